@@ -0,0 +1,167 @@
+import asyncio
+import re
+from collections import deque
+
+STATUS = "status"
+TOKEN = "token"
+
+
+class AdmissionRejected(Exception):
+    """Raised when the wait queue for the LLM is full."""
+
+
+def normalize_question(text):
+    """Collapses case, whitespace and trailing punctuation so trivially different repeats match."""
+    return re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!. ")
+
+
+def _notify(event):
+    event.set()
+    return asyncio.Event()
+
+
+class Ticket:
+    """A place in the admission queue. Holds an LLM slot once admitted."""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._changed = asyncio.Event()
+        self.admitted = False
+        self.released = False
+
+    @property
+    def position(self):
+        return self._controller.position(self)
+
+    async def wait(self, timeout):
+        """Waits until the ticket is admitted or its queue position changes."""
+        await asyncio.wait_for(self._changed.wait(), timeout)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller.release(self)
+
+
+class AdmissionController:
+    """
+    Limits how many generations run against Ollama at once. Requests beyond
+    max_in_flight wait in a bounded FIFO queue and can observe their position;
+    when the queue is full new requests are rejected instead of piling up.
+    Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, max_in_flight=2, max_queue=32):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queue = deque()
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    @property
+    def full(self):
+        return self.in_flight >= self.max_in_flight and len(self._queue) >= self.max_queue
+
+    def enqueue(self):
+        ticket = Ticket(self)
+        if self.in_flight < self.max_in_flight and not self._queue:
+            self._admit(ticket)
+        elif len(self._queue) >= self.max_queue:
+            raise AdmissionRejected(f"{len(self._queue)} requests are already waiting")
+        else:
+            self._queue.append(ticket)
+        return ticket
+
+    def position(self, ticket):
+        if ticket.admitted:
+            return 0
+        try:
+            return self._queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def release(self, ticket):
+        if ticket.admitted:
+            self.in_flight -= 1
+        elif ticket in self._queue:
+            self._queue.remove(ticket)
+        while self._queue and self.in_flight < self.max_in_flight:
+            self._admit(self._queue.popleft())
+        # Everyone still waiting moved up a place.
+        for waiting in self._queue:
+            waiting._changed = _notify(waiting._changed)
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        self.in_flight += 1
+        ticket._changed = _notify(ticket._changed)
+
+
+class SharedGeneration:
+    """
+    The output of one generation, fanned out to every stream that asked the
+    same question. Late subscribers get a replay of what was already produced.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+
+    def publish(self, text, kind=TOKEN):
+        self.events.append((kind, text))
+        self._changed = _notify(self._changed)
+
+    def finish(self):
+        self.done = True
+        self._changed = _notify(self._changed)
+
+    @property
+    def text(self):
+        return "".join(text for kind, text in self.events if kind == TOKEN)
+
+    async def stream(self):
+        self.subscribers += 1
+        position = 0
+        while True:
+            while position < len(self.events):
+                yield self.events[position][1]
+                position += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class GenerationCoalescer:
+    """Runs at most one generation per normalized question at a time."""
+
+    def __init__(self):
+        self._in_flight = {}
+
+    def get(self, key):
+        return self._in_flight.get(key)
+
+    def start(self, key, produce):
+        """
+        Starts produce(generation) as a background task, so the generation
+        keeps going for the other subscribers if the first client disconnects.
+        """
+        generation = SharedGeneration()
+        self._in_flight[key] = generation
+
+        async def run():
+            try:
+                await produce(generation)
+            except Exception as e:
+                print(f"ERROR: Generation for '{key}' failed: {e!r}")
+            finally:
+                generation.finish()
+                if self._in_flight.get(key) is generation:
+                    del self._in_flight[key]
+
+        generation.task = asyncio.create_task(run())
+        return generation
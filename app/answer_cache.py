@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    embedding: np.ndarray
+    created: float
+
+
+class AnswerCache:
+    """
+    Two-level cache of generated answers. An exact hit on the normalized
+    question is a dict lookup; otherwise the question's embedding is compared
+    against every cached question and the most similar one is used if it is
+    above similarity_threshold. Entries expire after ttl seconds, the least
+    recently used ones are evicted beyond max_entries, and the whole cache is
+    dropped when the knowledge base version changes.
+    """
+
+    def __init__(self, max_entries=512, ttl=6 * 3600, similarity_threshold=0.93):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.version = None
+        self._entries = OrderedDict()
+        self._matrix = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_version(self, version):
+        """Invalidates every answer built from an older version of the collection."""
+        if version != self.version:
+            if self._entries:
+                print(f"ANSWER CACHE: Knowledge base changed ({self.version} -> {version}); dropping {len(self._entries)} answers.")
+            self.version = version
+            self.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self._matrix = None
+
+    def get_exact(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.answer
+
+    def get_similar(self, embedding):
+        """Returns (answer, similarity) of the closest cached question above the threshold."""
+        if not self._entries:
+            return None, 0.0
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[key].embedding for key in self._keys])
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None, float(similarities[best])
+        answer = self.get_exact(self._keys[best])
+        return answer, float(similarities[best])
+
+    def put(self, key, embedding, answer):
+        self._entries[key] = CachedAnswer(answer=answer, embedding=embedding, created=time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._matrix = None
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+
+class Backend:
+    """
+    A lazily connected external service (Ollama, Chroma). connect() builds a
+    client and must prove the service answers; check(client) is a cheap health
+    check. get() hands out the client, connecting on first use. After a failed
+    connect or health check (or a failure reported by a caller) the backend
+    reconnects with exponential backoff, so a service that comes up late or
+    restarts is picked up again without restarting the API.
+    """
+
+    def __init__(self, name, connect, check, connect_timeout=10.0, min_backoff=1.0, max_backoff=60.0):
+        self.name = name
+        self._connect = connect
+        self._check = check
+        self.connect_timeout = connect_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.client = None
+        self.healthy = False
+        self.last_error = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.checked_at = None
+        self._lock = asyncio.Lock()
+
+    def _failed(self, error):
+        self.healthy = False
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.failures += 1
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+        self.retry_at = time.monotonic() + delay
+        print(f"BACKENDS: {self.name} unavailable ({self.last_error}); retrying in {delay:.0f}s.")
+
+    def _succeeded(self):
+        if not self.healthy:
+            print(f"BACKENDS: {self.name} is up.")
+        self.healthy = True
+        self.last_error = None
+        self.failures = 0
+        self.checked_at = time.monotonic()
+
+    async def get(self):
+        """Returns the client, or None while the service is down and its next retry isn't due."""
+        if self.healthy:
+            return self.client
+        if time.monotonic() < self.retry_at:
+            return None
+        async with self._lock:
+            if not self.healthy and time.monotonic() >= self.retry_at:
+                try:
+                    async with asyncio.timeout(self.connect_timeout):
+                        self.client = await self._connect()
+                    self._succeeded()
+                except Exception as e:
+                    self._failed(e)
+        return self.client if self.healthy else None
+
+    async def check(self):
+        """Health-checks a connected backend, or retries the connection when one is due."""
+        if not self.healthy:
+            return await self.get() is not None
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                await self._check(self.client)
+            self._succeeded()
+        except Exception as e:
+            self._failed(e)
+        return self.healthy
+
+    def report_failure(self, error):
+        """
+        Called when a request to the service failed. The next get() reconnects
+        right away; only failing reconnects back off.
+        """
+        if self.healthy:
+            self.healthy = False
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.retry_at = 0.0
+            print(f"BACKENDS: {self.name} request failed ({self.last_error}); reconnecting.")
+
+    def status(self):
+        return {
+            "ready": self.healthy,
+            "error": self.last_error,
+            "retry_in": None if self.healthy else max(0.0, round(self.retry_at - time.monotonic(), 1)),
+            "checked_ago": None if self.checked_at is None else round(time.monotonic() - self.checked_at, 1),
+        }
+
+
+async def monitor(backends, interval):
+    """Health-checks every backend each interval seconds (reconnecting those that are down)."""
+    while True:
+        await asyncio.gather(*(backend.check() for backend in backends))
+        await asyncio.sleep(interval)
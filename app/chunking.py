@@ -0,0 +1,316 @@
+import ast
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+
+# Bump whenever chunk boundaries or chunk metadata change: ingest.py then
+# re-ingests every repo from scratch instead of only the changed files.
+CHUNKER_VERSION = 2
+
+CODE_LANGUAGES = ("c", "python", "make")
+_EXTENSIONS = {".c": "c", ".h": "c", ".py": "python", ".mk": "make", ".md": "markdown", ".txt": "text"}
+_MAKEFILES = ("Makefile", "makefile", "GNUmakefile")
+_SPLITTER_LANGUAGES = {"c": Language.C, "python": Language.PYTHON, "markdown": Language.MARKDOWN}
+
+
+def detect_language(path):
+    """The chunker language of a file, or None for anything without one."""
+    name = os.path.basename(path)
+    if name in _MAKEFILES:
+        return "make"
+    return _EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+
+@dataclass
+class Unit:
+    """A piece of a file that should not be split: a function, a struct, a Make rule, a section."""
+    text: str
+    symbols: list = field(default_factory=list)
+    section: Optional[str] = None
+
+
+# --- C ---
+_C_STRING = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+_C_FUNCTION = re.compile(r"\b([A-Za-z_]\w*)\s*\([^;{}]*\)\s*(?:__attribute__\s*\(\(.*?\)\)\s*)?$", re.S)
+_C_TAG = re.compile(r"\b(?:struct|union|enum)\s+([A-Za-z_]\w*)\s*$")
+_C_TYPEDEF_NAME = re.compile(r"}\s*([A-Za-z_]\w*)\s*;")
+_C_PROTOTYPE = re.compile(r"\b([A-Za-z_]\w*)\s*\([^;{}]*\)\s*;")
+_C_DEFINE = re.compile(r"^\s*#\s*define\s+([A-Za-z_]\w*)", re.M)
+_C_KEYWORDS = {"if", "for", "while", "switch", "return", "sizeof", "defined"}
+
+
+def _c_strip_line(line, in_comment):
+    """The code of a line without string literals and comments; returns (code, still inside a /* comment)."""
+    code = []
+    rest = line
+    while rest:
+        if in_comment:
+            end = rest.find("*/")
+            if end < 0:
+                return "".join(code), True
+            rest, in_comment = rest[end + 2:], False
+            continue
+        rest = _C_STRING.sub('""', rest)
+        starts = [i for i in (rest.find("/*"), rest.find("//")) if i >= 0]
+        if not starts:
+            code.append(rest)
+            break
+        start = min(starts)
+        code.append(rest[:start])
+        if rest.startswith("//", start):
+            break
+        rest, in_comment = rest[start + 2:], True
+    return "".join(code), in_comment
+
+
+def _c_symbols(top_level, text):
+    """Names defined by a C unit, given its code outside braces."""
+    symbols = []
+    # Each "{" at depth 0 opens a function body or a struct/union/enum definition.
+    for header in top_level.split("{")[:-1]:
+        header = header.rsplit(";", 1)[-1].rsplit("}", 1)[-1].strip()
+        match = _C_FUNCTION.search(header) or _C_TAG.search(header)
+        if match and match.group(1) not in _C_KEYWORDS:
+            symbols.append(match.group(1))
+    symbols += _C_TYPEDEF_NAME.findall(top_level)
+    symbols += [name for name in _C_PROTOTYPE.findall(top_level) if name not in _C_KEYWORDS]
+    symbols += _C_DEFINE.findall(text)
+    return symbols
+
+
+def c_units(text):
+    """
+    Splits C source into top-level items: a unit ends where a function or
+    type definition closes or at a blank line between declarations.
+    """
+    units = []
+    lines, top_level = [], []
+    depth, in_comment = 0, False
+
+    def close():
+        if any(line.strip() for line in lines):
+            unit_text = "".join(lines).strip("\n")
+            units.append(Unit(unit_text, _c_symbols("".join(top_level), unit_text)))
+        lines.clear()
+        top_level.clear()
+
+    for line in text.splitlines(keepends=True):
+        if depth == 0 and not line.strip() and not in_comment:
+            close()
+            continue
+        lines.append(line)
+        code, in_comment = _c_strip_line(line, in_comment)
+        if code.lstrip().startswith("#"):
+            continue
+        closed = False
+        for char in code:
+            if char == "{":
+                if depth == 0:
+                    top_level.append("{")
+                depth += 1
+            elif char == "}":
+                depth = max(depth - 1, 0)
+                if depth == 0:
+                    top_level.append("}")
+                    closed = True
+            elif depth == 0:
+                top_level.append(char)
+        if depth == 0:
+            top_level.append("\n")
+            if closed:
+                close()
+    close()
+    return units
+
+
+# --- Python ---
+def python_units(text):
+    """Splits Python source on top-level functions and classes; None if it doesn't parse."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    lines = text.splitlines(keepends=True)
+    units, position, pending = [], 0, []
+
+    def add(start, end, symbols):
+        unit_text = "".join(lines[start:end]).strip("\n")
+        if unit_text.strip():
+            units.append(Unit(unit_text, symbols))
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+            # Comments directly above a definition belong to it.
+            while start > position and lines[start - 1].lstrip().startswith("#"):
+                start -= 1
+            add(position, start, pending)
+            symbols = [node.name]
+            if isinstance(node, ast.ClassDef):
+                symbols += [item.name for item in node.body
+                            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            add(start, node.end_lineno, symbols)
+            position, pending = node.end_lineno, []
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            pending += [target.id for target in targets if isinstance(target, ast.Name)]
+    add(position, len(lines), pending)
+    return units
+
+
+# --- Make ---
+_MAKE_TARGET = re.compile(r"^([^\s#=:][^=:]*?)\s*::?(?!=)")
+_MAKE_VARIABLE = re.compile(r"^(?:export\s+|override\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*(?:[:+?!]|::)?=")
+
+
+def make_units(text):
+    """Splits a Makefile into rules (a target line and its recipe) and blocks of variables."""
+    units, lines, symbols = [], [], []
+
+    def close():
+        block = "".join(lines).strip("\n")
+        if units and not symbols and all(line.lstrip().startswith("#") for line in lines):
+            # A comment block on its own stays with the rule above it.
+            units[-1].text += "\n\n" + block
+        elif block.strip():
+            units.append(Unit(block, list(symbols)))
+        lines.clear()
+        symbols.clear()
+
+    for line in text.splitlines(keepends=True):
+        if line.startswith("\t") or (lines and lines[-1].rstrip("\n").endswith("\\")):
+            lines.append(line)
+            continue
+        if not line.strip():
+            close()
+            continue
+        variable = _MAKE_VARIABLE.match(line)
+        target = None if variable else _MAKE_TARGET.match(line)
+        if target:
+            # A new rule starts a new unit, keeping the comments just above it.
+            if any(not l.lstrip().startswith("#") for l in lines):
+                close()
+            symbols += [name for name in target.group(1).split() if not name.startswith(".")]
+        elif variable:
+            symbols.append(variable.group(1))
+        lines.append(line)
+    close()
+    return units
+
+
+# --- Markdown ---
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def markdown_units(text):
+    """Splits Markdown on headings (outside code blocks); each unit carries its heading path."""
+    units, lines, headings = [], [], []
+    fence = None
+
+    def close():
+        if any(line.strip() for line in lines):
+            units.append(Unit("".join(lines).strip("\n"), section=" > ".join(title for _, title in headings) or None))
+        lines.clear()
+
+    for line in text.splitlines(keepends=True):
+        match = _FENCE.match(line)
+        if match:
+            fence = None if fence == match.group(1) else fence or match.group(1)
+        heading = None if fence or match else _HEADING.match(line)
+        if heading:
+            close()
+            level = len(heading.group(1))
+            headings = [(l, title) for l, title in headings if l < level] + [(level, heading.group(2))]
+        lines.append(line)
+    close()
+    return units
+
+
+_UNIT_SPLITTERS = {"c": c_units, "python": python_units, "make": make_units, "markdown": markdown_units}
+
+
+# --- Packing ---
+_splitters = {}
+
+def _splitter(language, chunk_size, chunk_overlap):
+    key = (language, chunk_size, chunk_overlap)
+    if key not in _splitters:
+        if language in _SPLITTER_LANGUAGES:
+            _splitters[key] = RecursiveCharacterTextSplitter.from_language(
+                _SPLITTER_LANGUAGES[language], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        else:
+            _splitters[key] = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return _splitters[key]
+
+
+def _metadata(language, symbols, section):
+    metadata = {"language": language, "kind": "code" if language in CODE_LANGUAGES else "docs"}
+    symbols = list(dict.fromkeys(symbols))
+    if symbols:
+        metadata["symbols"] = ",".join(symbols)
+    if section:
+        metadata["section"] = section
+    return metadata
+
+
+def pack_units(units, language, chunk_size, chunk_overlap):
+    """
+    Packs consecutive units into chunks of up to chunk_size characters. A
+    unit too large for one chunk is cut by the language's recursive splitter;
+    its pieces keep the unit's first symbol (the function or class they are
+    part of) and, for Markdown, repeat the section heading.
+    Returns (texts, metadatas).
+    """
+    texts, metadatas = [], []
+    current, symbols, section = [], [], None
+
+    def flush():
+        if current:
+            texts.append("\n\n".join(current))
+            metadatas.append(_metadata(language, symbols, section))
+        current.clear()
+        symbols.clear()
+
+    for unit in units:
+        if len(unit.text) > chunk_size:
+            flush()
+            heading = unit.text.split("\n", 1)[0] if language == "markdown" and unit.section else None
+            pieces = _splitter(language, chunk_size, chunk_overlap).split_text(unit.text)
+            for i, piece in enumerate(pieces):
+                if heading and piece.strip() == heading.strip() and len(pieces) > 1:
+                    continue
+                if heading and i and not piece.startswith(heading):
+                    piece = f"{heading}\n{piece}"
+                piece_symbols = unit.symbols[:1] + [s for s in unit.symbols[1:] if s in piece]
+                texts.append(piece)
+                metadatas.append(_metadata(language, piece_symbols, unit.section))
+            continue
+        if current and sum(map(len, current)) + 2 * len(current) + len(unit.text) > chunk_size:
+            flush()
+        if not current:
+            section = unit.section
+        current.append(unit.text)
+        symbols.extend(unit.symbols)
+    flush()
+    return texts, metadatas
+
+
+def split_document(text, path, chunk_size, chunk_overlap):
+    """
+    Splits a file along its syntax (C and Python definitions, Make rules,
+    Markdown sections) and returns (texts, metadatas), one metadata dict of
+    language, kind, symbols and section per chunk. Text without a known
+    language (docs pages, Telegram windows) gets the plain recursive splitter
+    and no chunk metadata.
+    """
+    language = detect_language(path) if path is not None else None
+    units = _UNIT_SPLITTERS[language](text) if language in _UNIT_SPLITTERS else None
+    if units is not None:
+        return pack_units(units, language, chunk_size, chunk_overlap)
+    texts = _splitter(language, chunk_size, chunk_overlap).split_text(text)
+    metadata = _metadata(language, [], None) if language else {}
+    return texts, [dict(metadata) for _ in texts]
@@ -26,3 +26,101 @@ PHONE = os.environ.get("TELEGRAM_PHONE")
 
 # Define session path consistently
 SESSION_PATH = "data/session"
+
+# --- Database ---
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/telegramdb")
+# Rows per multi-row INSERT when saving scraped messages.
+SCRAPE_INSERT_BATCH_SIZE = int(os.environ.get("SCRAPE_INSERT_BATCH_SIZE", 1000))
+
+# --- Telegram Scraping ---
+# Messages written (and watermarks advanced) per batch while a scrape streams in.
+SCRAPE_FETCH_BATCH_SIZE = int(os.environ.get("SCRAPE_FETCH_BATCH_SIZE", 500))
+# FloodWaits up to this many seconds are slept through inside Telethon.
+SCRAPE_FLOOD_SLEEP_THRESHOLD = int(os.environ.get("SCRAPE_FLOOD_SLEEP_THRESHOLD", 60))
+# Longer FloodWaits up to this are waited out by the scrape; beyond it the scrape stops and can be resumed.
+SCRAPE_MAX_FLOOD_WAIT = int(os.environ.get("SCRAPE_MAX_FLOOD_WAIT", 900))
+# How long resolved chat entities (and the dialog list behind /chats) are cached.
+ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", 3600))
+
+# --- Scrape Worker ---
+# Fallback poll interval; new jobs normally wake the worker through LISTEN/NOTIFY.
+SCRAPE_WORKER_POLL_INTERVAL = float(os.environ.get("SCRAPE_WORKER_POLL_INTERVAL", 5))
+# Running jobs without a heartbeat for this long are requeued.
+SCRAPE_JOB_STALE_SECONDS = float(os.environ.get("SCRAPE_JOB_STALE_SECONDS", 120))
+SCRAPE_JOB_HEARTBEAT_SECONDS = float(os.environ.get("SCRAPE_JOB_HEARTBEAT_SECONDS", 30))
+# Failed attempts (other than FloodWaits) before a job is marked failed.
+SCRAPE_JOB_MAX_ATTEMPTS = int(os.environ.get("SCRAPE_JOB_MAX_ATTEMPTS", 3))
+
+# --- Retrieval ---
+# Written by ingest.py on the host and mounted into the API container.
+LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "data/index/lexical.npz")
+# In-process vector search over a memory-mapped snapshot exported by ingest.py.
+# Set VECTOR_BACKEND=chroma to always query the Chroma server instead.
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "snapshot")
+VECTOR_SNAPSHOT_DIR = os.environ.get("VECTOR_SNAPSHOT_DIR", "data/index/vectors")
+VECTOR_SNAPSHOT_DTYPE = os.environ.get("VECTOR_SNAPSHOT_DTYPE", "int8")
+# Candidates fetched per question; the context stage picks the prompt's chunks from these.
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", 20))
+# Symbol lookups search only code and "how do I" questions search docs first; 0 searches everything.
+QUERY_ROUTING = os.environ.get("QUERY_ROUTING", "1") != "0"
+# A routed search that finds fewer chunks than this is topped up from the whole knowledge base.
+ROUTE_MIN_RESULTS = int(os.environ.get("ROUTE_MIN_RESULTS", 3))
+
+# --- Context Packing ---
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+CONTEXT_MAX_CHUNKS = int(os.environ.get("CONTEXT_MAX_CHUNKS", 7))
+# 1.0 ranks purely by relevance; lower values favour chunks unlike those already picked.
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", 0.7))
+# Chunks at least this similar to an already picked chunk are dropped as duplicates.
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", 0.95))
+
+# --- Backends ---
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://host.docker.internal:11434")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3:8b-instruct-q4_K_M")
+# How long Ollama keeps the model loaded after a request: a duration such as
+# "30m", or a number of seconds where a negative number keeps it loaded for good.
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "-1")
+if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "chroma")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", 8000))
+# Health check interval, and the limits for connecting and for the reconnect backoff.
+BACKEND_CHECK_INTERVAL = float(os.environ.get("BACKEND_CHECK_INTERVAL", 15))
+BACKEND_CONNECT_TIMEOUT = float(os.environ.get("BACKEND_CONNECT_TIMEOUT", 10))
+BACKEND_MAX_BACKOFF = float(os.environ.get("BACKEND_MAX_BACKOFF", 60))
+
+# --- Metrics ---
+# Requests slower than TRACE_SLOW_SECONDS have their per-stage trace appended
+# to TRACE_LOG_PATH, keeping a TRACE_SAMPLE_RATE fraction of them.
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "data/traces/slow_requests.jsonl")
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", 20))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.25))
+# Written by ingest.py next to the indexes and included in the API's /metrics.
+INGEST_METRICS_PATH = os.environ.get("INGEST_METRICS_PATH", "data/index/ingest.prom")
+
+# --- LLM Admission Control ---
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 2))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", 32))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 120))
+LLM_GENERATION_TIMEOUT = float(os.environ.get("LLM_GENERATION_TIMEOUT", 300))
+
+# --- Answer Cache ---
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 6 * 3600))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.93))
+# How often the API re-reads the collection's ingest version stamp.
+COLLECTION_VERSION_TTL = float(os.environ.get("COLLECTION_VERSION_TTL", 15))
+# How long /admin/stats and meta questions reuse the vector count and per-chat aggregates.
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", 10))
+
+# --- Chat Sessions ---
+# Sessions kept in memory; the rest are re-read from Postgres when they come back.
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 1024))
+# Turns replayed into the prompt; beyond this the window drops to the newest half.
+SESSION_HISTORY_TURNS = int(os.environ.get("SESSION_HISTORY_TURNS", 6))
+# Replayed answers are cut to this many characters.
+SESSION_ANSWER_CHARS = int(os.environ.get("SESSION_ANSWER_CHARS", 1500))
+# A question at least this similar to the one the session's context was retrieved for reuses that context.
+SESSION_TOPIC_SIMILARITY = float(os.environ.get("SESSION_TOPIC_SIMILARITY", 0.8))
+# Sessions idle for longer than this (seconds) are deleted.
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 30 * 86400))
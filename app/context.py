@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+def estimate_tokens(text):
+    """Rough Llama-style token count (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class ContextChunk:
+    id: str
+    text: str
+    metadata: dict
+    score: float
+    embedding: Optional[np.ndarray] = None
+
+
+def _unit(vector):
+    if vector is None:
+        return None
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def select_diverse(chunks, limit, mmr_lambda=0.7, duplicate_threshold=0.95):
+    """
+    Maximal marginal relevance: repeatedly picks the chunk with the best
+    trade-off between its retrieval score and its similarity to chunks that
+    are already picked. Near-duplicates (copies of the same file in another
+    repo) are dropped outright. Returns (selected, number dropped as duplicates).
+    """
+    remaining = list(chunks)
+    top_score = max((c.score for c in remaining), default=1.0) or 1.0
+    selected, duplicates = [], 0
+    while remaining and len(selected) < limit:
+        best, best_value = None, None
+        for chunk in list(remaining):
+            redundancy = 0.0
+            if chunk.embedding is not None:
+                for other in selected:
+                    if other.embedding is not None:
+                        redundancy = max(redundancy, float(chunk.embedding @ other.embedding))
+            if redundancy >= duplicate_threshold:
+                remaining.remove(chunk)
+                duplicates += 1
+                continue
+            value = mmr_lambda * chunk.score / top_score - (1 - mmr_lambda) * redundancy
+            if best is None or value > best_value:
+                best, best_value = chunk, value
+        if best is None:
+            break
+        remaining.remove(best)
+        selected.append(best)
+    return selected, duplicates
+
+
+def _join_overlapping(first, second, max_overlap=400):
+    """Concatenates neighbouring chunks, dropping the text the splitter repeated in both."""
+    for size in range(min(max_overlap, len(first), len(second)), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def merge_adjacent(chunks):
+    """
+    Merges chunks that are consecutive pieces of the same source into one
+    block, placed where the best-ranked of them was. Returns (blocks, merges).
+    """
+    by_source = {}
+    for chunk in chunks:
+        key = (chunk.metadata or {}).get("source_key")
+        if key is not None and (chunk.metadata or {}).get("chunk_index") is not None:
+            by_source.setdefault(key, []).append(chunk)
+
+    absorbed, merges = set(), 0
+    merged_text = {}
+    for group in by_source.values():
+        group.sort(key=lambda c: c.metadata["chunk_index"])
+        run = [group[0]]
+        for chunk in group[1:] + [None]:
+            if chunk is not None and chunk.metadata["chunk_index"] == run[-1].metadata["chunk_index"] + 1:
+                run.append(chunk)
+                continue
+            if len(run) > 1:
+                head = max(run, key=lambda c: c.score)
+                text = run[0].text
+                for part in run[1:]:
+                    text = _join_overlapping(text, part.text)
+                merged_text[head.id] = text
+                absorbed.update(c.id for c in run if c is not head)
+                merges += len(run) - 1
+            run = [chunk]
+
+    blocks = []
+    for chunk in chunks:
+        if chunk.id in absorbed:
+            continue
+        blocks.append(ContextChunk(chunk.id, merged_text.get(chunk.id, chunk.text), chunk.metadata,
+                                   chunk.score, chunk.embedding))
+    return blocks, merges
+
+
+def pack_context(results, token_budget=1500, max_chunks=7, mmr_lambda=0.7, duplicate_threshold=0.95,
+                 separator="\n---\n"):
+    """
+    Turns over-fetched retrieval results into the context block of the prompt:
+    diverse chunks only, neighbours merged, and packed into token_budget.
+    Returns (context_text, report); the report compares the token count with
+    what joining the top max_chunks raw results would have cost.
+    """
+    chunks = [
+        ContextChunk(cid, text, metadata or {}, score, _unit(embedding))
+        for cid, text, metadata, score, embedding in zip(
+            results["ids"], results["documents"], results["metadatas"], results["scores"], results["embeddings"]
+        )
+        if text
+    ]
+    naive_tokens = estimate_tokens(separator.join(c.text for c in chunks[:max_chunks]))
+
+    selected, duplicates = select_diverse(chunks, max_chunks, mmr_lambda, duplicate_threshold)
+    blocks, merges = merge_adjacent(selected)
+
+    packed, used = [], 0
+    for block in blocks:
+        cost = estimate_tokens(block.text) + estimate_tokens(separator)
+        if used + cost > token_budget:
+            continue
+        packed.append(block.text)
+        used += cost
+
+    context = separator.join(packed)
+    tokens = estimate_tokens(context)
+    return context, {
+        "candidates": len(chunks),
+        "chunks": len(packed),
+        "duplicates_dropped": duplicates,
+        "chunks_merged": merges,
+        "tokens": tokens,
+        "naive_tokens": naive_tokens,
+        "tokens_saved": naive_tokens - tokens,
+    }
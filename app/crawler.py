@@ -0,0 +1,241 @@
+import hashlib
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from app.metrics import INGEST_STAGE_SECONDS
+from app.state import load_json_state, save_json_state
+
+USER_AGENT = "openipc-rag-pipeline/1.0 (+https://github.com/mikecarr/openipc-rag-pipeline)"
+# Responses that mean a page is really gone; any other failure may be temporary.
+GONE_STATUSES = (404, 410)
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    title: str
+    text: str
+    links: list = field(default_factory=list)
+    etag: str = None
+    last_modified: str = None
+    not_modified: bool = False
+
+    @property
+    def text_hash(self):
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest()
+
+
+class PageCache:
+    """
+    On-disk cache of crawled pages keyed by URL. It stores the HTTP validators
+    (ETag/Last-Modified) used for conditional requests, a hash of the extracted
+    text to detect real content changes, and the page's links so a 304 response
+    doesn't cut off discovery of the pages behind it.
+    """
+
+    def __init__(self, path, save_every=100):
+        self.path = path
+        self.save_every = save_every
+        self.entries = load_json_state(path)
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def validators(self, url):
+        entry = self.entries.get(url)
+        if not entry:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def cached_links(self, url):
+        return self.entries.get(url, {}).get("links", [])
+
+    def has_changed(self, page):
+        if page.not_modified:
+            return False
+        return self.entries.get(page.url, {}).get("text_hash") != page.text_hash
+
+    def update(self, page):
+        """Records a page once its chunks are safely in the vector store."""
+        if page.not_modified:
+            return
+        with self._lock:
+            self.entries[page.url] = {
+                "etag": page.etag,
+                "last_modified": page.last_modified,
+                "text_hash": page.text_hash,
+                "links": page.links,
+            }
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def forget(self, url):
+        with self._lock:
+            self.entries.pop(url, None)
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        save_json_state(self.path, self.entries)
+        self._unsaved = 0
+
+
+def normalize_url(url):
+    """Drops fragments and query strings so the same page is only crawled once."""
+    return url.split('#')[0].split('?')[0]
+
+
+def parse_page(url, content):
+    """Extracts the title, visible text and same-host links from a fetched HTML page."""
+    soup = BeautifulSoup(content, "html.parser")
+
+    domain_name = urlparse(url).netloc
+    links = []
+    for a_tag in soup.find_all("a"):
+        href = a_tag.attrs.get("href")
+        if href == "" or href is None:
+            continue
+        href = normalize_url(urljoin(url, href))
+        if urlparse(href).netloc == domain_name:
+            links.append(href)
+
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    text = soup.get_text(separator="\n", strip=True)
+    return CrawledPage(url=url, title=title, text=text, links=links)
+
+
+class SiteCrawler:
+    """
+    Breadth-first crawler that fetches pages concurrently over a shared
+    connection pool. Each page is downloaded exactly once; its text and links
+    are parsed from those bytes and handed to the caller as a CrawledPage.
+    With a PageCache, pages are revalidated with conditional requests and an
+    unchanged page comes back as not_modified without being downloaded.
+    A page that could not be fetched (timeout, 5xx, ...) is recorded in
+    failed_urls rather than treated as removed, and the links it had last
+    time are still followed.
+    """
+
+    def __init__(self, max_workers=8, per_host_limit=4, max_pages=5000, timeout=10, cache=None):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.cache = cache
+        self.pages_discovered = 0
+        self.crawled_urls = set()
+        # Pages that answered 404/410, and pages that failed in a way that may be temporary.
+        self.gone_urls = set()
+        self.failed_urls = set()
+        self._lock = threading.Lock()
+        # Set when max_pages cut the crawl short, i.e. crawled_urls is not the whole site.
+        self.truncated = False
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url):
+        with INGEST_STAGE_SECONDS.time(stage="crawl", source_type="docs"):
+            return self._fetch(url)
+
+    def _fetch(self, url):
+        headers = self.cache.validators(url) if self.cache else {}
+        try:
+            response = self.session.get(url, timeout=self.timeout, headers=headers)
+            if response.status_code == 304 and self.cache:
+                return CrawledPage(url=url, title="", text="", links=self.cache.cached_links(url), not_modified=True)
+            if response.status_code in GONE_STATUSES:
+                print(f"  {url} is gone ({response.status_code}).")
+                with self._lock:
+                    self.gone_urls.add(url)
+                return None
+            response.raise_for_status()
+            if "html" not in response.headers.get("Content-Type", "text/html"):
+                return None
+            page = parse_page(url, response.content)
+            page.etag = response.headers.get("ETag")
+            page.last_modified = response.headers.get("Last-Modified")
+            return page
+        except Exception as e:
+            print(f"  Could not discover links on {url}: {e}")
+            with self._lock:
+                self.failed_urls.add(url)
+            return None
+
+    @property
+    def failure_rate(self):
+        """The share of fetched pages that failed in a way that may be temporary."""
+        attempted = len(self.crawled_urls) + len(self.gone_urls) + len(self.failed_urls)
+        return len(self.failed_urls) / attempted if attempted else 0.0
+
+    def crawl(self, start_urls):
+        """
+        Yields a CrawledPage for every reachable page under start_urls.
+
+        The frontier is kept per host and capped at max_pages discovered URLs,
+        and no host ever has more than per_host_limit requests in flight.
+        """
+        frontier = {}
+        seen = set()
+
+        def enqueue(url):
+            if url in seen:
+                return
+            if len(seen) >= self.max_pages:
+                self.truncated = True
+                return
+            seen.add(url)
+            frontier.setdefault(urlparse(url).netloc, deque()).append(url)
+
+        for url in start_urls:
+            enqueue(normalize_url(url))
+
+        in_flight = {}
+        active = Counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                for host, queue in frontier.items():
+                    while queue and active[host] < self.per_host_limit and len(in_flight) < self.max_workers:
+                        url = queue.popleft()
+                        in_flight[pool.submit(self.fetch, url)] = (host, url)
+                        active[host] += 1
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host, url = in_flight.pop(future)
+                    active[host] -= 1
+                    page = future.result()
+                    if page is None:
+                        # Pages behind a failed one are still reached through its cached links.
+                        if url in self.failed_urls and self.cache:
+                            for link in self.cache.cached_links(url):
+                                enqueue(link)
+                        continue
+                    for link in page.links:
+                        enqueue(link)
+                    self.crawled_urls.add(page.url)
+                    yield page
+
+        self.pages_discovered = len(seen)
@@ -0,0 +1,273 @@
+import base64
+import binascii
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import sqlalchemy
+from databases import Database
+
+from app.config import DATABASE_URL, SCRAPE_INSERT_BATCH_SIZE
+
+SCHEMA_LOCK_ID = 7342001
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "init.sql")
+
+database = Database(DATABASE_URL)
+metadata = sqlalchemy.MetaData()
+messages_table = sqlalchemy.Table(
+    "messages",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("chat_id", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("sender_id", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("date", sqlalchemy.DateTime(timezone=True), nullable=False),
+    sqlalchemy.Column("text", sqlalchemy.Text, nullable=True),
+    sqlalchemy.Column("media", sqlalchemy.JSON, nullable=True),
+)
+scrape_progress_table = sqlalchemy.Table(
+    "scrape_progress",
+    metadata,
+    sqlalchemy.Column("chat_id", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("newest_id", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("oldest_id", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("backfill_complete", sqlalchemy.Boolean, nullable=False),
+    sqlalchemy.Column("updated_at", sqlalchemy.DateTime(timezone=True), nullable=False),
+)
+
+# One statement per batch: every column is bound as a single array, so the SQL
+# text is constant (no per-row compilation) and there is no bind parameter limit.
+INSERT_MESSAGES = """
+    INSERT INTO messages (id, chat_id, sender_id, date, text, media)
+    SELECT * FROM unnest(
+        CAST(:ids AS BIGINT[]), CAST(:chat_ids AS BIGINT[]), CAST(:sender_ids AS BIGINT[]),
+        CAST(:dates AS TIMESTAMPTZ[]), CAST(:texts AS TEXT[]), CAST(:media AS JSONB[])
+    )
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+"""
+
+# Watermarks only ever widen, so a batch committed late can't move them backwards.
+UPDATE_WATERMARKS = """
+    INSERT INTO scrape_progress (chat_id, newest_id, oldest_id, backfill_complete)
+    VALUES (:chat_id, :newest_id, :oldest_id, :backfill_complete)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        newest_id = GREATEST(scrape_progress.newest_id, EXCLUDED.newest_id),
+        oldest_id = LEAST(scrape_progress.oldest_id, EXCLUDED.oldest_id),
+        backfill_complete = scrape_progress.backfill_complete OR EXCLUDED.backfill_complete,
+        updated_at = now()
+"""
+
+
+async def apply_schema():
+    """Runs db/init.sql (idempotent), so tables added after the volume was created exist too."""
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        schema = f.read()
+    # The script runs as one transaction; the advisory lock keeps several API
+    # processes starting at once from racing on the same CREATE statements.
+    async with database.connection() as connection:
+        await connection.raw_connection.execute(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_ID});\n{schema}")
+
+
+def message_row(message, chat_id):
+    """Turns a scraped message dict into a messages row, or None if it can't be stored."""
+    if message.get("sender_id") is None or not message.get("date"):
+        return None
+    date = message["date"]
+    return {
+        "id": message["id"],
+        "chat_id": chat_id,
+        "sender_id": message["sender_id"],
+        "date": datetime.fromisoformat(date) if isinstance(date, str) else date,
+        "text": message["text"],
+        "media": json.dumps(message["media"]) if message["media"] is not None else None,
+    }
+
+
+async def save_messages(messages, chat_id, batch_size=SCRAPE_INSERT_BATCH_SIZE):
+    """
+    Inserts messages with multi-row INSERT ... ON CONFLICT DO NOTHING
+    statements of batch_size rows, all in one transaction. Returns a report
+    with the number of rows actually inserted (already stored messages and
+    messages without a sender or date are not counted).
+    """
+    batch_size = max(1, batch_size)
+    rows = [row for row in (message_row(m, chat_id) for m in messages) if row is not None]
+    started = time.monotonic()
+    inserted = 0
+    async with database.transaction():
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            inserted += len(await database.fetch_all(INSERT_MESSAGES, {
+                "ids": [row["id"] for row in batch],
+                "chat_ids": [row["chat_id"] for row in batch],
+                "sender_ids": [row["sender_id"] for row in batch],
+                "dates": [row["date"] for row in batch],
+                "texts": [row["text"] for row in batch],
+                "media": [row["media"] for row in batch],
+            }))
+    elapsed = time.monotonic() - started
+    return {
+        "inserted": inserted,
+        "duplicates": len(rows) - inserted,
+        "skipped": len(messages) - len(rows),
+        "seconds": elapsed,
+        "rows_per_second": len(rows) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+async def get_scrape_progress(chat_id):
+    """
+    Returns the chat's watermarks as a dict, or None if nothing was scraped
+    yet. Chats scraped before watermarks existed are seeded from the
+    messages already stored.
+    """
+    row = await database.fetch_one(
+        sqlalchemy.select(scrape_progress_table).where(scrape_progress_table.c.chat_id == chat_id)
+    )
+    if row is not None:
+        return dict(row._mapping)
+    bounds = await database.fetch_one(
+        sqlalchemy.select(
+            sqlalchemy.func.max(messages_table.c.id).label("newest_id"),
+            sqlalchemy.func.min(messages_table.c.id).label("oldest_id"),
+        ).where(messages_table.c.chat_id == chat_id)
+    )
+    if bounds is None or bounds["newest_id"] is None:
+        return None
+    await database.execute(UPDATE_WATERMARKS, {
+        "chat_id": chat_id, "newest_id": bounds["newest_id"], "oldest_id": bounds["oldest_id"],
+        "backfill_complete": False,
+    })
+    return await get_scrape_progress(chat_id)
+
+
+async def save_message_batch(messages, chat_id, backfill_complete=False):
+    """
+    Saves one scraped batch and widens the chat's watermarks to cover it in
+    the same transaction, so a scrape interrupted at any point resumes right
+    after the last batch that was stored.
+    """
+    async with database.transaction():
+        report = await save_messages(messages, chat_id)
+        if messages:
+            ids = [message["id"] for message in messages]
+            await database.execute(UPDATE_WATERMARKS, {
+                "chat_id": chat_id, "newest_id": max(ids), "oldest_id": min(ids),
+                "backfill_complete": backfill_complete,
+            })
+        elif backfill_complete:
+            await database.execute(
+                scrape_progress_table.update()
+                .where(scrape_progress_table.c.chat_id == chat_id)
+                .values(backfill_complete=True, updated_at=sqlalchemy.func.now())
+            )
+    return report
+
+
+async def save_telegram_chats(chats):
+    """Upserts the resolved TARGET_CHATS dialogs, given as dicts with chat_id, name, username and type."""
+    if not chats:
+        return
+    await database.execute_many("""
+        INSERT INTO telegram_chats (chat_id, name, username, type)
+        VALUES (:chat_id, :name, :username, :type)
+        ON CONFLICT (chat_id) DO UPDATE SET
+            name = EXCLUDED.name, username = EXCLUDED.username, type = EXCLUDED.type, updated_at = now()
+    """, chats)
+
+
+async def list_telegram_chats(names):
+    rows = await database.fetch_all(
+        "SELECT chat_id, name, username, type FROM telegram_chats WHERE name = ANY(:names) ORDER BY name",
+        {"names": list(names)},
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+async def fetch_chat_stats(chat_ids=None):
+    """Per-chat message counts and date bounds from the trigger-maintained chat_stats table."""
+    query = "SELECT chat_id, message_count, earliest, latest FROM chat_stats"
+    if chat_ids is not None:
+        rows = await database.fetch_all(query + " WHERE chat_id = ANY(:chat_ids)", {"chat_ids": list(chat_ids)})
+    else:
+        rows = await database.fetch_all(query + " ORDER BY message_count DESC")
+    return [dict(row._mapping) for row in rows]
+
+
+# Same character ranges as the search_vector expression in db/init.sql.
+CJK_RUN = re.compile("[぀-ヿ㐀-䶿一-鿿豈-﫿]+")
+
+
+def search_query_text(query):
+    """
+    Rewrites a websearch-style query for search_vector: runs of CJK characters
+    become quoted phrases of single-character tokens, the way they are indexed.
+    """
+    parts = query.split('"')
+    for i, part in enumerate(parts):
+        inside_quotes = i % 2 == 1
+        parts[i] = CJK_RUN.sub(
+            lambda m: " ".join(m.group()) if inside_quotes else f' "{" ".join(m.group())}" ', part
+        )
+    return '"'.join(parts)
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row['date'].isoformat()}|{row['id']}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (date, id) encoded by encode_cursor; raises ValueError for anything else."""
+    try:
+        date, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date), int(message_id)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+async def search_messages(query=None, chat_id=None, sender_id=None, date_from=None, date_to=None,
+                          cursor=None, limit=50):
+    """
+    Stored messages, newest first, optionally matching a full-text query and
+    filtered by chat, sender and date range [date_from, date_to). Pages are
+    keyset-paginated on (date, id): pass the returned next_cursor to get the
+    next page, which costs the same however deep it is. Returns
+    (messages, next_cursor), with next_cursor None on the last page.
+    """
+    conditions, values = [], {"limit": limit + 1}
+    if query:
+        conditions.append("search_vector @@ websearch_to_tsquery('simple', :query)")
+        values["query"] = search_query_text(query)
+    if chat_id is not None:
+        conditions.append("chat_id = :chat_id")
+        values["chat_id"] = chat_id
+    if sender_id is not None:
+        conditions.append("sender_id = :sender_id")
+        values["sender_id"] = sender_id
+    if date_from is not None:
+        conditions.append("date >= :date_from")
+        values["date_from"] = date_from
+    if date_to is not None:
+        conditions.append("date < :date_to")
+        values["date_to"] = date_to
+    if cursor is not None:
+        conditions.append("(date, id) < (:cursor_date, :cursor_id)")
+        values["cursor_date"], values["cursor_id"] = decode_cursor(cursor)
+
+    # Only the filters in use are part of the statement, so each combination
+    # gets a plan that can use its index.
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = await database.fetch_all(f"""
+        SELECT id, chat_id, sender_id, date, text, media FROM messages
+        {where}
+        ORDER BY date DESC, id DESC
+        LIMIT :limit
+    """, values)
+    messages = [dict(row._mapping) for row in rows[:limit]]
+    for message in messages:
+        if isinstance(message["media"], str):
+            message["media"] = json.loads(message["media"])
+    next_cursor = encode_cursor(messages[-1]) if len(rows) > limit else None
+    return messages, next_cursor
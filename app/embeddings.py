@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+import numpy as np
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+# The same model Chroma uses for the collection, so query embeddings computed
+# here can be passed straight to collection.query(query_embeddings=...).
+_embedding_function = None
+
+
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        _embedding_function = DefaultEmbeddingFunction()
+    return _embedding_function
+
+
+@lru_cache(maxsize=2048)
+def embed_query(text):
+    """Returns the unit-length embedding of a query, cached per query text."""
+    vector = np.asarray(get_embedding_function()([text])[0], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector = vector / norm
+    vector.setflags(write=False)
+    return vector
@@ -0,0 +1,180 @@
+import json
+import math
+import os
+import re
+import time
+from array import array
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from app.routing import ROUTING_FIELDS, field_columns, filter_mask
+
+# Identifiers (CONFIG_SENSOR_IMX335, getBitrate, 0x1F) and words in any script.
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+[A-Za-z0-9_]*|[^\W\d_]+")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text):
+    """
+    Code-aware tokenizer: every identifier is kept whole (lowercased) and also
+    split into its snake_case and camelCase parts, so both "CONFIG_SENSOR" and
+    "sensor" match CONFIG_SENSOR_IMX335.
+    """
+    tokens = []
+    for word in _WORD.findall(text):
+        if len(word) < 2:
+            continue
+        tokens.append(word.lower())
+        if word.isalpha() and (word.islower() or word.isupper()):
+            continue
+        parts = [part for piece in word.split('_') for part in _CAMEL.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts if len(part) > 1)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of the collection. Postings are stored
+    as flat NumPy arrays (one slice per term), so a query is a handful of
+    vectorized array operations.
+    """
+
+    def __init__(self, ids, terms, offsets, doc_indices, term_freqs, doc_lengths, k1=1.2, b=0.75, fields=None):
+        self.ids = ids
+        # Per-document ROUTING_FIELDS values for metadata filters (None for indexes built without them).
+        self.fields = fields
+        self._masks = {}
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_indices = doc_indices
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(avg_length, 1.0))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, documents):
+        """Builds the index from an iterable of (chunk_id, text, metadata) triples."""
+        postings_docs = defaultdict(lambda: array('I'))
+        postings_freqs = defaultdict(lambda: array('H'))
+        ids, lengths, metadatas = [], [], []
+        for doc_index, (cid, text, metadata) in enumerate(documents):
+            counts = Counter(tokenize(text or ""))
+            ids.append(cid)
+            metadatas.append(metadata)
+            lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                postings_docs[term].append(doc_index)
+                postings_freqs[term].append(min(freq, 65535))
+
+        terms = sorted(postings_docs)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings_docs[term])
+        doc_indices = np.empty(offsets[-1], dtype=np.uint32)
+        term_freqs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            doc_indices[offsets[i]:offsets[i + 1]] = np.frombuffer(postings_docs.pop(term), dtype=np.uint32)
+            term_freqs[offsets[i]:offsets[i + 1]] = np.frombuffer(postings_freqs.pop(term), dtype=np.uint16)
+        return cls(ids, terms, offsets, doc_indices, term_freqs, np.asarray(lengths, dtype=np.float32),
+                   fields=field_columns(metadatas))
+
+    def save(self, path):
+        """Writes the index atomically, so the API never loads a half-written file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        terms = sorted(self.term_index, key=self.term_index.get)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.frombuffer("\n".join(self.ids).encode('utf-8'), dtype=np.uint8),
+            terms=np.frombuffer("\n".join(terms).encode('utf-8'), dtype=np.uint8),
+            offsets=self.offsets,
+            doc_indices=self.doc_indices,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+            **{f"field_{name}": np.frombuffer(json.dumps(values).encode('utf-8'), dtype=np.uint8)
+               for name, values in (self.fields or {}).items()},
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            ids = data["ids"].tobytes().decode('utf-8').split("\n") if data["ids"].size else []
+            terms = data["terms"].tobytes().decode('utf-8').split("\n") if data["terms"].size else []
+            fields = {name: json.loads(data[f"field_{name}"].tobytes().decode('utf-8')) for name in ROUTING_FIELDS} \
+                if all(f"field_{name}" in data for name in ROUTING_FIELDS) else None
+            return cls(ids, terms, data["offsets"], data["doc_indices"], data["term_freqs"], data["doc_lengths"],
+                       fields=fields)
+
+    def mask(self, where):
+        """Boolean mask of the documents passing a metadata filter, or None if the index has no fields."""
+        if self.fields is None:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._masks:
+            self._masks[key] = filter_mask(self.fields, where, len(self.ids))
+        return self._masks[key]
+
+    def search(self, query, k=20, where=None):
+        """
+        Returns up to k (chunk_id, score) pairs, best first. With a where
+        filter, only documents whose metadata passes it are ranked.
+        """
+        if not self.ids:
+            return []
+        num_docs = len(self.ids)
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.term_index.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.doc_indices[start:end]
+            freqs = self.term_freqs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norm[docs])
+        mask = self.mask(where) if where else None
+        if mask is not None:
+            scores[~mask] = 0
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+class LexicalIndexFile:
+    """Holds the index loaded from path and reloads it when ingest.py publishes a new one."""
+
+    def __init__(self, path, check_interval=15.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.index = None
+        self._mtime = None
+        self._checked_at = float("-inf")
+
+    def get(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime != self._mtime:
+                    started = time.monotonic()
+                    self.index = LexicalIndex.load(self.path)
+                    self._mtime = mtime
+                    print(f"LEXICAL: Loaded index of {len(self.index)} chunks in {time.monotonic() - started:.2f}s.")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"LEXICAL: Could not load {self.path}: {e}")
+        return self.index
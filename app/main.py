@@ -5,24 +5,50 @@
 #
 import os
 import asyncio
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import NamedTuple, Optional
 
 import shutil
-import sqlalchemy
+import numpy as np
 import ollama
 import chromadb # NEW: Import chromadb
-from databases import Database
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.dialects.postgresql import insert
 
-from app.scraper import fetch_messages, client
-from app.config import DOCS_URLS, GITHUB_REPOS, TARGET_CHATS
+from app.admission import STATUS, AdmissionController, AdmissionRejected, GenerationCoalescer, normalize_question
+from app.answer_cache import AnswerCache
+from app.backends import Backend, monitor
+from app.db import apply_schema, database, fetch_chat_stats, list_telegram_chats, search_messages
+from app.scrape_jobs import enqueue_job, get_job, list_jobs
+from app.context import pack_context
+from app.embeddings import embed_query
+from app.lexical import LexicalIndexFile
+from app.metrics import RATE_BUCKETS, REGISTRY, Counter, Histogram, RequestTrace, SlowRequestLog
+from app.retrieval import routed_search
+from app.routing import GENERAL, Route, route_query
+from app.vector_index import VectorSnapshotFile
+from app.scraper import NEWER, OLDER
+from app.sessions import ChatSession, SessionStore, Turn, standalone_query
+from app.config import (
+    DOCS_URLS, GITHUB_REPOS, TARGET_CHATS,
+    LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT, LLM_GENERATION_TIMEOUT,
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY, COLLECTION_VERSION_TTL, STATS_CACHE_TTL,
+    LEXICAL_INDEX_PATH, RETRIEVAL_CANDIDATES, VECTOR_BACKEND, VECTOR_SNAPSHOT_DIR, QUERY_ROUTING, ROUTE_MIN_RESULTS,
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_CHUNKS, CONTEXT_MMR_LAMBDA, CONTEXT_DUPLICATE_THRESHOLD,
+    OLLAMA_HOST, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, CHROMA_HOST, CHROMA_PORT,
+    BACKEND_CHECK_INTERVAL, BACKEND_CONNECT_TIMEOUT, BACKEND_MAX_BACKOFF,
+    TRACE_LOG_PATH, TRACE_SLOW_SECONDS, TRACE_SAMPLE_RATE, INGEST_METRICS_PATH,
+    SESSION_CACHE_SIZE, SESSION_HISTORY_TURNS, SESSION_ANSWER_CHARS, SESSION_TOPIC_SIMILARITY, SESSION_TTL,
+)
 
 # --- Configuration ---
-DATABASE_URL = "postgresql://postgres:password@db:5432/telegramdb"
+COLLECTION_NAME = "openipc_knowledge"
 
 # --- Pydantic Models ---
 class ChatRequest(BaseModel):
@@ -36,108 +62,260 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id", "X-Answer-Cache"],
 )
 
-# --- Database Setup ---
-database = Database(DATABASE_URL)
-metadata = sqlalchemy.MetaData()
-messages_table = sqlalchemy.Table(
-    "messages",
-    metadata,
-    sqlalchemy.Column("id", sqlalchemy.BigInteger, primary_key=True),
-    sqlalchemy.Column("chat_id", sqlalchemy.BigInteger, nullable=False),
-    sqlalchemy.Column("sender_id", sqlalchemy.BigInteger, nullable=False),
-    sqlalchemy.Column("date", sqlalchemy.DateTime(timezone=True), nullable=False),
-    sqlalchemy.Column("text", sqlalchemy.Text, nullable=True),
-    sqlalchemy.Column("media", sqlalchemy.JSON, nullable=True),
-)
+# The Chroma client is synchronous (and embeds queries in-process), so its calls
+# run on a dedicated thread pool instead of the event loop.
+chroma_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("CHROMA_WORKERS", 4)),
+                                     thread_name_prefix="chroma")
 
-# --- AI & Knowledge Base Client Setup ---
-try:
-    ollama_client = ollama.Client(host='http://host.docker.internal:11434')
-    print("Successfully configured Ollama client.")
-except Exception as e:
-    print(f"FATAL: Could not configure Ollama client. Is Ollama running on the host? Error: {e}")
-    ollama_client = None
-
-# NEW: Configure the ChromaDB client to connect to the 'chroma' service
-try:
-    chroma_client = chromadb.HttpClient(host='chroma', port=8000)
-    
-    collection = chroma_client.get_or_create_collection("openipc_knowledge")
-    
-    print("Successfully connected to ChromaDB knowledge base.")
-except Exception as e:
-    print(f"FATAL: Could not connect to ChromaDB. Is it running? Is the 'openipc_knowledge' collection created? Error: {e}")
-    collection = None
+async def run_in_chroma_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(chroma_executor, partial(func, *args, **kwargs))
+
+# BM25 index over the same chunks, built by ingest.py and reloaded when it publishes a new one.
+lexical_index = LexicalIndexFile(LEXICAL_INDEX_PATH, check_interval=COLLECTION_VERSION_TTL)
+
+# Memory-mapped export of the collection's vectors, searched in-process; Chroma is the fallback.
+vector_snapshot = VectorSnapshotFile(VECTOR_SNAPSHOT_DIR, check_interval=COLLECTION_VERSION_TTL) \
+    if VECTOR_BACKEND == "snapshot" else None
+
+# --- AI & Knowledge Base Backends ---
+# Connected on first use and reconnected with backoff, so the API starts (and
+# recovers) regardless of whether Ollama and Chroma are up yet.
+class ChromaConnection(NamedTuple):
+    client: object
+    collection: object
+
+async def connect_ollama():
+    # The client is async so token streaming never blocks the event loop.
+    client = ollama.AsyncClient(host=OLLAMA_HOST)
+    await client.list()
+    return client
+
+async def check_ollama(client):
+    await client.list()
+
+async def connect_chroma():
+    def connect():
+        client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        return ChromaConnection(client, client.get_or_create_collection(COLLECTION_NAME))
+    return await run_in_chroma_executor(connect)
+
+async def check_chroma(connection):
+    await run_in_chroma_executor(connection.client.heartbeat)
+
+ollama_backend = Backend("Ollama", connect_ollama, check_ollama, connect_timeout=BACKEND_CONNECT_TIMEOUT,
+                         max_backoff=BACKEND_MAX_BACKOFF)
+chroma_backend = Backend("Chroma", connect_chroma, check_chroma, connect_timeout=BACKEND_CONNECT_TIMEOUT,
+                         max_backoff=BACKEND_MAX_BACKOFF)
+
+async def get_collection():
+    connection = await chroma_backend.get()
+    return connection.collection if connection else None
+
+def load_retrieval_indexes():
+    """Returns the current (lexical index, vector snapshot), picking up newly published ones. Blocking."""
+    return lexical_index.get(), vector_snapshot.get() if vector_snapshot else None
+
+async def knowledge_base_available():
+    """Chroma is only needed while there is no vector snapshot to search in-process."""
+    if vector_snapshot is not None:
+        _, snapshot = await run_in_chroma_executor(load_retrieval_indexes)
+        if snapshot is not None and len(snapshot):
+            return True
+    return await chroma_backend.get() is not None
+
+def search_knowledge_base(collection, query, query_embedding=None, route=GENERAL):
+    """Hybrid retrieval over the current indexes, within the route. Blocking; run it in chroma_executor."""
+    lexical, snapshot = load_retrieval_indexes()
+    return routed_search(collection, lexical, query, route, query_embedding, n_results=RETRIEVAL_CANDIDATES,
+                         vector_snapshot=snapshot, min_results=ROUTE_MIN_RESULTS)
+
+# Admission control in front of Ollama, which can only generate a couple of answers at once.
+admission = AdmissionController(max_in_flight=LLM_MAX_IN_FLIGHT, max_queue=LLM_MAX_QUEUE)
+coalescer = GenerationCoalescer()
+
+# --- Metrics ---
+# Exported on /metrics; every process of the API keeps its own.
+CHAT_REQUESTS = Counter("chat_requests_total", "/chat requests by outcome.", ["result"])
+CHAT_REQUEST_SECONDS = Histogram("chat_request_seconds", "Time from receiving a question until its answer ended.",
+                                 ["result"])
+CHAT_STAGE_SECONDS = Histogram("chat_stage_seconds", "Time spent in each stage of answering a question.", ["stage"])
+CHAT_TIME_TO_FIRST_TOKEN = Histogram("chat_time_to_first_token_seconds",
+                                     "Time from receiving a question to the first token of its answer.")
+CHAT_TOKENS_PER_SECOND = Histogram("chat_tokens_per_second", "Answer generation speed.", buckets=RATE_BUCKETS)
+CHAT_CONTEXT = Counter("chat_context_total",
+                       "Context blocks by origin: retrieved, or reused from the session's previous turn.", ["source"])
+slow_requests = SlowRequestLog(TRACE_LOG_PATH, threshold=TRACE_SLOW_SECONDS, sample_rate=TRACE_SAMPLE_RATE)
+
+def finish_chat(trace, result):
+    CHAT_REQUESTS.inc(result=result)
+    CHAT_REQUEST_SECONDS.observe(trace.elapsed(), result=result)
+    trace.finish(result=result)
+
+# Answers are cached per knowledge base version, which ingest.py bumps in the collection metadata.
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                           similarity_threshold=ANSWER_CACHE_SIMILARITY)
+collection_version = {"value": None, "checked_at": float("-inf")}
+
+# Multi-turn conversations, stored in Postgres with the active ones cached in memory.
+sessions = SessionStore(max_cached=SESSION_CACHE_SIZE, history_turns=SESSION_HISTORY_TURNS)
+
+async def get_collection_version():
+    """Returns the collection's ingest version stamp, re-read at most every COLLECTION_VERSION_TTL seconds."""
+    connection = await chroma_backend.get()
+    if connection and time.monotonic() - collection_version["checked_at"] >= COLLECTION_VERSION_TTL:
+        try:
+            current = await run_in_chroma_executor(connection.client.get_collection, COLLECTION_NAME)
+            collection_version["value"] = (current.metadata or {}).get("ingest_version")
+        except Exception as e:
+            print(f"Could not read the collection version: {e}")
+        collection_version["checked_at"] = time.monotonic()
+    return collection_version["value"]
+
+# Knowledge base stats (vector count and per-chat aggregates) are shared by
+# /admin/stats and meta questions, and cached briefly so bursts of them cost
+# one round trip to Postgres and Chroma.
+stats_cache = {"value": None, "expires_at": float("-inf"), "lock": asyncio.Lock()}
+
+async def get_cached_stats():
+    """Returns {"vector_count", "chats"}, refreshed at most every STATS_CACHE_TTL seconds."""
+    if time.monotonic() < stats_cache["expires_at"]:
+        return stats_cache["value"]
+    async with stats_cache["lock"]:
+        if time.monotonic() < stats_cache["expires_at"]:
+            return stats_cache["value"]
+        stats = {"vector_count": 0, "chats": []}
+        try:
+            collection = await get_collection()
+            if collection:
+                stats["vector_count"] = await run_in_chroma_executor(collection.count)
+        except Exception as e:
+            print(f"Could not fetch count from ChromaDB: {e}")
+        try:
+            if database.is_connected:
+                stats["chats"] = await fetch_chat_stats()
+        except Exception as e:
+            print(f"Could not fetch stats from PostgreSQL: {e}")
+        stats_cache["value"] = stats
+        stats_cache["expires_at"] = time.monotonic() + STATS_CACHE_TTL
+        return stats
 
 # --- App Lifecycle Events ---
+warmup = {"done": False, "seconds": None}
+background_tasks = set()
+
+async def warm_up():
+    """
+    Loads the model into Ollama (kept resident via keep_alive) and runs one
+    retrieval, which loads the query embedding model and maps the indexes, so
+    the first question is as fast as later ones. Waits for the backends.
+    """
+    started = time.monotonic()
+    while not (await ollama_backend.get() and await chroma_backend.get()):
+        await asyncio.sleep(BACKEND_CHECK_INTERVAL)
+    try:
+        client = await ollama_backend.get()
+        await client.generate(model=OLLAMA_MODEL, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+        query = "OpenIPC firmware"
+        query_embedding = await run_in_chroma_executor(embed_query, query)
+        await run_in_chroma_executor(search_knowledge_base, await get_collection(), query, query_embedding)
+    except Exception as e:
+        print(f"BACKENDS: Warm-up failed, the first question will be slower: {e!r}")
+    warmup.update(done=True, seconds=round(time.monotonic() - started, 1))
+    print(f"BACKENDS: Warm-up finished after {warmup['seconds']}s.")
+
+async def expire_sessions(interval=3600):
+    """Deletes sessions idle for longer than SESSION_TTL, once an hour."""
+    while True:
+        try:
+            expired = await sessions.expire(SESSION_TTL)
+            if expired:
+                print(f"SESSIONS: Deleted {expired} idle sessions.")
+        except Exception as e:
+            print(f"SESSIONS: Could not delete idle sessions: {e}")
+        await asyncio.sleep(interval)
+
+def start_background_task(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
 @app.on_event("startup")
 async def startup():
     await database.connect()
+    await apply_schema()
+    await run_in_chroma_executor(load_retrieval_indexes)
+    start_background_task(monitor([ollama_backend, chroma_backend], BACKEND_CHECK_INTERVAL))
+    start_background_task(warm_up())
+    start_background_task(expire_sessions())
 
 @app.on_event("shutdown")
 async def shutdown():
+    for task in list(background_tasks):
+        task.cancel()
     await database.disconnect()
+    chroma_executor.shutdown(wait=False)
 
-# --- Helper Functions ---
-async def ensure_client_connected():
-    if not client.is_connected():
-        await client.start()
-
-async def save_message(message, chat_id):
-    stmt = insert(messages_table).values(
-        id=message["id"],
-        chat_id=chat_id,
-        sender_id=message["sender_id"],
-        date=datetime.fromisoformat(message["date"]) if message["date"] else None,
-        text=message["text"],
-        media=message["media"],
-    )
-    do_nothing_stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
+# --- API Endpoints ---
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this API process, followed by those of the last ingest.py run."""
+    text = REGISTRY.render()
     try:
-        await database.execute(do_nothing_stmt)
+        with open(INGEST_METRICS_PATH, encoding="utf-8") as f:
+            text += f.read()
+    except FileNotFoundError:
+        pass
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/health")
+async def health():
+    """
+    Readiness: 200 once PostgreSQL, Chroma and Ollama answer and the warm-up
+    has run, 503 (with the state of each backend) until then.
+    """
+    postgres = {"ready": False, "error": None}
+    try:
+        async with asyncio.timeout(BACKEND_CONNECT_TIMEOUT):
+            await database.fetch_val("SELECT 1")
+        postgres["ready"] = True
     except Exception as e:
-        print(f"Unexpected DB error for message {message['id']}: {e}")
+        postgres["error"] = f"{type(e).__name__}: {e}"
+    backends = {"postgres": postgres, "chroma": chroma_backend.status(), "ollama": ollama_backend.status()}
+    ready = all(backend["ready"] for backend in backends.values()) and warmup["done"]
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ok" if ready else "starting" if not warmup["done"] else "degraded",
+        "warmed_up": warmup["done"],
+        "warmup_seconds": warmup["seconds"],
+        "backends": backends,
+    })
 
-# --- API Endpoints ---
 @app.get("/chats")
 async def list_chats():
     """
-    Fetches dialogs from Telegram, but only returns the ones
-    specified in the TARGET_CHATS set.
+    Returns the chats specified in the TARGET_CHATS set, as last resolved
+    by the scrape worker (the API itself never talks to Telegram).
     """
-    await ensure_client_connected()
-    dialogs = await client.get_dialogs()
-    
-    # Filter the dialogs to only include those in our target list
-    target_dialogs = [d for d in dialogs if d.name in TARGET_CHATS]
-    
-    chat_ids = [getattr(d.entity, "id", None) for d in target_dialogs]
-    valid_chat_ids = [cid for cid in chat_ids if cid is not None]
+    target_chats = await list_telegram_chats(TARGET_CHATS)
+    valid_chat_ids = [chat["chat_id"] for chat in target_chats]
 
+    # Primary key lookups in chat_stats, so counts are current right after a scrape.
     if not valid_chat_ids:
         counts = {}
     else:
-        query = (
-            sqlalchemy.select(
-                messages_table.c.chat_id,
-                sqlalchemy.func.count(messages_table.c.id).label("count")
-            )
-            .where(messages_table.c.chat_id.in_(valid_chat_ids))
-            .group_by(messages_table.c.chat_id)
-        )
-        rows = await database.fetch_all(query)
-        counts = {row['chat_id']: row['count'] for row in rows}
+        counts = {row['chat_id']: row['message_count'] for row in await fetch_chat_stats(valid_chat_ids)}
 
     response_chats = []
-    for dialog in target_dialogs:
-        chat_id = getattr(dialog.entity, "id", None)
+    for chat in target_chats:
+        chat_id = chat["chat_id"]
         response_chats.append({
-            "name": dialog.name,
+            "name": chat["name"],
             "id": chat_id,
-            "username": getattr(dialog.entity, "username", None),
-            "type": type(dialog.entity).__name__,
+            "username": chat["username"],
+            "type": chat["type"],
             "message_count": counts.get(chat_id, 0)
         })
         
@@ -145,39 +323,109 @@ async def list_chats():
 
 
 @app.post("/chats/{chat_id}/scrape")
-async def scrape_and_save_chat_messages(chat_id: int, limit: int = 100):
-    # This function remains the same
-    await ensure_client_connected()
-    print(f"SCRAPING: Starting scrape for chat_id: {chat_id}")
+async def scrape_and_save_chat_messages(chat_id: int, limit: int = 100, direction: str = NEWER):
+    """
+    Queues a scrape for the scrape worker and returns its job id right away.
+    direction=newer fetches messages newer than the newest stored one,
+    direction=older continues backfilling older history; limit <= 0 scrapes
+    without a limit. Poll /scrape-jobs/{job_id} for progress.
+    """
+    if direction not in (NEWER, OLDER):
+        raise HTTPException(status_code=400, detail=f"direction must be '{NEWER}' or '{OLDER}'")
+    job, created = await enqueue_job(chat_id, direction, limit if limit > 0 else None)
+    print(f"SCRAPING: {'Queued' if created else 'Already queued'} job {job['id']} "
+          f"({direction} scrape of chat_id: {chat_id})")
+    return {"status": "queued", "job_id": job["id"], "already_queued": not created, "job": job}
+
+@app.get("/scrape-jobs/{job_id}")
+async def get_scrape_job(job_id: int):
+    """Status and progress (messages fetched/inserted, watermarks) of one scrape job."""
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Scrape job {job_id} not found")
+    return job
+
+@app.get("/scrape-jobs")
+async def list_scrape_jobs(chat_id: int = None, limit: int = 20):
+    """The most recent scrape jobs, optionally for one chat."""
+    return await list_jobs(chat_id, min(max(limit, 1), 200))
+
+@app.get("/messages")
+async def search_stored_messages(q: str = None, chat_id: int = None, sender_id: int = None,
+                                 date_from: datetime = None, date_to: datetime = None,
+                                 cursor: str = None, limit: int = 50):
+    """
+    Searches stored Telegram messages, newest first. q is a full-text query
+    (websearch syntax: "exact phrase", -exclude, or); chat_id, sender_id and
+    date_from/date_to narrow it down. Pass next_cursor back as cursor for the
+    next page.
+    """
     try:
-        scraped_messages = await fetch_messages(client, chat_id, limit)
-    except Exception as e:
-        print(f"SCRAPING ERROR: Could not fetch messages for chat {chat_id}. Reason: {e}")
-        return {"status": "error", "messages_saved": 0, "detail": str(e)}
-    count = 0
-    for msg_dict in scraped_messages:
-        await save_message(msg_dict, chat_id)
-        count += 1
-    print(f"SCRAPING: Finished. Saved {count} new messages for chat_id: {chat_id}")
-    return {"status": "success", "messages_saved": count}
+        messages, next_cursor = await search_messages(
+            q.strip() if q and q.strip() else None, chat_id=chat_id, sender_id=sender_id,
+            date_from=date_from, date_to=date_to, cursor=cursor, limit=min(max(limit, 1), 200),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"messages": messages, "next_cursor": next_cursor}
 
-# MODIFIED: The chat endpoint now uses the RAG pattern
-@app.post("/chat")
-async def handle_rag_chat(request: ChatRequest):
-    if not ollama_client or not collection:
-        async def error_stream():
-            yield "Error: AI or Knowledge Base is not configured on the server."
-        return StreamingResponse(error_stream(), media_type="text/plain")
+def is_meta_query(query):
+    """Questions about the knowledge base itself, answered from live stats instead of retrieval."""
+    meta_keywords = ["what do you know", "how many messages", "your knowledge", "what repos", "what sources"]
+    user_query = query.lower()
+    return any(keyword in user_query for keyword in meta_keywords)
+
+SYSTEM_PROMPT = (
+    "You are an expert AI assistant for the OpenIPC project. Your knowledge base contains documents in multiple languages, including English and Chinese. "
+    "You will be given a user's question and a set of context documents. "
+    "Your task is to synthesize an answer based *only* on the provided context. "
+    "If the context documents are in a different language from the user's question, you must translate the relevant parts to answer in the user's language. "
+    "If the context does not contain the answer, explicitly state that the information is not in the knowledge base."
+)
+
+def question_message(query):
+    return {'role': 'user', 'content': f"Based ONLY on the context documents above, answer this question: {query}"}
 
-    user_query = request.query.lower()
+def prompt_messages(context_documents, query, history=()):
+    """
+    The chat messages of a turn, laid out so consecutive turns share a prefix
+    Ollama can keep cached: instructions and context first (unchanged while
+    the context is reused), then earlier turns exactly as they were sent,
+    then the new question.
+    """
+    system = (
+        f"{SYSTEM_PROMPT}\n\n"
+        f"--- CONTEXT DOCUMENTS ---\n"
+        f"{context_documents if context_documents else 'No relevant documents were found.'}\n"
+        f"--- END OF CONTEXT ---"
+    )
+    messages = [{'role': 'system', 'content': system}]
+    for turn in history:
+        messages.append(question_message(turn.query))
+        messages.append({'role': 'assistant', 'content': turn.answer[:SESSION_ANSWER_CHARS]})
+    messages.append(question_message(query))
+    return messages
+
+async def build_prompt(query, query_embedding=None, trace=None, route=GENERAL, session=None, retrieval_query=None,
+                       shared=False):
+    """
+    Retrieves context for retrieval_query (the query itself unless a session
+    rewrote it) within the route and returns the chat messages for Ollama.
+    In a session, the previous turn's context is reused while the question
+    stays on its topic, and the recent turns are replayed. A shared answer
+    (cached, or joined by other sessions) is built from freshly retrieved
+    context without the session's turns.
+    """
+    if trace is None:
+        trace = RequestTrace("prompt", CHAT_STAGE_SECONDS)
+    retrieval_query = retrieval_query or query
     context_documents = ""
     
     # --- NEW META-AWARENESS LOGIC ---
-    meta_keywords = ["what do you know", "how many messages", "your knowledge", "what repos", "what sources"]
-    
-    if any(keyword in user_query for keyword in meta_keywords):
+    if is_meta_query(query):
         print("META_QUERY DETECTED: Gathering knowledge base stats...")
-        stats = await get_knowledge_base_stats()
+        with trace.span("stats"):
+            stats = await get_knowledge_base_stats()
         
         # Format the stats into a text block for the AI
         stats_context = "I have been provided with the following information about my own knowledge base:\n\n"
@@ -192,54 +440,245 @@ async def handle_rag_chat(request: ChatRequest):
             stats_context += f"  - Chat ID {chat_id}: Contains {chat_data['message_count']} messages, ranging from {chat_data['earliest']} to {chat_data['latest']}.\n"
         
         context_documents = stats_context
+    elif session is not None and not shared and session.context_matches(query_embedding, SESSION_TOPIC_SIMILARITY):
+        print(f"RAG: Reusing the session's context (retrieved for '{session.context_query}') for '{retrieval_query}'")
+        context_documents = session.context
+        CHAT_CONTEXT.inc(source="reused")
+        trace.attributes["context"] = "reused"
     else:
-        # --- This is the original RAG logic ---
+        # --- This is the original RAG logic, now fusing vector and BM25 results ---
+        # Over-fetch, then let the context stage drop duplicates, merge
+        # neighbouring chunks and fit the rest into the token budget.
         try:
-            print(f"RAG: Querying knowledge base for: '{request.query}'")
-            results = collection.query(query_texts=[request.query], n_results=7)
-            if results['documents'] and results['documents'][0]:
-                context_documents = "\n---\n".join(results['documents'][0])
-                print(f"RAG: Found {len(results['documents'][0])} relevant document chunks.")
+            print(f"RAG: Querying knowledge base for: '{retrieval_query}' (route: {route.name})")
+            with trace.span("retrieval"):
+                results = await run_in_chroma_executor(search_knowledge_base, await get_collection(),
+                                                       retrieval_query, query_embedding, route)
+            if results['documents']:
+                with trace.span("context"):
+                    context_documents, report = pack_context(
+                        results, token_budget=CONTEXT_TOKEN_BUDGET, max_chunks=CONTEXT_MAX_CHUNKS,
+                        mmr_lambda=CONTEXT_MMR_LAMBDA, duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+                    )
+                print(f"RAG: Packed {report['chunks']} of {report['candidates']} candidate chunks "
+                      f"({results['backend']} search, {results['lexical_hits']} from the lexical index, "
+                      f"{results['filtered_hits']} within the {results['route']} route) "
+                      f"into {report['tokens']} tokens; dropped {report['duplicates_dropped']} duplicates, merged {report['chunks_merged']} "
+                      f"neighbours, saved {report['tokens_saved']} tokens.")
             else:
                 print("RAG: Found 0 relevant document chunks.")
+            CHAT_CONTEXT.inc(source="retrieved")
+            if session is not None and context_documents and query_embedding is not None:
+                session.set_context(context_documents, retrieval_query, query_embedding)
         except Exception as e:
             print(f"RAG Error: {e}")
+            chroma_backend.report_failure(e)
             # We'll just proceed with an empty context if the query fails
 
-    # --- The rest of the function remains the same ---
-    system_prompt = (
-    "You are an expert AI assistant for the OpenIPC project. Your knowledge base contains documents in multiple languages, including English and Chinese. "
-    "You will be given a user's question and a set of context documents. "
-    "Your task is to synthesize an answer based *only* on the provided context. "
-    "If the context documents are in a different language from the user's question, you must translate the relevant parts to answer in the user's language. "
-    "If the context does not contain the answer, explicitly state that the information is not in the knowledge base."
-    )
-    
-    full_prompt = (
-        f"--- CONTEXT DOCUMENTS ---\n"
-        f"{context_documents if context_documents else 'No relevant documents were found.'}\n"
-        f"--- END OF CONTEXT ---\n\n"
-        f"Based ONLY on the context above, answer this question: {request.query}"
-    )
+    history = session.turns if session is not None and not shared else []
+    return prompt_messages(context_documents, query, history)
+
+@dataclass
+class AnswerRequest:
+    """Everything stream_answer needs to answer one /chat turn."""
+    query: str
+    retrieval_query: str
+    query_embedding: Optional[np.ndarray]
+    cache_key: Optional[str]
+    version: Optional[str]
+    trace: RequestTrace
+    route: Route
+    session: Optional[ChatSession] = None
+    # Answers that may be cached or joined by other sessions don't see this session's turns.
+    shared: bool = False
+
+async def generate_answer(request, generation):
+    """Runs stream_answer and records the request's outcome and timings."""
+    result = "error"
+    try:
+        result = await stream_answer(request, generation)
+    finally:
+        generation.result = result
+        finish_chat(request.trace, result)
+
+async def stream_answer(request, generation):
+    """
+    Builds the prompt, waits for an LLM slot and streams the answer into the
+    shared generation. Queue position updates are published as status events.
+    A complete answer is stored in the answer cache under cache_key.
+    Returns the outcome for the request metrics.
+    """
+    query, query_embedding, trace = request.query, request.query_embedding, request.trace
+    messages = await build_prompt(query, query_embedding, trace, request.route, request.session,
+                                  request.retrieval_query, request.shared)
+
+    try:
+        ticket = admission.enqueue()
+    except AdmissionRejected as e:
+        print(f"ADMISSION: Rejected '{query}': {e}")
+        generation.publish("Error: The AI model is overloaded right now. Please try again in a minute.", STATUS)
+        return "rejected"
 
-    async def stream_generator():
+    try:
+        queued = time.perf_counter()
         try:
-            stream = ollama_client.chat(
-                model='llama3:8b-instruct-q4_K_M',
-                messages=[
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': full_prompt}
-                ],
-                stream=True
+            async with asyncio.timeout(LLM_QUEUE_TIMEOUT):
+                last_position = None
+                while not ticket.admitted:
+                    if ticket.position != last_position:
+                        last_position = ticket.position
+                        generation.publish(f"[Waiting for the AI model: you are #{last_position} in the queue]\n\n", STATUS)
+                    await ticket.wait(None)
+        except TimeoutError:
+            print(f"ADMISSION: '{query}' timed out after {LLM_QUEUE_TIMEOUT}s in the queue.")
+            generation.publish("Error: The AI model is busy. Please try again in a minute.", STATUS)
+            return "queue_timeout"
+        trace.add("queue_wait", time.perf_counter() - queued)
+
+        ollama_client = await ollama_backend.get()
+        if ollama_client is None:
+            generation.publish("Error: The AI model is not reachable right now. Please try again shortly.", STATUS)
+            return "unavailable"
+        requested = time.perf_counter()
+        first_token = None
+        tokens, eval_count, eval_duration = 0, None, None
+        async with asyncio.timeout(LLM_GENERATION_TIMEOUT):
+            stream = await ollama_client.chat(
+                model=OLLAMA_MODEL,
+                messages=messages,
+                stream=True,
+                keep_alive=OLLAMA_KEEP_ALIVE,
             )
-            for chunk in stream:
-                yield chunk['message']['content']
-                await asyncio.sleep(0.01)
-        except Exception as e:
-            print(f"ERROR: Ollama stream failed: {e}")
-            yield "Error communicating with the local AI model."
+            async for chunk in stream:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    trace.add("prefill", first_token - requested)
+                    CHAT_TIME_TO_FIRST_TOKEN.observe(trace.elapsed())
+                tokens += 1
+                # The final chunk carries Ollama's own token count and generation time.
+                eval_count = chunk.get('eval_count') or eval_count
+                eval_duration = chunk.get('eval_duration') or eval_duration
+                generation.publish(chunk['message']['content'])
+
+        if first_token is not None:
+            generation_seconds = time.perf_counter() - first_token
+            trace.add("generation", generation_seconds)
+            if eval_count and eval_duration:
+                CHAT_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9))
+            elif tokens > 1 and generation_seconds > 0:
+                CHAT_TOKENS_PER_SECOND.observe((tokens - 1) / generation_seconds)
+            trace.attributes["tokens"] = eval_count or tokens
+
+        if request.cache_key is not None and answer_cache.version == request.version:
+            answer_cache.put(request.cache_key, query_embedding, generation.text)
+        return "answered"
+    except Exception as e:
+        print(f"ERROR: Ollama stream failed: {e!r}")
+        ollama_backend.report_failure(e)
+        generation.publish("Error communicating with the local AI model.", STATUS)
+        return "timeout" if isinstance(e, TimeoutError) else "error"
+    finally:
+        ticket.release()
+
+async def remember_turn(session, query, retrieval_query, generation):
+    """Adds the turn to the session once its answer is complete; failed answers are not kept."""
+    await generation.task
+    if getattr(generation, "result", None) == "answered" and generation.text:
+        await sessions.add_turn(session, Turn(query, retrieval_query, generation.text))
+
+# MODIFIED: The chat endpoint now uses the RAG pattern
+@app.post("/chat")
+async def handle_rag_chat(request: ChatRequest, x_session_id: Optional[str] = Header(None)):
+    """
+    Answers a question as one turn of the session named by the X-Session-Id
+    header. Without one (or with an unknown one) a new session is started;
+    either way its id is returned in the X-Session-Id response header.
+    """
+    trace = RequestTrace("chat", CHAT_STAGE_SECONDS, slow_requests, query=request.query)
+    with trace.span("session"):
+        session = await sessions.get(x_session_id)
+    headers = {"X-Session-Id": session.id}
+    trace.attributes["session_turn"] = session.turn_count
+    if not await ollama_backend.get() or not await knowledge_base_available():
+        finish_chat(trace, "unavailable")
+        async def error_stream():
+            yield "Error: AI or Knowledge Base is not reachable right now. Please try again shortly."
+        return StreamingResponse(error_stream(), media_type="text/plain", status_code=503, headers=headers)
+
+    # Follow-ups are retrieved as standalone queries and answered with the
+    # conversation in the prompt, so they bypass the shared answer cache.
+    # A standalone question later in a session still uses it, and is answered
+    # without the conversation so the cached answer suits every session.
+    retrieval_query = standalone_query(request.query, session)
+    follow_up = retrieval_query != request.query
+    if follow_up:
+        print(f"SESSIONS: Follow-up '{request.query}' retrieved as '{retrieval_query}'")
+    key = normalize_question(request.query)
+
+    # Repeated and near-duplicate questions are answered from the cache.
+    cache_key, query_embedding, version = None, None, None
+    if not is_meta_query(request.query):
+        answer, cache_hit = None, None
+        if not follow_up:
+            version = await get_collection_version()
+            answer_cache.set_version(version)
+            answer, cache_hit = answer_cache.get_exact(key), "exact"
+        if answer is None:
+            try:
+                with trace.span("embed"):
+                    query_embedding = await run_in_chroma_executor(embed_query, retrieval_query)
+                if not follow_up:
+                    cache_key = key
+                    answer, similarity = answer_cache.get_similar(query_embedding)
+                    cache_hit = "semantic"
+            except Exception as e:
+                print(f"ANSWER CACHE: Could not embed the query: {e}")
+        if answer is not None:
+            print(f"ANSWER CACHE: {cache_hit} hit for '{request.query}'")
+            finish_chat(trace, f"cache_{cache_hit}")
+            start_background_task(sessions.add_turn(session, Turn(request.query, retrieval_query, answer)))
+            return StreamingResponse(iter([answer]), media_type="text/plain",
+                                     headers={**headers, "X-Answer-Cache": cache_hit})
+
+    # Identical questions that are already being answered share that generation;
+    # a follow-up depends on its conversation, so it only joins the same question in the same session.
+    if follow_up:
+        key = f"session:{session.id}:{session.turn_count}:{key}"
+    generation = coalescer.get(key)
+    if generation is not None:
+        print(f"ADMISSION: Joining in-flight generation for '{request.query}'")
+        finish_chat(trace, "joined")
+    elif admission.full:
+        finish_chat(trace, "rejected")
+        async def busy_stream():
+            yield "Error: The AI model is overloaded right now. Please try again in a minute."
+        return StreamingResponse(busy_stream(), media_type="text/plain", status_code=503, headers=headers)
+    else:
+        # Symbol lookups only search code, "how do I" questions search the docs first.
+        route = route_query(retrieval_query) if QUERY_ROUTING else GENERAL
+        trace.attributes["route"] = route.name
+        generation = coalescer.start(key, partial(generate_answer, AnswerRequest(
+            request.query, retrieval_query, query_embedding, cache_key, version, trace, route, session,
+            shared=not follow_up,
+        )))
 
-    return StreamingResponse(stream_generator(), media_type="text/plain")
+    start_background_task(remember_turn(session, request.query, retrieval_query, generation))
+    return StreamingResponse(generation.stream(), media_type="text/plain",
+                             headers={**headers, "X-Answer-Cache": "miss"})
+
+@app.get("/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Every stored turn of a chat session."""
+    session = await sessions.history(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@app.delete("/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if not await sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"deleted": session_id}
 
 @app.get("/sources")
 async def get_knowledge_sources():
@@ -252,38 +691,19 @@ async def get_knowledge_sources():
     
 async def get_knowledge_base_stats():
     """Gathers statistics about the contents of the knowledge base."""
+    cached = await get_cached_stats()
     stats = {
         "github_repos": GITHUB_REPOS,
         "docs_url": DOCS_URLS,
         "telegram_chats": {},
-        "vector_db_count": 0,
+        "vector_db_count": cached["vector_count"],
     }
-    
-    # 1. Get stats from PostgreSQL
-    try:
-        if database.is_connected:
-            query = """
-                SELECT chat_id, COUNT(id) as message_count, MIN(date) as earliest, MAX(date) as latest
-                FROM messages
-                GROUP BY chat_id
-            """
-            rows = await database.fetch_all(query)
-            for row in rows:
-                stats["telegram_chats"][row['chat_id']] = {
-                    "message_count": row['message_count'],
-                    "earliest": row['earliest'].strftime("%Y-%m-%d"),
-                    "latest": row['latest'].strftime("%Y-%m-%d"),
-                }
-    except Exception as e:
-        print(f"Could not fetch stats from PostgreSQL: {e}")
-
-    # 2. Get stats from ChromaDB
-    try:
-        if collection:
-            stats["vector_db_count"] = collection.count()
-    except Exception as e:
-        print(f"Could not fetch count from ChromaDB: {e}")
-        
+    for row in cached["chats"]:
+        stats["telegram_chats"][row['chat_id']] = {
+            "message_count": row['message_count'],
+            "earliest": row['earliest'].strftime("%Y-%m-%d") if row['earliest'] else 'N/A',
+            "latest": row['latest'].strftime("%Y-%m-%d") if row['latest'] else 'N/A',
+        }
     return stats
 
 def get_directory_size(path='.'):
@@ -303,39 +723,20 @@ def get_directory_size(path='.'):
 async def get_system_stats():
     """Gathers and returns detailed statistics about the system."""
     
-    # 1. Get stats from ChromaDB
-    chroma_stats = {"vector_count": 0} # We only need the vector count
-    try:
-        if collection:
-            chroma_stats["vector_count"] = collection.count()
-    except Exception as e:
-        print(f"Could not get ChromaDB stats: {e}")
+    cached = await get_cached_stats()
+    chroma_stats = {"vector_count": cached["vector_count"]}
 
-    # 2. Get stats from PostgreSQL
+    # Per-chat aggregates come from chat_stats; the total is their sum.
     pg_stats = {"total_messages": 0, "chat_details": []}
-    try:
-        if database.is_connected:
-            # Query for total count
-            total_count_query = "SELECT COUNT(id) FROM messages;"
-            total_count = await database.fetch_val(total_count_query)
-            pg_stats["total_messages"] = total_count
-
-            # Query for per-chat details
-            per_chat_query = """
-                SELECT chat_id, COUNT(id) as message_count, MIN(date) as earliest, MAX(date) as latest
-                FROM messages GROUP BY chat_id ORDER BY message_count DESC;
-            """
-            rows = await database.fetch_all(per_chat_query)
-            for row in rows:
-                pg_stats["chat_details"].append({
-                    "chat_id": row['chat_id'],
-                    "message_count": row['message_count'],
-                    "earliest": row['earliest'].strftime("%Y-%m-%d %H:%M:%S") if row['earliest'] else 'N/A',
-                    "latest": row['latest'].strftime("%Y-%m-%d %H:%M:%S") if row['latest'] else 'N/A',
-                })
-    except Exception as e:
-        print(f"Could not get PostgreSQL stats: {e}")
-        
+    for row in cached["chats"]:
+        pg_stats["total_messages"] += row['message_count']
+        pg_stats["chat_details"].append({
+            "chat_id": row['chat_id'],
+            "message_count": row['message_count'],
+            "earliest": row['earliest'].strftime("%Y-%m-%d %H:%M:%S") if row['earliest'] else 'N/A',
+            "latest": row['latest'].strftime("%Y-%m-%d %H:%M:%S") if row['latest'] else 'N/A',
+        })
+
     return {
         "knowledge_sources": {
             "docs_urls": DOCS_URLS, # Changed key name
@@ -0,0 +1,237 @@
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; fine-grained at the low end for retrieval stages, up to full generations.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500, 1000, 5000)
+
+
+class Registry:
+    """Collects metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "".join(metric.render() for metric in self.metrics)
+
+    def write_textfile(self, path):
+        """Writes the metrics atomically, e.g. for node_exporter's textfile collector or the API's /metrics."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} counter\n"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}\n")
+        return "".join(lines)
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} gauge\n"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}\n")
+        return "".join(lines)
+
+
+class Histogram:
+    """
+    A Prometheus-style histogram. observe() is a bisect and a few additions
+    under a lock, so it is cheap enough for every request and every batch.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def totals(self):
+        """{label values: (observations, sum)} for every series."""
+        with self._lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self._series.items()}
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} histogram\n"]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', le)])} {cumulative}\n")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}\n")
+            lines.append(f"{self.name}_count{labels} {cumulative}\n")
+        return "".join(lines)
+
+
+class SlowRequestLog:
+    """
+    Appends the traces of requests slower than threshold seconds to a JSON
+    lines file, keeping only a sample_rate fraction of them.
+    """
+
+    def __init__(self, path, threshold, sample_rate):
+        self.path = path
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    def offer(self, trace):
+        if trace.total < self.threshold or random.random() >= self.sample_rate:
+            return
+        line = json.dumps(trace.to_dict(), default=str) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"METRICS: Could not write the slow request log: {e}")
+
+
+class RequestTrace:
+    """
+    Timing spans of one request. Every span is observed in stage_histogram
+    (labelled by stage) as it ends; finish() records the total and offers the
+    whole trace to the slow request log.
+    """
+
+    def __init__(self, name, stage_histogram, slow_log=None, **attributes):
+        self.name = name
+        self.stage_histogram = stage_histogram
+        self.slow_log = slow_log
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.total = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, round(self.elapsed() - seconds, 6), round(seconds, 6)))
+        self.stage_histogram.observe(seconds, stage=stage)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def finish(self, **attributes):
+        if self.total is not None:
+            return
+        self.total = self.elapsed()
+        self.attributes.update(attributes)
+        if self.slow_log is not None:
+            self.slow_log.offer(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_seconds": round(self.total, 6) if self.total is not None else None,
+            "spans": [{"stage": stage, "offset": offset, "seconds": seconds} for stage, offset, seconds in self.spans],
+            **self.attributes,
+        }
+
+
+# --- Ingestion ---
+# ingest.py runs as its own process, so its metrics live in a separate registry
+# that it writes to a file at the end of a run (see INGEST_METRICS_PATH).
+INGEST_REGISTRY = Registry()
+INGEST_SOURCE_SECONDS = Histogram("ingest_source_seconds", "Wall time of each ingestion source (repo, docs, Telegram).",
+                                  ["source"], registry=INGEST_REGISTRY)
+INGEST_STAGE_SECONDS = Histogram("ingest_stage_seconds",
+                                 "Time per item in each per-source stage: clone (repo), crawl (page), split (file).",
+                                 ["stage", "source_type"], registry=INGEST_REGISTRY)
+INGEST_BATCH_SECONDS = Histogram("ingest_batch_seconds",
+                                 "Time per write batch: embed, then the upsert/update/delete requests to Chroma.",
+                                 ["stage"], registry=INGEST_REGISTRY)
+INGEST_LAST_RUN = Gauge("ingest_last_run", "Counters of the last ingest run (chunks added, files processed, ...).",
+                        ["stat"], registry=INGEST_REGISTRY)
+INGEST_LAST_RUN_SECONDS = Gauge("ingest_last_run_seconds", "Duration of the last ingest run.",
+                                registry=INGEST_REGISTRY)
+INGEST_LAST_RUN_TIMESTAMP = Gauge("ingest_last_run_timestamp_seconds", "When the last ingest run finished.",
+                                  registry=INGEST_REGISTRY)
@@ -0,0 +1,247 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from app.chunking import split_document
+from app.metrics import INGEST_STAGE_SECONDS
+
+_STOP = object()
+
+
+@dataclass
+class SplitTask:
+    """
+    A file or page to be loaded and split in the process pool, then written.
+    Its chunks replace whatever was previously stored for source_key.
+    """
+    source_key: str
+    metadata: dict
+    path: Optional[str] = None
+    text: Optional[str] = None
+    on_done: Optional[Callable] = None
+
+    @property
+    def key(self):
+        return self.source_key
+
+
+@dataclass
+class DeleteTask:
+    """Removes the chunks of a source (or of every source under a key prefix)."""
+    source_key: Optional[str] = None
+    prefix: Optional[str] = None
+    on_done: Optional[Callable] = None
+
+    @property
+    def key(self):
+        return self.source_key or f"{self.prefix}*"
+
+
+@dataclass
+class WriteTask:
+    task: SplitTask
+    chunks: list = field(default_factory=list)
+    chunk_metadatas: list = field(default_factory=list)
+
+    @property
+    def key(self):
+        return self.task.key
+
+    @property
+    def on_done(self):
+        return self.task.on_done
+
+
+class TaskGroup:
+    """
+    Tracks a set of tasks submitted for one source (e.g. one repo) and calls
+    on_complete(ok) once the group is closed and all of them were written.
+    ok is False if any write to the vector store failed.
+    """
+
+    def __init__(self, on_complete):
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self._ok = True
+
+    def track(self, task):
+        with self._lock:
+            self._pending += 1
+        task.on_done = self._task_done
+        return task
+
+    def _task_done(self, ok):
+        with self._lock:
+            self._pending -= 1
+            self._ok = self._ok and ok
+            finished = self._closed and self._pending == 0
+        if finished:
+            self.on_complete(self._ok)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            finished = self._pending == 0
+        if finished:
+            self.on_complete(self._ok)
+
+
+# --- Process pool worker ---
+def split_source(path, text, chunk_size, chunk_overlap):
+    """
+    Runs in a worker process: loads a file (or takes the given text) and
+    splits it along its syntax. Returns (chunks, chunk metadatas, seconds spent).
+    """
+    started = time.perf_counter()
+    if path is not None:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    chunks, chunk_metadatas = split_document(text, path, chunk_size, chunk_overlap)
+    return chunks, chunk_metadatas, time.perf_counter() - started
+
+
+class IngestPipeline:
+    """
+    Streaming ingestion engine. Source producers run in a thread pool and
+    submit tasks; files and pages are loaded and split in a process pool; a
+    single writer thread feeds the chunks to a VectorWriter, which embeds and
+    stores them in large batches. The stages are joined by bounded queues, so
+    a slow stage blocks the ones feeding it instead of letting work pile up
+    in memory. If a stage fails, the pipeline stops taking tasks, drains the
+    queues so nothing blocks, and run() raises.
+    """
+
+    def __init__(self, writer, split_workers=None, queue_size=256, chunk_size=2000, chunk_overlap=200,
+                 flush_interval=2.0):
+        self.writer = writer
+        self.split_workers = split_workers or os.cpu_count() or 1
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.split_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.error = None
+
+    def count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def submit(self, task):
+        """Called by producers; blocks while the split stage is saturated."""
+        if self.error is not None:
+            raise RuntimeError(f"The ingest pipeline failed: {self.error}")
+        self.split_queue.put(task)
+
+    def _fail(self, stage, error):
+        print(f"  The {stage} stage failed, stopping the ingest: {error!r}")
+        if self.error is None:
+            self.error = error
+
+    def _dispatch(self):
+        """Feeds split tasks to the process pool, keeping a bounded number in flight."""
+        max_in_flight = self.split_workers * 2
+        in_flight = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=self.split_workers) as pool:
+                while True:
+                    task = self.split_queue.get()
+                    if task is _STOP:
+                        break
+                    if isinstance(task, DeleteTask):
+                        self.write_queue.put(task)
+                        continue
+                    future = pool.submit(split_source, task.path, task.text, self.chunk_size, self.chunk_overlap)
+                    in_flight.append((future, task))
+                    while len(in_flight) >= max_in_flight:
+                        wait([f for f, _ in in_flight], return_when=FIRST_COMPLETED)
+                        self._forward_done(in_flight)
+                while in_flight:
+                    wait([f for f, _ in in_flight], return_when=FIRST_COMPLETED)
+                    self._forward_done(in_flight)
+        except Exception as e:
+            self._fail("split", e)
+            # Producers may be blocked on the split queue; drain it until run() stops them.
+            while self.split_queue.get() is not _STOP:
+                pass
+        finally:
+            self.write_queue.put(_STOP)
+
+    def _forward_done(self, in_flight):
+        for item in [item for item in in_flight if item[0].done()]:
+            in_flight.remove(item)
+            future, task = item
+            try:
+                chunks, chunk_metadatas, seconds = future.result()
+            except Exception as e:
+                # The source keeps its previous chunks and is retried next run, not recorded as ingested.
+                print(f"  Failed to split {task.key}: {e}")
+                self.count("split_errors")
+                if task.on_done:
+                    task.on_done(False)
+                continue
+            INGEST_STAGE_SECONDS.observe(seconds, stage="split", source_type=task.metadata.get("source", "other"))
+            self.write_queue.put(WriteTask(task=task, chunks=chunks, chunk_metadatas=chunk_metadatas))
+
+    def _write(self):
+        """
+        Hands chunks to the writer, flushing whenever the queue goes idle.
+        Once the writer raises, the remaining items are only drained: their
+        tasks never complete, so their sources aren't recorded as ingested.
+        """
+        while True:
+            try:
+                item = self.write_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if self.error is not None:
+                if item is _STOP:
+                    return
+                continue
+            try:
+                if item is None:
+                    self.writer.flush()
+                elif item is _STOP:
+                    self.writer.flush()
+                    return
+                elif isinstance(item, DeleteTask):
+                    self.writer.remove_source(source_key=item.source_key, prefix=item.prefix, on_done=item.on_done)
+                else:
+                    self.writer.write_source(item.task.source_key, item.task.metadata, item.chunks,
+                                             on_done=item.on_done, chunk_metadatas=item.chunk_metadatas)
+            except Exception as e:
+                self.count("write_errors")
+                self._fail("write", e)
+                if item is _STOP:
+                    return
+
+    def run(self, sources, source_workers=4):
+        """Runs every source producer to completion and drains all stages."""
+        dispatcher = threading.Thread(target=self._dispatch, name="ingest-split")
+        writer = threading.Thread(target=self._write, name="ingest-write")
+        dispatcher.start()
+        writer.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=source_workers, thread_name_prefix="ingest-source") as pool:
+                for future in [pool.submit(source, self) for source in sources]:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"  Source failed: {e}")
+        finally:
+            self.split_queue.put(_STOP)
+            dispatcher.join()
+            writer.join()
+        self.stats.update(self.writer.stats)
+        if self.error is not None:
+            raise RuntimeError(f"The ingest pipeline failed: {self.error}") from self.error
+        return self.stats
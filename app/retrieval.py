@@ -0,0 +1,136 @@
+from app.routing import GENERAL, matches_where
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked lists of ids into {id: score}; ids ranked high in any list score highest."""
+    scores = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return scores
+
+
+def _snapshot_usable(snapshot, query_embedding):
+    return snapshot is not None and query_embedding is not None and len(snapshot) \
+        and snapshot.dimension == len(query_embedding)
+
+
+def defines_symbol(metadata, symbol):
+    return symbol in ((metadata or {}).get("symbols") or "").split(",")
+
+
+def hybrid_search(collection, lexical_index, query, query_embedding=None, n_results=7, candidates=20,
+                  vector_snapshot=None, where=None, symbol=None):
+    """
+    Runs the vector search and (if an index is loaded) the BM25 search, fuses
+    both rankings and returns the top n_results as flat lists of ids,
+    documents, metadatas, embeddings and fused scores. The vector search runs
+    in-process on vector_snapshot when one is loaded and falls back to Chroma
+    otherwise, so collection may be None while a snapshot is loaded. where
+    restricts both searches to chunks whose metadata passes the filter;
+    chunks defining symbol get a third ranking of their own. Blocking; call
+    it from an executor.
+    """
+    lexical_ids = [cid for cid, _ in lexical_index.search(query, candidates, where=where)] if lexical_index else []
+
+    found = {}
+    include = ["documents", "metadatas", "embeddings"]
+    snapshot = vector_snapshot if _snapshot_usable(vector_snapshot, query_embedding) else None
+    if snapshot is not None:
+        vector_ids = [snapshot.ids[row] for row, _ in snapshot.search(query_embedding, candidates, where=where)]
+    else:
+        filters = {"where": where} if where else {}
+        if query_embedding is not None:
+            results = collection.query(query_embeddings=[query_embedding.tolist()], n_results=candidates,
+                                       include=include, **filters)
+        else:
+            results = collection.query(query_texts=[query], n_results=candidates, include=include, **filters)
+        vector_ids = results['ids'][0] if results['ids'] else []
+        if vector_ids:
+            found = {
+                cid: (document, metadata, embedding)
+                for cid, document, metadata, embedding in zip(
+                    vector_ids, results['documents'][0], results['metadatas'][0], results['embeddings'][0]
+                )
+            }
+
+    def fetch(cids):
+        """Fills in the text, metadata and embedding of chunks not yet in found."""
+        missing = [cid for cid in cids if cid not in found]
+        if snapshot is not None:
+            for cid in missing:
+                row = snapshot.row_of(cid)
+                if row is not None:
+                    record = snapshot.record(row)
+                    found[cid] = (record["document"], record["metadata"], snapshot.embedding(row))
+            missing = [cid for cid in missing if cid not in found]
+        if missing and collection is not None:
+            extra = collection.get(ids=missing, include=include)
+            for cid, document, metadata, embedding in zip(
+                extra['ids'], extra['documents'], extra['metadatas'], extra['embeddings']
+            ):
+                found[cid] = (document, metadata, embedding)
+
+    rankings = [vector_ids, lexical_ids]
+    symbol_ids = []
+    if symbol:
+        pool = list(dict.fromkeys(vector_ids + lexical_ids))
+        fetch(pool)
+        symbol_ids = [cid for cid in pool if cid in found and defines_symbol(found[cid][1], symbol)]
+        rankings.append(symbol_ids)
+    scores = reciprocal_rank_fusion(rankings)
+    fused_ids = sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+    # Chunks only the lexical index found (or all of them, with a snapshot) still need their text.
+    fetch(fused_ids)
+    fused_ids = [cid for cid in fused_ids if cid in found]
+    if where:
+        # Lexical indexes built before chunks had routing fields can't filter; drop what they let through.
+        fused_ids = [cid for cid in fused_ids if matches_where(found[cid][1], where)]
+    return {
+        "ids": fused_ids,
+        "documents": [found[cid][0] for cid in fused_ids],
+        "metadatas": [found[cid][1] for cid in fused_ids],
+        "embeddings": [found[cid][2] for cid in fused_ids],
+        "scores": [scores[cid] for cid in fused_ids],
+        "lexical_hits": len(set(lexical_ids) & set(fused_ids)),
+        "symbol_hits": len(symbol_ids),
+        "backend": "snapshot" if snapshot is not None else "chroma",
+    }
+
+
+def routed_search(collection, lexical_index, query, route, query_embedding=None, n_results=7, candidates=20,
+                  vector_snapshot=None, min_results=3):
+    """
+    hybrid_search within the route's filter. When the filter leaves fewer
+    than min_results chunks and the route allows it, the rest is filled from
+    an unfiltered search, ranked after the filtered results. A symbol route
+    that finds no chunk defining the symbol (it was no symbol after all, or
+    it isn't indexed) is searched as a general question instead.
+    """
+    results = hybrid_search(collection, lexical_index, query, query_embedding, n_results, candidates,
+                            vector_snapshot, where=route.where, symbol=route.symbol)
+    if route.symbol and not results["symbol_hits"] and route.fallback:
+        results = hybrid_search(collection, lexical_index, query, query_embedding, n_results, candidates,
+                                vector_snapshot)
+        route = GENERAL
+    results["route"] = route.name
+    results["filtered_hits"] = len(results["ids"])
+    if not route.where or not route.fallback or len(results["ids"]) >= min_results:
+        return results
+
+    broad = hybrid_search(collection, lexical_index, query, query_embedding, n_results, candidates,
+                          vector_snapshot, symbol=route.symbol)
+    seen = set(results["ids"])
+    # Scores of the filled-in chunks are scaled below the filtered ones, so they stay ranked after them.
+    floor = min(results["scores"], default=1.0)
+    top = max(broad["scores"], default=1.0) or 1.0
+    for i, cid in enumerate(broad["ids"]):
+        if len(results["ids"]) >= n_results:
+            break
+        if cid in seen:
+            continue
+        for field in ("ids", "documents", "metadatas", "embeddings"):
+            results[field].append(broad[field][i])
+        results["scores"].append(0.5 * floor * broad["scores"][i] / top)
+    return results
@@ -0,0 +1,130 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+# Chunk metadata fields that retrieval can filter on. The vector snapshot and
+# the lexical index keep a column of each, so filters never parse records.
+ROUTING_FIELDS = ("source", "kind", "language")
+
+# Identifiers that are almost certainly code: snake_case, camelCase, CONSTANT_CASE, a call like main(),
+# or anything in backticks.
+_IDENTIFIER = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)(\(\))?")
+_BACKTICKED = re.compile(r"`([A-Za-z_][A-Za-z0-9_]*)(?:\(\))?`")
+_CODE_WORDS = re.compile(r"\b(?:function|struct|enum|macro|define|symbol|variable|target|method|class)\s+"
+                         r"([A-Za-z_][A-Za-z0-9_]*)(\(\))?")
+_HOW_TO = re.compile(r"\bhow (?:do|can|should|would|to) (?:i|we|you)\b|\bhow to\b|\bstep[- ]by[- ]step\b"
+                     r"|\btutorial\b|\bguide\b|\bкак\b|如何|怎么", re.IGNORECASE)
+
+
+@dataclass
+class Route:
+    """
+    Where a question is searched. where is a Chroma-style metadata filter;
+    symbol is an identifier whose definition should rank first. With
+    fallback, a filtered search that finds too little is topped up from the
+    whole knowledge base.
+    """
+    name: str
+    where: Optional[dict] = None
+    symbol: Optional[str] = None
+    fallback: bool = True
+
+
+GENERAL = Route("general")
+
+
+def _looks_like_code(word, call):
+    return bool(call) or "_" in word.strip("_") or bool(re.fullmatch(r"[a-z]+[A-Z][A-Za-z0-9]*", word))
+
+
+def find_symbol(query):
+    """
+    The first identifier in the query that looks like code, or None. A word
+    after "function", "macro", "target" and the like only counts when it
+    looks like code itself: in "the target of the build" it is plain English.
+    """
+    match = _BACKTICKED.search(query)
+    if match:
+        return match.group(1)
+    for pattern in (_CODE_WORDS, _IDENTIFIER):
+        for match in pattern.finditer(query):
+            if _looks_like_code(*match.groups()):
+                return match.group(1)
+    return None
+
+
+def route_query(query):
+    """
+    Picks the part of the knowledge base to search: symbol lookups only search
+    code, "how do I" questions search documentation first, anything else
+    searches everything.
+    """
+    symbol = find_symbol(query)
+    if symbol:
+        return Route("symbol", where={"kind": "code"}, symbol=symbol)
+    if _HOW_TO.search(query):
+        return Route("howto", where={"$or": [{"source": "docs"}, {"kind": "docs"}]})
+    return GENERAL
+
+
+# --- Metadata filters ---
+# The subset of Chroma's where syntax the routes use: equality, $eq, $ne, $in, $nin, $and and $or.
+def _matches_condition(value, condition):
+    if not isinstance(condition, dict):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == "$eq" and value != operand:
+            return False
+        if operator == "$ne" and value == operand:
+            return False
+        if operator == "$in" and value not in operand:
+            return False
+        if operator == "$nin" and value in operand:
+            return False
+    return True
+
+
+def matches_where(metadata, where):
+    """Whether one record's metadata passes the filter."""
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, part) for part in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+def field_columns(metadatas):
+    """Per-field value lists of ROUTING_FIELDS for a sequence of metadata dicts (None where unset)."""
+    columns = {field: [] for field in ROUTING_FIELDS}
+    for metadata in metadatas:
+        metadata = metadata or {}
+        for field in ROUTING_FIELDS:
+            columns[field].append(metadata.get(field))
+    return columns
+
+
+def filter_mask(columns, where, count):
+    """
+    Boolean mask of the rows whose ROUTING_FIELDS columns pass the filter.
+    Raises KeyError if the filter uses a field without a column.
+    """
+    mask = np.ones(count, dtype=bool)
+    for key, condition in where.items():
+        if key == "$and":
+            for part in condition:
+                mask &= filter_mask(columns, part, count)
+        elif key == "$or":
+            mask &= np.logical_or.reduce([filter_mask(columns, part, count) for part in condition])
+        else:
+            values = columns[key]
+            mask &= np.fromiter((_matches_condition(value, condition) for value in values), dtype=bool,
+                                count=count)
+    return mask
@@ -0,0 +1,120 @@
+import json
+
+from app.db import database
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Workers LISTEN on this channel so new jobs start without waiting for the next poll.
+NOTIFY_CHANNEL = "scrape_jobs"
+
+JOB_COLUMNS = """
+    id, chat_id, direction, message_limit, status, progress, error, attempts, failed_attempts,
+    run_after, created_at, started_at, heartbeat_at, finished_at
+"""
+
+
+def job_dict(row):
+    if row is None:
+        return None
+    job = dict(row._mapping)
+    if isinstance(job["progress"], str):
+        job["progress"] = json.loads(job["progress"])
+    return job
+
+
+async def enqueue_job(chat_id, direction, limit=None):
+    """
+    Queues a scrape and returns (job, created). If the chat already has a
+    queued or running job in that direction, that job is returned instead.
+    """
+    async with database.transaction():
+        row = await database.fetch_one(f"""
+            INSERT INTO scrape_jobs (chat_id, direction, message_limit)
+            VALUES (:chat_id, :direction, :message_limit)
+            ON CONFLICT (chat_id, direction) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING {JOB_COLUMNS}
+        """, {"chat_id": chat_id, "direction": direction, "message_limit": limit})
+        if row is not None:
+            await database.execute(f"NOTIFY {NOTIFY_CHANNEL}")
+            return job_dict(row), True
+        row = await database.fetch_one(f"""
+            SELECT {JOB_COLUMNS} FROM scrape_jobs
+            WHERE chat_id = :chat_id AND direction = :direction AND status IN ('queued', 'running')
+        """, {"chat_id": chat_id, "direction": direction})
+        return job_dict(row), False
+
+
+async def get_job(job_id):
+    return job_dict(await database.fetch_one(
+        f"SELECT {JOB_COLUMNS} FROM scrape_jobs WHERE id = :id", {"id": job_id}
+    ))
+
+
+async def list_jobs(chat_id=None, limit=20):
+    rows = await database.fetch_all(f"""
+        SELECT {JOB_COLUMNS} FROM scrape_jobs
+        WHERE CAST(:chat_id AS BIGINT) IS NULL OR chat_id = :chat_id
+        ORDER BY id DESC LIMIT :limit
+    """, {"chat_id": chat_id, "limit": limit})
+    return [job_dict(row) for row in rows]
+
+
+async def claim_job():
+    """Takes the oldest runnable job; SKIP LOCKED keeps concurrent workers from taking the same one."""
+    return job_dict(await database.fetch_one(f"""
+        UPDATE scrape_jobs SET status = 'running', attempts = attempts + 1,
+            started_at = now(), heartbeat_at = now(), error = NULL
+        WHERE id = (
+            SELECT id FROM scrape_jobs
+            WHERE status = 'queued' AND run_after <= now()
+            ORDER BY run_after, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING {JOB_COLUMNS}
+    """))
+
+
+async def update_progress(job_id, progress):
+    await database.execute(
+        "UPDATE scrape_jobs SET progress = CAST(:progress AS JSONB), heartbeat_at = now() WHERE id = :id",
+        {"id": job_id, "progress": json.dumps(progress, default=str)},
+    )
+
+
+async def finish_job(job_id, progress, error=None):
+    await database.execute("""
+        UPDATE scrape_jobs SET status = :status, progress = CAST(:progress AS JSONB), error = :error,
+            failed_attempts = failed_attempts + CASE WHEN CAST(:error AS TEXT) IS NULL THEN 0 ELSE 1 END,
+            finished_at = now(), heartbeat_at = now()
+        WHERE id = :id
+    """, {"id": job_id, "status": FAILED if error else DONE, "error": error,
+          "progress": json.dumps(progress, default=str)})
+
+
+async def requeue_job(job_id, progress, delay_seconds, message_limit, error=None):
+    """
+    Puts a running job back in the queue to continue (from the chat's
+    watermarks) after a delay, with message_limit lowered to what is left.
+    A requeue with an error counts as a failed attempt.
+    """
+    await database.execute("""
+        UPDATE scrape_jobs SET status = 'queued', progress = CAST(:progress AS JSONB), error = :error,
+            failed_attempts = failed_attempts + CASE WHEN CAST(:error AS TEXT) IS NULL THEN 0 ELSE 1 END,
+            message_limit = :message_limit, run_after = now() + make_interval(secs => :delay)
+        WHERE id = :id
+    """, {"id": job_id, "delay": float(delay_seconds), "error": error, "message_limit": message_limit,
+          "progress": json.dumps(progress, default=str)})
+
+
+async def requeue_stale_jobs(stale_seconds):
+    """Requeues running jobs whose worker stopped sending heartbeats (crashed or was restarted)."""
+    rows = await database.fetch_all("""
+        UPDATE scrape_jobs SET status = 'queued', run_after = now()
+        WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => :stale)
+        RETURNING id
+    """, {"stale": float(stale_seconds)})
+    return [row["id"] for row in rows]
@@ -0,0 +1,133 @@
+#
+# Scrape worker: the only process that talks to Telegram.
+# Run with: python -m app.scrape_worker
+#
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from app.config import (
+    DATABASE_URL, TARGET_CHATS, ENTITY_CACHE_TTL,
+    SCRAPE_WORKER_POLL_INTERVAL, SCRAPE_JOB_STALE_SECONDS, SCRAPE_JOB_HEARTBEAT_SECONDS, SCRAPE_JOB_MAX_ATTEMPTS,
+)
+from app.db import apply_schema, database, save_telegram_chats
+from app.scrape_jobs import (
+    NOTIFY_CHANNEL, claim_job, finish_job, requeue_job, requeue_stale_jobs, update_progress,
+)
+from app.scraper import create_client, entity_cache, scrape_chat
+
+COUNTERS = ("fetched", "inserted", "duplicates", "skipped")
+
+
+async def refresh_chats(client):
+    """Resolves TARGET_CHATS and stores them for the API's /chats endpoint."""
+    resolved = await entity_cache.resolve_names(client, sorted(TARGET_CHATS))
+    await save_telegram_chats([
+        {
+            "chat_id": entity.id,
+            "name": name,
+            "username": getattr(entity, "username", None),
+            "type": type(entity).__name__,
+        }
+        for name, entity in resolved
+    ])
+    print(f"WORKER: Resolved {len(resolved)} of {len(TARGET_CHATS)} target chats.")
+
+
+async def heartbeat(job_id, progress):
+    # Keeps the job from looking stale while the scrape sleeps through a FloodWait.
+    while True:
+        await asyncio.sleep(SCRAPE_JOB_HEARTBEAT_SECONDS)
+        await update_progress(job_id, progress)
+
+
+async def run_job(client, job):
+    """Runs one claimed job. Counters accumulate across requeued attempts of the same job."""
+    previous = job["progress"] or {}
+    progress = {key: previous.get(key, 0) for key in COUNTERS}
+    limit = job["message_limit"]
+    print(f"WORKER: Job {job['id']}: {job['direction']} scrape of chat {job['chat_id']} "
+          f"(limit {limit if limit is not None else 'none'}, run {job['attempts']}, "
+          f"{job['failed_attempts']} failed).")
+
+    async def on_progress(stats):
+        progress.update({key: previous.get(key, 0) + stats[key] for key in COUNTERS})
+        await update_progress(job["id"], progress)
+
+    beat = asyncio.create_task(heartbeat(job["id"], progress))
+    try:
+        stats = await scrape_chat(client, job["chat_id"], direction=job["direction"], limit=limit,
+                                  on_progress=on_progress)
+    except Exception as e:
+        print(f"WORKER: Job {job['id']} failed: {e!r}")
+        # Runs that ended in a FloodWait pause don't count, so only errors use up attempts.
+        failures = job["failed_attempts"] + 1
+        if failures < SCRAPE_JOB_MAX_ATTEMPTS:
+            # Batches already stored are kept; the retry continues from the watermarks.
+            await requeue_job(job["id"], progress, delay_seconds=30 * 2 ** (failures - 1),
+                              message_limit=limit, error=str(e))
+        else:
+            await finish_job(job["id"], progress, error=str(e))
+        return
+    finally:
+        beat.cancel()
+
+    progress.update({key: stats[key] for key in ("newest_id", "oldest_id", "backfill_complete")})
+    if stats["retry_after"]:
+        remaining = None if limit is None else max(limit - stats["fetched"], 0)
+        print(f"WORKER: Job {job['id']} paused by a FloodWait; continuing in {stats['retry_after']}s.")
+        # Tells clients this requeue waits out a rate limit, unlike a retry after an error (which sets error).
+        progress["flood_wait_until"] = datetime.now(timezone.utc) + timedelta(seconds=stats["retry_after"])
+        await requeue_job(job["id"], progress, delay_seconds=stats["retry_after"], message_limit=remaining)
+    else:
+        print(f"WORKER: Job {job['id']} done: {progress['inserted']} new messages.")
+        await finish_job(job["id"], progress)
+
+
+async def main():
+    await database.connect()
+    await apply_schema()
+    client = create_client()
+    await client.start()
+
+    # Whatever was running when the worker last stopped is picked up again.
+    requeued = await requeue_stale_jobs(0)
+    if requeued:
+        print(f"WORKER: Requeued interrupted jobs {requeued}.")
+
+    wake = asyncio.Event()
+    listener = await asyncpg.connect(DATABASE_URL)
+    await listener.add_listener(NOTIFY_CHANNEL, lambda *args: wake.set())
+
+    chats_refresh_at = 0.0
+    print("WORKER: Waiting for scrape jobs.")
+    try:
+        while True:
+            if time.monotonic() >= chats_refresh_at:
+                try:
+                    await refresh_chats(client)
+                    chats_refresh_at = time.monotonic() + ENTITY_CACHE_TTL
+                except Exception as e:
+                    print(f"WORKER: Could not refresh target chats: {e}")
+                    chats_refresh_at = time.monotonic() + 60
+
+            wake.clear()
+            await requeue_stale_jobs(SCRAPE_JOB_STALE_SECONDS)
+            job = await claim_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(wake.wait(), SCRAPE_WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await run_job(client, job)
+    finally:
+        await listener.close()
+        await client.disconnect()
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
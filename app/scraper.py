@@ -1,35 +1,191 @@
-from telethon import TelegramClient
-from app.config import API_ID, API_HASH, SESSION_PATH
+import asyncio
+import time
 
-client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
+from telethon import TelegramClient, errors
+from app.config import (
+    API_ID, API_HASH, SESSION_PATH,
+    SCRAPE_FETCH_BATCH_SIZE, SCRAPE_FLOOD_SLEEP_THRESHOLD, SCRAPE_MAX_FLOOD_WAIT, ENTITY_CACHE_TTL,
+)
+from app.db import get_scrape_progress, save_message_batch
 
-from telethon.tl.types import Channel
+from telethon.tl.types import Channel, PeerChannel
 
-async def fetch_messages(client, chat, limit):
-    
-    channel_id = chat if chat == "me" else int(chat)
+NEWER = "newer"
+OLDER = "older"
 
-    dialogs = await client.get_dialogs()
 
-    channel_entity = None
-    for dialog in dialogs:
-        if isinstance(dialog.entity, Channel) and dialog.entity.id == channel_id:
-            channel_entity = dialog.entity
-            break
+def create_client():
+    """
+    The Telethon client. Its SQLite session can only be used by one process,
+    so only app/scrape_worker.py creates it.
+    """
+    client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
+    # Telethon sleeps through flood waits up to this long by itself; longer ones raise FloodWaitError.
+    client.flood_sleep_threshold = SCRAPE_FLOOD_SLEEP_THRESHOLD
+    return client
 
-    if channel_entity is None:
-        raise ValueError(f"Channel with id {channel_id} not found in dialogs")
 
-    messages = []
-    async for message in client.iter_messages(channel_entity, limit=limit):
-        # Convert message to JSON-serializable dict
-        messages.append({
-            "id": message.id,
-            "date": message.date.isoformat() if message.date else None,
-            "text": message.message,
-            "sender_id": message.sender_id,
-            "media": str(message.media) if message.media else None,
-            # Add other fields you want to expose here
-        })
+class EntityCache:
+    """
+    Resolves chats to Telethon entities without enumerating the dialog list
+    on every call. Entities are cached by chat id and by dialog name for ttl
+    seconds. An unknown or expired id is looked up directly with get_entity
+    (served from the session's entity cache, or one small request), and the
+    full dialog list is only downloaded to resolve names, at most once per ttl.
+    """
 
-    return messages
+    def __init__(self, ttl=3600.0):
+        self.ttl = ttl
+        self._by_id = {}
+        self._by_name = {}
+        self._dialogs_loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[1] < self.ttl
+
+    def _remember(self, entity, name=None):
+        now = time.monotonic()
+        self._by_id[entity.id] = (entity, now)
+        if name is not None:
+            self._by_name[name] = (entity, now)
+
+    async def _load_dialogs(self, client):
+        async with self._lock:
+            if time.monotonic() - self._dialogs_loaded_at < self.ttl:
+                return
+            started = time.monotonic()
+            dialogs = await client.get_dialogs()
+            for dialog in dialogs:
+                self._remember(dialog.entity, dialog.name)
+            self._dialogs_loaded_at = time.monotonic()
+            print(f"SCRAPER: Cached {len(dialogs)} dialogs in {time.monotonic() - started:.2f}s.")
+
+    async def resolve_channel(self, client, chat):
+        if chat == "me":
+            return await client.get_entity("me")
+        channel_id = int(chat)
+        entry = self._by_id.get(channel_id)
+        if self._fresh(entry) and isinstance(entry[0], Channel):
+            return entry[0]
+        try:
+            entity = await client.get_entity(PeerChannel(channel_id))
+        except (ValueError, errors.RPCError) as e:
+            print(f"SCRAPER: get_entity failed for {channel_id} ({e}); falling back to the dialog list.")
+            await self._load_dialogs(client)
+            entry = self._by_id.get(channel_id)
+            entity = entry[0] if entry else None
+        if not isinstance(entity, Channel):
+            raise ValueError(f"Channel with id {channel_id} not found in dialogs")
+        self._remember(entity)
+        return entity
+
+    async def resolve_names(self, client, names):
+        """Returns [(name, entity)] for the dialog names that exist, refreshing the dialog list when stale."""
+        if not all(self._fresh(self._by_name.get(name)) for name in names):
+            try:
+                await self._load_dialogs(client)
+            except Exception as e:
+                # Keep serving what we have; the next call retries the refresh.
+                if not self._by_name:
+                    raise
+                print(f"SCRAPER: Could not refresh dialogs, using cached entities: {e}")
+        return [(name, self._by_name[name][0]) for name in names if name in self._by_name]
+
+
+entity_cache = EntityCache(ttl=ENTITY_CACHE_TTL)
+
+
+async def resolve_channel(client, chat):
+    return await entity_cache.resolve_channel(client, chat)
+
+
+def message_to_dict(message):
+    # Convert message to JSON-serializable dict
+    return {
+        "id": message.id,
+        "date": message.date.isoformat() if message.date else None,
+        "text": message.message,
+        "sender_id": message.sender_id,
+        "media": str(message.media) if message.media else None,
+        # Add other fields you want to expose here
+    }
+
+
+async def iter_message_batches(client, entity, batch_size, limit=None, min_id=0, max_id=0, reverse=False):
+    """Yields lists of message dicts as they arrive instead of buffering the whole history."""
+    batch = []
+    async for message in client.iter_messages(entity, limit=limit, min_id=min_id, max_id=max_id, reverse=reverse):
+        batch.append(message_to_dict(message))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def scrape_chat(client, chat_id, direction=NEWER, limit=None, batch_size=SCRAPE_FETCH_BATCH_SIZE,
+                      on_progress=None):
+    """
+    Scrapes one chat incrementally. NEWER fetches only messages above the
+    chat's newest stored id (oldest first, so every committed batch is a safe
+    resume point); OLDER continues the backfill below the oldest stored id.
+    A chat with no watermarks yet starts from its newest message going back.
+    limit caps the messages fetched in this call (None fetches everything).
+
+    Each batch is committed together with the watermarks, so a restart or a
+    FloodWait loses nothing: waits up to SCRAPE_MAX_FLOOD_WAIT seconds are
+    slept through and the scrape resumes from the watermarks, longer ones end
+    the call with retry_after set.
+    """
+    entity = await resolve_channel(client, chat_id)
+    stats = {"fetched": 0, "inserted": 0, "duplicates": 0, "skipped": 0, "retry_after": None}
+
+    while limit is None or stats["fetched"] < limit:
+        progress = await get_scrape_progress(chat_id)
+        remaining = None if limit is None else limit - stats["fetched"]
+        if progress is None:
+            batches = iter_message_batches(client, entity, batch_size, limit=remaining)
+            backfilling = True
+        elif direction == NEWER:
+            batches = iter_message_batches(client, entity, batch_size, limit=remaining,
+                                           min_id=progress["newest_id"], reverse=True)
+            backfilling = False
+        else:
+            if progress["backfill_complete"]:
+                break
+            batches = iter_message_batches(client, entity, batch_size, limit=remaining,
+                                           max_id=progress["oldest_id"])
+            backfilling = True
+
+        fetched_before = stats["fetched"]
+        try:
+            async for batch in batches:
+                report = await save_message_batch(batch, chat_id)
+                stats["fetched"] += len(batch)
+                for key in ("inserted", "duplicates", "skipped"):
+                    stats[key] += report[key]
+                if on_progress:
+                    await on_progress(stats)
+        except errors.FloodWaitError as e:
+            if e.seconds > SCRAPE_MAX_FLOOD_WAIT:
+                print(f"SCRAPING: FloodWait of {e.seconds}s for chat {chat_id}; stopping, progress is saved.")
+                stats["retry_after"] = e.seconds
+                break
+            print(f"SCRAPING: FloodWait of {e.seconds}s for chat {chat_id}; resuming afterwards.")
+            await asyncio.sleep(e.seconds)
+            continue
+
+        fetched = stats["fetched"] - fetched_before
+        if backfilling and (remaining is None or fetched < remaining):
+            # The iterator ran out before the limit: nothing older is left.
+            await save_message_batch([], chat_id, backfill_complete=True)
+        break
+
+    progress = await get_scrape_progress(chat_id) or {}
+    stats.update({
+        "newest_id": progress.get("newest_id"),
+        "oldest_id": progress.get("oldest_id"),
+        "backfill_complete": progress.get("backfill_complete", False),
+    })
+    return stats
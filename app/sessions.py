@@ -0,0 +1,234 @@
+import re
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from app.db import database
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Follow-ups lean on the previous turn: they open with a connective ("what about ...?"), point back at it
+# ("the same for ..."), or use a pronoun for its subject.
+_FOLLOW_UP_START = re.compile(r"^(?:and|but|also|so|then|what about|how about|what if|why not|ok|okay|"
+                              r"и|а|также|тогда|还有|那么?)\b|^why\W*$", re.IGNORECASE)
+_BACK_REFERENCE = re.compile(r"\b(?:the same|the above|the previous|that one|this one)\b|它|这个|那个", re.IGNORECASE)
+_PRONOUNS = {"it", "its", "they", "them", "their", "он", "она", "оно", "они", "его", "её", "их"}
+_DEMONSTRATIVES = {"this", "that", "these", "those", "это", "этот", "эта", "эти"}
+# "is it possible to ..." is not about anything said before.
+_DUMMY_IT = {"possible", "necessary", "safe", "ok", "okay", "worth", "true", "normal", "better", "easy", "hard"}
+# Words that say nothing about the subject of a question: a question made of only these and a pronoun is a follow-up.
+_FUNCTION_WORDS = {
+    "what", "when", "where", "which", "who", "whom", "whose", "why", "how", "is", "are", "was", "were", "be", "been",
+    "am", "do", "does", "did", "can", "could", "should", "would", "will", "shall", "may", "might", "must", "has",
+    "have", "had", "i", "me", "my", "we", "our", "you", "your", "he", "she", "him", "his", "her", "a", "an", "the",
+    "to", "of", "in", "on", "at", "for", "with", "from", "by", "about", "into", "over", "under", "via", "as", "than",
+    "and", "or", "but", "if", "then", "so", "not", "no", "there", "here", "any", "some", "all", "also", "just",
+    "still", "again", "more", "up", "out", "mean", "means", "work", "works", "get", "use", "set", "make", "need",
+    "want", "try", "fix", "change", "configure", "enable", "disable", "install", "flash", "run", "build", "update",
+    "support", "supports", "как", "что", "где", "почему", "можно", "ли", "в", "на", "с", "для", "не",
+}
+_WORD = re.compile(r"\w+")
+@dataclass
+class Turn:
+    query: str
+    standalone_query: str
+    answer: str
+
+
+@dataclass
+class ChatSession:
+    """
+    A conversation. turns holds the window replayed into the prompt, which
+    starts at turn number history_start; the context block is reused across
+    turns while the questions stay close to context_embedding.
+    """
+    id: str
+    turns: list = field(default_factory=list)
+    turn_count: int = 0
+    history_start: int = 0
+    context: Optional[str] = None
+    context_query: Optional[str] = None
+    context_embedding: Optional[np.ndarray] = None
+
+    def set_context(self, context, query, embedding):
+        self.context, self.context_query, self.context_embedding = context, query, embedding
+
+    def context_matches(self, embedding, threshold):
+        """Whether a question with this embedding is still on the topic the context was retrieved for."""
+        if self.context is None or self.context_embedding is None or embedding is None:
+            return False
+        return float(self.context_embedding @ embedding) >= threshold
+
+
+def _is_reference(words, i):
+    word, following = words[i], words[i + 1] if i + 1 < len(words) else None
+    if word in _PRONOUNS:
+        return not (word == "it" and following in _DUMMY_IT)
+    # "this camera" names its subject; a demonstrative on its own ("how do I flash this?") refers back.
+    return word in _DEMONSTRATIVES and (following is None or following in _FUNCTION_WORDS)
+
+
+def is_follow_up(query):
+    """
+    Whether a question only makes sense after the previous turn. A pronoun
+    counts when it comes within the first three words ("does it support
+    h265?") or the question has no other subject ("how do I enable it?").
+    """
+    text = query.strip()
+    if _FOLLOW_UP_START.match(text) or _BACK_REFERENCE.search(text):
+        return True
+    words = _WORD.findall(text.lower())
+    references = [i for i in range(len(words)) if _is_reference(words, i)]
+    if not references:
+        return False
+    subjects = [w for w in words if w not in _FUNCTION_WORDS and w not in _PRONOUNS and w not in _DEMONSTRATIVES]
+    return references[0] < 3 or not subjects
+
+
+def _topic(turn):
+    """The retrieval query of a turn without the follow-up that was appended to it."""
+    if turn.standalone_query != turn.query and turn.standalone_query.endswith(turn.query):
+        return turn.standalone_query[:-len(turn.query)].rstrip()
+    return turn.standalone_query
+
+
+def standalone_query(query, session, max_words=48):
+    """
+    The retrieval query for a turn. A follow-up ("what about gk7205?") is
+    prefixed with the topic of the previous turn (its question, or for a
+    follow-up the question it followed up on), keeping only the last
+    max_words words, so it finds the same topic without asking the model to
+    rewrite it.
+    """
+    if not session.turns or not is_follow_up(query):
+        return query
+    words = f"{_topic(session.turns[-1])} {query}".split()
+    return " ".join(words[-max_words:])
+
+
+def _row_session(row, turns):
+    session = dict(row._mapping)
+    embedding = session["context_embedding"]
+    return ChatSession(
+        id=session["id"],
+        turns=[Turn(**dict(t._mapping)) for t in turns],
+        turn_count=session["turn_count"],
+        history_start=session["history_start"],
+        context=session["context"],
+        context_query=session["context_query"],
+        context_embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+    )
+
+
+class SessionStore:
+    """
+    Chat sessions in Postgres with an LRU cache of recently used ones in
+    front, so a turn costs one primary key lookup (to notice turns another
+    API process added) instead of loading the history. Only the last history_turns
+    turns are replayed; once a session has more, the window drops to the
+    newest half at once, so the prompt prefix only changes every few turns.
+    """
+
+    def __init__(self, max_cached=1024, history_turns=6):
+        self.max_cached = max_cached
+        self.history_turns = history_turns
+        self._cache = OrderedDict()
+
+    def _remember(self, session):
+        self._cache[session.id] = session
+        self._cache.move_to_end(session.id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def get(self, session_id):
+        """Returns the session, or a new one (with a new id) when session_id is missing or unknown."""
+        if session_id and SESSION_ID.match(session_id):
+            session = self._cache.get(session_id)
+            try:
+                if session is None or await self._stale(session):
+                    session = await self.load(session_id) or session
+            except Exception as e:
+                print(f"SESSIONS: Could not load session {session_id}: {e}")
+            if session is not None:
+                self._remember(session)
+                return session
+        session = ChatSession(id=uuid.uuid4().hex)
+        self._remember(session)
+        return session
+
+    async def _stale(self, session):
+        """Whether another API process has added turns since the session was cached."""
+        turn_count = await database.fetch_val("SELECT turn_count FROM chat_sessions WHERE id = :id",
+                                              {"id": session.id})
+        return turn_count is not None and turn_count != session.turn_count
+
+    async def load(self, session_id):
+        row = await database.fetch_one("SELECT * FROM chat_sessions WHERE id = :id", {"id": session_id})
+        if row is None:
+            return None
+        turns = await database.fetch_all("""
+            SELECT query, standalone_query, answer FROM chat_turns
+            WHERE session_id = :id AND turn >= :history_start ORDER BY turn
+        """, {"id": session_id, "history_start": row._mapping["history_start"]})
+        return _row_session(row, turns)
+
+    async def add_turn(self, session, turn):
+        """Appends a finished turn (and the session's current context) and stores both."""
+        session.turns.append(turn)
+        session.turn_count += 1
+        if len(session.turns) > self.history_turns:
+            session.turns = session.turns[-max(1, self.history_turns // 2):]
+            session.history_start = session.turn_count - len(session.turns)
+        embedding = session.context_embedding.tolist() if session.context_embedding is not None else None
+        try:
+            async with database.transaction():
+                await database.execute("""
+                    INSERT INTO chat_sessions (id, turn_count, history_start, context, context_query, context_embedding)
+                    VALUES (:id, :turn_count, :history_start, :context, :context_query, :context_embedding)
+                    ON CONFLICT (id) DO UPDATE SET
+                        turn_count = EXCLUDED.turn_count,
+                        history_start = EXCLUDED.history_start,
+                        context = EXCLUDED.context,
+                        context_query = EXCLUDED.context_query,
+                        context_embedding = EXCLUDED.context_embedding,
+                        updated_at = now()
+                """, {"id": session.id, "turn_count": session.turn_count, "history_start": session.history_start,
+                      "context": session.context, "context_query": session.context_query,
+                      "context_embedding": embedding})
+                await database.execute("""
+                    INSERT INTO chat_turns (session_id, turn, query, standalone_query, answer)
+                    VALUES (:session_id, :turn, :query, :standalone_query, :answer)
+                """, {"session_id": session.id, "turn": session.turn_count - 1, "query": turn.query,
+                      "standalone_query": turn.standalone_query, "answer": turn.answer})
+        except Exception as e:
+            # The turn still counts for this process; only the stored history misses it.
+            print(f"SESSIONS: Could not store turn {session.turn_count} of session {session.id}: {e}")
+
+    async def history(self, session_id):
+        """Every stored turn of a session, or None if there is no such session."""
+        row = await database.fetch_one("SELECT id, created_at, updated_at FROM chat_sessions WHERE id = :id",
+                                       {"id": session_id})
+        if row is None:
+            return None
+        turns = await database.fetch_all("""
+            SELECT turn, query, standalone_query, answer, created_at FROM chat_turns
+            WHERE session_id = :id ORDER BY turn
+        """, {"id": session_id})
+        return {**dict(row._mapping), "turns": [dict(t._mapping) for t in turns]}
+
+    async def delete(self, session_id):
+        self._cache.pop(session_id, None)
+        row = await database.fetch_one("DELETE FROM chat_sessions WHERE id = :id RETURNING id", {"id": session_id})
+        return row is not None
+
+    async def expire(self, max_age):
+        """Deletes sessions idle for more than max_age seconds (their turns go with them)."""
+        rows = await database.fetch_all("""
+            DELETE FROM chat_sessions WHERE updated_at < now() - make_interval(secs => :max_age) RETURNING id
+        """, {"max_age": max_age})
+        for row in rows:
+            self._cache.pop(row._mapping["id"], None)
+        return len(rows)
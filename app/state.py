@@ -0,0 +1,20 @@
+import json
+import os
+
+
+def load_json_state(path):
+    """Loads a JSON state file, returning an empty dict if it doesn't exist yet."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_json_state(path, state):
+    """Writes a JSON state file atomically so an interrupted run can't corrupt it."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
@@ -0,0 +1,115 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import asyncpg
+
+# Messages not yet covered by a chat's [low, high] watermark range, in
+# conversation order. Chats without watermarks are read in full.
+UNINGESTED_MESSAGES = """
+    SELECT m.chat_id, m.id, m.sender_id, m.date, m.text, c.name AS chat_name
+    FROM messages m
+    LEFT JOIN unnest($1::BIGINT[], $2::TIMESTAMPTZ[], $3::BIGINT[], $4::TIMESTAMPTZ[], $5::BIGINT[])
+        AS w(chat_id, low_date, low_id, high_date, high_id) ON w.chat_id = m.chat_id
+    LEFT JOIN telegram_chats c ON c.chat_id = m.chat_id
+    WHERE m.text IS NOT NULL AND m.text <> ''
+      AND (w.chat_id IS NULL OR w.high_id IS NULL
+           OR (m.date, m.id) < (w.low_date, w.low_id)
+           OR (m.date, m.id) > (w.high_date, w.high_id))
+    ORDER BY m.chat_id, m.date, m.id
+"""
+
+
+@dataclass
+class ConversationWindow:
+    """A run of messages from one chat with no long pauses, embedded as one chunk."""
+    chat_id: int
+    chat_name: str
+    messages: list = field(default_factory=list)
+    size: int = 0
+
+    @property
+    def first(self):
+        return self.messages[0]
+
+    @property
+    def last(self):
+        return self.messages[-1]
+
+    @property
+    def source_key(self):
+        # Keyed by the first message, so a window that grows is replaced, not duplicated.
+        return f"telegram:{self.chat_id}:{self.first['id']}"
+
+    @property
+    def text(self):
+        header = f"Telegram chat {self.chat_name}, {self.first['date']:%Y-%m-%d}:"
+        lines = [f"[{m['date']:%H:%M}] user {m['sender_id']}: {m['text']}" for m in self.messages]
+        return "\n".join([header] + lines)
+
+    @property
+    def metadata(self):
+        return {
+            "source": "telegram",
+            "chat_id": self.chat_id,
+            "chat": self.chat_name,
+            "date_start": self.first["date"].isoformat(),
+            "date_end": self.last["date"].isoformat(),
+            "message_count": len(self.messages),
+        }
+
+
+def watermark(state, name):
+    """The (date, message id) of a chat's "low" or "high" watermark, or (None, None)."""
+    mark = state.get(name)
+    return (datetime.fromisoformat(mark[0]), mark[1]) if mark else (None, None)
+
+
+async def stream_messages(dsn, watermarks, prefetch=1000):
+    """
+    Yields message rows past the watermarks through a server-side cursor,
+    so memory use doesn't depend on how many messages are stored.
+    """
+    chat_ids, low_dates, low_ids, high_dates, high_ids = [], [], [], [], []
+    for chat_id, state in watermarks.items():
+        (low_date, low_id), (high_date, high_id) = watermark(state, "low"), watermark(state, "high")
+        chat_ids.append(int(chat_id))
+        low_dates.append(low_date)
+        low_ids.append(low_id)
+        high_dates.append(high_date)
+        high_ids.append(high_id)
+
+    connection = await asyncpg.connect(dsn)
+    try:
+        async with connection.transaction():
+            async for row in connection.cursor(UNINGESTED_MESSAGES, chat_ids, low_dates, low_ids, high_dates,
+                                               high_ids, prefetch=prefetch):
+                yield dict(row)
+    finally:
+        await connection.close()
+
+
+async def conversation_windows(rows, watermarks, max_gap=timedelta(minutes=30), max_chars=1800):
+    """
+    Groups rows (ordered by chat and date) into conversation windows: a new
+    window starts after a pause longer than max_gap, when the text would
+    exceed max_chars, or where the rows jump over the already ingested range.
+    Yields (window, is_last_of_chat).
+    """
+    window = None
+    async for row in rows:
+        line_size = len(row["text"]) + 20
+        if window is not None:
+            same_chat = row["chat_id"] == window.chat_id
+            high_date, high_id = watermark(watermarks.get(str(window.chat_id), {}), "high")
+            crosses_ingested = high_date is not None and \
+                (window.last["date"], window.last["id"]) < (high_date, high_id) < (row["date"], row["id"])
+            if not same_chat or crosses_ingested or row["date"] - window.last["date"] > max_gap \
+                    or window.size + line_size > max_chars:
+                yield window, not same_chat
+                window = None
+        if window is None:
+            window = ConversationWindow(row["chat_id"], row["chat_name"] or str(row["chat_id"]))
+        window.messages.append(row)
+        window.size += line_size
+    if window is not None:
+        yield window, True
@@ -0,0 +1,196 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from app.routing import field_columns, filter_mask
+from app.state import load_json_state, save_json_state
+
+# Layout of one snapshot directory:
+#   vectors.npy   (rows, dim) int8 or float16 unit vectors, memory-mapped by the API
+#   scales.npy    (rows,) float32 per-row scale of int8 vectors
+#   ids.txt       newline-separated chunk IDs, one per row
+#   records.bin   concatenated JSON records {"document", "metadata"}
+#   offsets.npy   (rows + 1,) int64 byte offsets of each record in records.bin
+#   fields.json   per-row values of the metadata fields retrieval filters on (ROUTING_FIELDS)
+#   manifest.json count, dimension, dtype and the collection version it was taken from
+# The snapshot directory currently in use is named by the pointer file current.json.
+POINTER_FILE = "current.json"
+SNAPSHOT_DTYPES = ("int8", "float16")
+
+
+def _quantize(vectors, dtype):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def export_snapshot(pages, base_dir, version=None, dtype="int8", keep=2):
+    """
+    Writes a new snapshot from pages of (ids, embeddings, documents, metadatas)
+    and then atomically repoints current.json at it, so the API only ever sees
+    complete snapshots. Older snapshots beyond keep are removed.
+    Returns (snapshot_dir, row_count).
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"Unsupported snapshot dtype {dtype!r}; use one of {SNAPSHOT_DTYPES}")
+    os.makedirs(base_dir, exist_ok=True)
+    name = f"snapshot-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{time.time_ns() % 10**9:09d}"
+    target = os.path.join(base_dir, name)
+    building = target + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    blocks, scales, offsets, all_ids, all_metadatas = [], [], [0], [], []
+    with open(os.path.join(building, "records.bin"), "wb") as records:
+        for ids, embeddings, documents, metadatas in pages:
+            vectors, block_scales = _quantize(np.asarray(embeddings, dtype=np.float32), dtype)
+            blocks.append(vectors)
+            if block_scales is not None:
+                scales.append(block_scales)
+            all_ids.extend(ids)
+            all_metadatas.extend(metadatas)
+            for document, metadata in zip(documents, metadatas):
+                record = json.dumps({"document": document, "metadata": metadata},
+                                    ensure_ascii=False).encode('utf-8')
+                records.write(record)
+                offsets.append(offsets[-1] + len(record))
+
+    with open(os.path.join(building, "ids.txt"), "w", encoding='utf-8') as f:
+        f.write("\n".join(all_ids))
+    with open(os.path.join(building, "fields.json"), "w", encoding='utf-8') as f:
+        json.dump(field_columns(all_metadatas), f)
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=dtype)
+    np.save(os.path.join(building, "vectors.npy"), matrix)
+    if dtype == "int8":
+        np.save(os.path.join(building, "scales.npy"), np.concatenate(scales) if scales else np.zeros(0, np.float32))
+    np.save(os.path.join(building, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    save_json_state(os.path.join(building, "manifest.json"), {
+        "count": int(matrix.shape[0]), "dimension": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "dtype": dtype, "version": version,
+    })
+
+    os.replace(building, target)
+    save_json_state(os.path.join(base_dir, POINTER_FILE), {"snapshot": name})
+
+    snapshots = sorted(entry for entry in os.listdir(base_dir)
+                       if entry.startswith("snapshot-") and not entry.endswith(".tmp"))
+    for old in snapshots[:-keep]:
+        if old != name:
+            shutil.rmtree(os.path.join(base_dir, old), ignore_errors=True)
+    return target, int(matrix.shape[0])
+
+
+class VectorSnapshot:
+    """A read-only, memory-mapped snapshot searched with brute-force NumPy top-k."""
+
+    def __init__(self, path, block_rows=65536):
+        self.path = path
+        self.block_rows = block_rows
+        self.manifest = load_json_state(os.path.join(path, "manifest.json"))
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode='r')
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.records = np.memmap(os.path.join(path, "records.bin"), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] else np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(path, "ids.txt"), encoding='utf-8') as f:
+            self.ids = f.read().split("\n") if len(self) else []
+        self._rows = {cid: row for row, cid in enumerate(self.ids)}
+        self._fields = None
+        self._masks = {}
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    @property
+    def version(self):
+        return self.manifest.get("version")
+
+    def row_of(self, cid):
+        return self._rows.get(cid)
+
+    def record(self, row):
+        return json.loads(self.records[self.offsets[row]:self.offsets[row + 1]].tobytes())
+
+    def embedding(self, row):
+        vector = self.vectors[row].astype(np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def fields(self):
+        """Per-row ROUTING_FIELDS values; snapshots exported without fields.json read them from the records once."""
+        if self._fields is None:
+            path = os.path.join(self.path, "fields.json")
+            self._fields = load_json_state(path) if os.path.exists(path) \
+                else field_columns(self.record(row)["metadata"] for row in range(len(self)))
+        return self._fields
+
+    def filter_rows(self, where):
+        """Row numbers whose metadata passes the filter, computed once per filter."""
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._masks:
+            self._masks[key] = np.flatnonzero(filter_mask(self.fields(), where, len(self)))
+        return self._masks[key]
+
+    def search(self, query_embedding, k=20, where=None):
+        """
+        Returns up to k (row, cosine similarity) pairs, best first. With a
+        where filter only the rows passing it are scored.
+        """
+        if not len(self) or k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        rows = self.filter_rows(where) if where else None
+        count = len(self) if rows is None else len(rows)
+        if not count:
+            return []
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            block = self.vectors[start:start + self.block_rows] if rows is None \
+                else self.vectors[rows[start:start + self.block_rows]]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is None:
+            return [(int(row), float(scores[row])) for row in top]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+class VectorSnapshotFile:
+    """Holds the snapshot current.json points at and swaps to a new one when ingest.py publishes it."""
+
+    def __init__(self, base_dir, check_interval=15.0):
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self.snapshot = None
+        self._name = None
+        self._checked_at = float("-inf")
+
+    def get(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            name = load_json_state(os.path.join(self.base_dir, POINTER_FILE)).get("snapshot")
+            if name and name != self._name:
+                try:
+                    started = time.monotonic()
+                    snapshot = VectorSnapshot(os.path.join(self.base_dir, name))
+                    # A single reference swap: searches already running keep the old snapshot.
+                    self.snapshot, self._name = snapshot, name
+                    print(f"VECTORS: Loaded snapshot {name} of {len(snapshot)} vectors "
+                          f"({snapshot.manifest.get('dtype')}) in {time.monotonic() - started:.2f}s.")
+                except Exception as e:
+                    print(f"VECTORS: Could not load snapshot {name}: {e}")
+        return self.snapshot
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from app.metrics import INGEST_BATCH_SECONDS
+
+
+def chunk_id(text):
+    """Content-hash ID: identical chunk text is embedded and stored only once."""
+    return "c_" + hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+class ChunkLedger:
+    """
+    Local SQLite record of which source locations reference which chunk.
+    Chroma only stores one copy of each distinct chunk, so the ledger is what
+    tells the writer when a chunk gained a location (metadata update), lost
+    its last one (delete) or is brand new (embed + upsert).
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.created = not os.path.exists(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level="DEFERRED")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                source_key TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS locations (
+                source_key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (source_key, position)
+            );
+            CREATE INDEX IF NOT EXISTS locations_chunk_id ON locations (chunk_id);
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY
+            );
+        """)
+        # Ledgers written before chunks carried their own metadata (symbols, language) lack the column.
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(locations)")}
+        if "metadata" not in columns:
+            self.conn.execute("ALTER TABLE locations ADD COLUMN metadata TEXT")
+        self.conn.commit()
+
+    def chunk_ids(self, source_key):
+        rows = self.conn.execute("SELECT chunk_id FROM locations WHERE source_key = ?", (source_key,))
+        return [row[0] for row in rows]
+
+    def source_keys(self, prefix):
+        rows = self.conn.execute(
+            "SELECT source_key FROM sources WHERE substr(source_key, 1, ?) = ?", (len(prefix), prefix)
+        )
+        return [row[0] for row in rows]
+
+    def is_stored(self, cid):
+        return self.conn.execute("SELECT 1 FROM chunks WHERE chunk_id = ?", (cid,)).fetchone() is not None
+
+    def mark_stored(self, cid):
+        self.conn.execute("INSERT OR IGNORE INTO chunks (chunk_id) VALUES (?)", (cid,))
+
+    def forget(self, cid):
+        self.conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (cid,))
+
+    def reference_count(self, cid):
+        return self.conn.execute("SELECT COUNT(*) FROM locations WHERE chunk_id = ?", (cid,)).fetchone()[0]
+
+    def set_source(self, source_key, metadata, cids, chunk_metadatas=None):
+        self.conn.execute("DELETE FROM locations WHERE source_key = ?", (source_key,))
+        self.conn.execute("INSERT OR REPLACE INTO sources (source_key, metadata) VALUES (?, ?)",
+                          (source_key, json.dumps(metadata, sort_keys=True)))
+        chunk_metadatas = chunk_metadatas or [None] * len(cids)
+        self.conn.executemany(
+            "INSERT INTO locations (source_key, position, chunk_id, metadata) VALUES (?, ?, ?, ?)",
+            [(source_key, i, cid, json.dumps(chunk_meta, sort_keys=True) if chunk_meta else None)
+             for i, (cid, chunk_meta) in enumerate(zip(cids, chunk_metadatas))],
+        )
+
+    def source_unchanged(self, source_key, metadata, cids, chunk_metadatas=None):
+        """True if the source is recorded with exactly this metadata and these chunks, in order."""
+        row = self.conn.execute("SELECT metadata FROM sources WHERE source_key = ?", (source_key,)).fetchone()
+        if row is None or row[0] != json.dumps(metadata, sort_keys=True):
+            return False
+        chunk_metadatas = chunk_metadatas or [None] * len(cids)
+        locations = self.conn.execute(
+            "SELECT chunk_id, metadata FROM locations WHERE source_key = ? ORDER BY position", (source_key,)
+        ).fetchall()
+        return locations == [(cid, json.dumps(chunk_meta, sort_keys=True) if chunk_meta else None)
+                             for cid, chunk_meta in zip(cids, chunk_metadatas)]
+
+    def remove_source(self, source_key):
+        self.conn.execute("DELETE FROM locations WHERE source_key = ?", (source_key,))
+        self.conn.execute("DELETE FROM sources WHERE source_key = ?", (source_key,))
+
+    def chunk_metadata(self, cid):
+        """
+        Metadata of the chunk's first location (its source metadata, key and
+        chunk index within that source, plus the chunk's own metadata such as
+        symbols and language) and the list of all its locations.
+        """
+        # SQLite takes the bare l.metadata from the row MIN() picked.
+        rows = self.conn.execute("""
+            SELECT l.source_key, MIN(l.position), s.metadata, l.metadata FROM locations l
+            JOIN sources s ON s.source_key = l.source_key
+            WHERE l.chunk_id = ? GROUP BY l.source_key ORDER BY l.source_key
+        """, (cid,)).fetchall()
+        if not rows:
+            return {"location_count": 0}
+        source_key, position, source_metadata, location_metadata = rows[0]
+        metadata = json.loads(source_metadata)
+        if location_metadata:
+            metadata.update(json.loads(location_metadata))
+        metadata["source_key"] = source_key
+        metadata["chunk_index"] = position
+        metadata["locations"] = "\n".join(row[0] for row in rows)
+        metadata["location_count"] = len(rows)
+        return metadata
+
+    def stored_chunk_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT chunk_id FROM chunks")}
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+class VectorWriter:
+    """
+    Buffers chunks across many sources and writes them to Chroma in large
+    batches. The batch size adapts to how long writes take (grow while fast,
+    halve on slow or failed writes) and failed writes are retried with
+    backoff. Ledger changes are only committed once their batch is stored,
+    so a failed batch leaves no trace and its sources are retried next run.
+
+    With an embedding_function (the collection's own), documents are embedded
+    here before the upsert instead of inside the Chroma client, so embedding
+    and writing are timed separately.
+    """
+
+    def __init__(self, collection, ledger, batch_size=256, min_batch_size=16, max_batch_size=4096,
+                 target_seconds=5.0, max_retries=4, backoff_seconds=1.0, embedding_function=None):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_seconds = target_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.stats = {"chunks_added": 0, "chunks_deduplicated": 0, "chunks_deleted": 0, "chunks_relabelled": 0,
+                      "sources_unchanged": 0, "batches_written": 0}
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self._documents = {}
+        self._touched = set()
+        self._deleted = set()
+        self._callbacks = []
+
+    @property
+    def pending(self):
+        return len(self._documents) + len(self._touched)
+
+    def write_source(self, source_key, metadata, chunks, on_done=None, chunk_metadatas=None):
+        """
+        Replaces all chunks of source_key with the given chunk texts.
+        chunk_metadatas optionally adds metadata per chunk on top of the source's.
+        A source that is already stored exactly like this is only acknowledged.
+        """
+        new_ids = [chunk_id(text) for text in chunks]
+        if self.ledger.source_unchanged(source_key, metadata, new_ids, chunk_metadatas):
+            self.stats["sources_unchanged"] += 1
+            self._callbacks.append(on_done)
+            return
+        old_ids = set(self.ledger.chunk_ids(source_key))
+        self.ledger.set_source(source_key, metadata, new_ids, chunk_metadatas)
+
+        for cid, text in zip(new_ids, chunks):
+            if cid in self._documents or self.ledger.is_stored(cid):
+                if cid not in old_ids:
+                    self.stats["chunks_deduplicated"] += 1
+                self._touched.add(cid)
+            else:
+                self.ledger.mark_stored(cid)
+                self._documents[cid] = text
+        self._release(old_ids - set(new_ids))
+        self._callbacks.append(on_done)
+        self._maybe_flush()
+
+    def remove_source(self, source_key=None, prefix=None, on_done=None):
+        """Drops one source, or every source whose key starts with prefix."""
+        source_keys = self.ledger.source_keys(prefix) if prefix is not None else [source_key]
+        for key in source_keys:
+            old_ids = set(self.ledger.chunk_ids(key))
+            self.ledger.remove_source(key)
+            self._release(old_ids)
+        self._callbacks.append(on_done)
+        self._maybe_flush()
+
+    def _release(self, cids):
+        for cid in cids:
+            if self.ledger.reference_count(cid) == 0:
+                self.ledger.forget(cid)
+                self._documents.pop(cid, None)
+                self._deleted.add(cid)
+            else:
+                self._touched.add(cid)
+
+    def _maybe_flush(self):
+        if self.pending + len(self._deleted) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered batch and commits its ledger changes."""
+        if not self._callbacks:
+            return
+        upsert_ids = list(self._documents)
+        update_ids = [cid for cid in self._touched if cid not in self._documents and self.ledger.is_stored(cid)]
+        delete_ids = [cid for cid in self._deleted if not self.ledger.is_stored(cid)]
+        ok = True
+        try:
+            if upsert_ids:
+                documents = [self._documents[cid] for cid in upsert_ids]
+                columns = {}
+                if self.embedding_function is not None:
+                    with INGEST_BATCH_SECONDS.time(stage="embed"):
+                        columns["embeddings"] = self.embedding_function(documents)
+                self._send(self.collection.upsert, upsert_ids, documents=documents,
+                           metadatas=[self.ledger.chunk_metadata(cid) for cid in upsert_ids], **columns)
+            if update_ids:
+                self._send(self.collection.update, update_ids,
+                           metadatas=[self.ledger.chunk_metadata(cid) for cid in update_ids])
+            if delete_ids:
+                self._send(self.collection.delete, delete_ids)
+            self.ledger.commit()
+            self.stats["chunks_added"] += len(upsert_ids)
+            self.stats["chunks_deleted"] += len(delete_ids)
+            self.stats["chunks_relabelled"] += len(update_ids)
+            if upsert_ids or update_ids or delete_ids:
+                self.stats["batches_written"] += 1
+        except Exception as e:
+            print(f"  Failed to write a batch of {len(upsert_ids) + len(update_ids) + len(delete_ids)} chunks: {e}")
+            self.ledger.rollback()
+            ok = False
+
+        callbacks = self._callbacks
+        self._reset_buffer()
+        for on_done in callbacks:
+            if on_done:
+                on_done(ok)
+
+    def _send(self, operation, ids, **columns):
+        """Sends ids (and matching column values) in adaptively sized, retried slices."""
+        start = 0
+        while start < len(ids):
+            for attempt in range(self.max_retries + 1):
+                size = self.batch_size
+                end = start + size
+                try:
+                    began = time.monotonic()
+                    operation(ids=ids[start:end], **{name: values[start:end] for name, values in columns.items()})
+                    seconds = time.monotonic() - began
+                    self._adapt(seconds)
+                    INGEST_BATCH_SECONDS.observe(seconds, stage=operation.__name__)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.batch_size = max(self.min_batch_size, size // 2)
+                    delay = self.backoff_seconds * 2 ** attempt
+                    print(f"  Write of {min(size, len(ids) - start)} chunks failed ({e}); "
+                          f"retrying in {delay:.0f}s with batches of {self.batch_size}.")
+                    time.sleep(delay)
+            start = end
+
+    def collect_garbage(self, page_size=10000):
+        """
+        Deletes every vector in the collection that the ledger doesn't know
+        about: chunks of removed sources, leftovers from interrupted runs and
+        vectors written under the old per-file ID scheme. Returns a report of
+        what was reclaimed and of ledger chunks missing from the collection.
+        """
+        self.flush()
+        stored = self.ledger.stored_chunk_ids()
+        present, orphans = set(), []
+        offset = 0
+        while True:
+            ids = self.collection.get(include=[], limit=page_size, offset=offset)["ids"]
+            if not ids:
+                break
+            for cid in ids:
+                if cid in stored:
+                    present.add(cid)
+                else:
+                    orphans.append(cid)
+            offset += len(ids)
+
+        if orphans:
+            self._send(self.collection.delete, orphans)
+        return {
+            "vectors_scanned": offset,
+            "orphans_deleted": len(orphans),
+            "missing_from_collection": len(stored - present),
+        }
+
+    def _adapt(self, seconds):
+        if seconds > self.target_seconds:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif seconds < self.target_seconds / 2:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
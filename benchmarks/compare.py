@@ -0,0 +1,44 @@
+#
+# Compares two benchmark result files: python -m benchmarks.compare BASELINE.json CURRENT.json
+#
+import json
+import sys
+
+# Metrics where a larger number is better; for everything else (latencies, seconds) smaller is better.
+HIGHER_IS_BETTER = ("per_second", "answered")
+
+
+def flatten(report, prefix=""):
+    metrics = {}
+    for key, value in report.items():
+        if key == "meta":
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def main(baseline_path, current_path, threshold=5.0):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)
+    # commit is None for runs outside a git checkout.
+    print(f"baseline {(baseline['meta'].get('commit') or '?')[:8]}  vs  "
+          f"current {(current['meta'].get('commit') or '?')[:8]}")
+    before, after = flatten(baseline), flatten(current)
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        change = 100.0 * (new - old) / old if old else 0.0
+        better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+        flag = "" if abs(change) < threshold else ("  better" if better else "  WORSE")
+        print(f"{name:60} {old:>12} {new:>12} {change:+8.1f}%{flag}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m benchmarks.compare BASELINE.json CURRENT.json")
+    main(sys.argv[1], sys.argv[2])
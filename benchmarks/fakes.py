@@ -0,0 +1,267 @@
+#
+# Local stand-ins for Ollama, Chroma and Telegram, so benchmarks measure this
+# code rather than the services it talks to.
+#
+import asyncio
+import hashlib
+import os
+import random
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+from app.routing import matches_where
+
+EMBEDDING_DIMENSION = 384
+# Every fake model token starts with this, so clients can tell them from status lines.
+TOKEN_MARKER = "▁"
+
+
+def fake_embedding(text, dimension=EMBEDDING_DIMENSION):
+    """Deterministic unit vector from hashed words: cheap, and texts sharing words end up similar."""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimension
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    vector.setflags(write=False)
+    return vector
+
+
+# --- Ollama ---
+class FakeOllamaStream:
+    def __init__(self, first_token_latency, token_interval, tokens):
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.sent = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.sent >= self.tokens:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.first_token_latency if self.sent == 0 else self.token_interval)
+        self.sent += 1
+        return {"message": {"content": f"{TOKEN_MARKER}tok{self.sent} "}}
+
+
+class FakeOllama:
+    """
+    Stands in for ollama.AsyncClient. Generation serializes like a single GPU
+    does: at most `parallel` streams produce tokens at once, the rest wait.
+    Prefill costs prefill_per_char seconds for every prompt character after
+    the prefix shared with the previous prompt, which Ollama keeps cached.
+    """
+
+    def __init__(self, first_token_latency=0.2, token_interval=0.02, tokens=50, parallel=2, prefill_per_char=0.0):
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.prefill_per_char = prefill_per_char
+        self._slots = asyncio.Semaphore(parallel)
+        self._last_prompt = ""
+
+    async def list(self):
+        return {"models": []}
+
+    async def generate(self, **kwargs):
+        return {"response": ""}
+
+    def _prefill_latency(self, messages):
+        prompt = "\n".join(message["content"] for message in messages)
+        shared = len(os.path.commonprefix([prompt, self._last_prompt]))
+        self._last_prompt = prompt
+        return self.first_token_latency + self.prefill_per_char * (len(prompt) - shared)
+
+    async def chat(self, model, messages, stream=False, **kwargs):
+        stream = FakeOllamaStream(self._prefill_latency(messages), self.token_interval, self.tokens)
+        slots = self._slots
+
+        async def generate():
+            async with slots:
+                async for chunk in stream:
+                    yield chunk
+        return generate()
+
+
+# --- Chroma ---
+class InMemoryCollection:
+    """The subset of a Chroma collection the app and ingest.py use, with fake_embedding as the embedding function."""
+
+    def __init__(self, name="benchmark", metadata=None):
+        self.name = name
+        self.metadata = metadata or {}
+        self._records = {}
+
+    def count(self):
+        return len(self._records)
+
+    def modify(self, metadata=None, **kwargs):
+        if metadata is not None:
+            self.metadata = metadata
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        for i, cid in enumerate(ids):
+            document = documents[i] if documents else self._records.get(cid, {}).get("document")
+            self._records[cid] = {
+                "document": document,
+                "metadata": metadatas[i] if metadatas else None,
+                "embedding": np.asarray(embeddings[i], dtype=np.float32) if embeddings else fake_embedding(document),
+            }
+
+    def update(self, ids, metadatas=None, **kwargs):
+        for cid, metadata in zip(ids, metadatas or []):
+            if cid in self._records:
+                self._records[cid]["metadata"] = metadata
+
+    def delete(self, ids=None, **kwargs):
+        for cid in ids or []:
+            self._records.pop(cid, None)
+
+    def _result(self, ids, include):
+        result = {"ids": ids}
+        for field in ("documents", "metadatas", "embeddings"):
+            values = [self._records[cid][field[:-1]] for cid in ids] if field in include else None
+            if field == "embeddings" and values is not None:
+                values = np.array(values) if values else np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+            result[field] = values
+        return result
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=0, **kwargs):
+        selected = [cid for cid in ids if cid in self._records] if ids is not None else list(self._records)
+        selected = selected[offset:offset + limit if limit is not None else None]
+        return self._result(selected, include)
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, include=("documents", "metadatas"),
+              where=None, **kwargs):
+        queries = query_embeddings or [fake_embedding(text) for text in query_texts]
+        ids = [cid for cid, record in self._records.items() if not where or matches_where(record["metadata"], where)]
+        matrix = np.array([self._records[cid]["embedding"] for cid in ids]) if ids else None
+        result = {"ids": [], "documents": [], "metadatas": [], "embeddings": [], "distances": []}
+        for query in queries:
+            if matrix is None:
+                top = []
+            else:
+                similarities = matrix @ np.asarray(query, dtype=np.float32)
+                top = [ids[i] for i in np.argsort(-similarities)[:n_results]]
+            single = self._result(top, include)
+            for field in ("ids", "documents", "metadatas", "embeddings"):
+                result[field].append(single[field])
+        return result
+
+
+# --- Telegram ---
+class FakeMessage:
+    def __init__(self, message_id, date, text, sender_id):
+        self.id = message_id
+        self.date = date
+        self.message = text
+        self.sender_id = sender_id
+        self.media = None
+
+
+class FakeTelegramClient:
+    """
+    Stands in for TelegramClient for scrape_chat: one channel holding `count`
+    messages with ids first_id.., served like iter_messages does (pages of 100
+    with request_latency seconds per page).
+    """
+
+    def __init__(self, chat_id, count, first_id=1, request_latency=0.0, seed=0):
+        self.channel = Channel(id=chat_id, title=f"benchmark-{chat_id}", photo=ChatPhotoEmpty(), date=None)
+        self.first_id = first_id
+        self.count = count
+        self.request_latency = request_latency
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    async def get_entity(self, peer):
+        return self.channel
+
+    async def get_dialogs(self):
+        return []
+
+    def _message(self, message_id):
+        words = self._random.choices(CORPUS_WORDS, k=self._random.randint(3, 40))
+        date = self._start + timedelta(seconds=30 * (message_id - self.first_id))
+        return FakeMessage(message_id, date, " ".join(words), sender_id=1000 + message_id % 50)
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, reverse=False):
+        last_id = self.first_id + self.count - 1
+        low = max(self.first_id, min_id + 1)
+        high = min(last_id, max_id - 1) if max_id else last_id
+        ids = range(low, high + 1) if reverse else range(high, low - 1, -1)
+        for served, message_id in enumerate(ids):
+            if limit is not None and served >= limit:
+                return
+            if served % 100 == 0:
+                self.requests += 1
+                if self.request_latency:
+                    await asyncio.sleep(self.request_latency)
+            yield self._message(message_id)
+
+
+# --- Synthetic corpus ---
+CORPUS_WORDS = (
+    "openipc firmware camera sensor isp encoder h264 h265 rtsp onvif majestic uboot kernel flash spi nor nand "
+    "partition rootfs overlay wifi fpv drone goggles vtx rtl8812au wfb mavlink osd msposd gstreamer bitrate "
+    "latency fps resolution ssc338q ssc30kq hi3516 gk7205 t31 sigmastar ingenic goke hisilicon board serial "
+    "uart tftp bootloader recovery upgrade sysupgrade config yaml network dhcp static route telemetry link "
+    "adaptive channel frequency power antenna module driver build buildroot toolchain package patch release "
+    "прошивка камера настройка сборка загрузчик 固件 摄像头 编译 升级 配置"
+).split()
+
+
+def synthetic_text(rng, words):
+    lines, line = [], []
+    for _ in range(words):
+        line.append(rng.choice(CORPUS_WORDS))
+        if len(line) >= rng.randint(6, 14):
+            lines.append(" ".join(line))
+            line = []
+    return "\n".join(lines + [" ".join(line)])
+
+
+def write_corpus(base_dir, files=400, pages=100, words_per_file=600, seed=0):
+    """
+    Writes a synthetic repo (C, headers, Markdown, Python, Makefiles) under
+    base_dir and returns (repo_files, doc_pages): repo-relative paths and a
+    list of (url, text) documentation pages.
+    """
+    rng = random.Random(seed)
+    templates = {
+        ".c": "#include \"{name}.h\"\n\nint {name}_init(void) {{\n    /* {text} */\n    return 0;\n}}\n",
+        ".h": "#ifndef {upper}_H\n#define {upper}_H\n/* {text} */\nint {name}_init(void);\n#endif\n",
+        ".md": "# {name}\n\n{text}\n",
+        ".py": "def {name}():\n    \"\"\"{text}\"\"\"\n    return None\n",
+        "Makefile": "# {text}\nall:\n\t$(CC) -o {name} {name}.c\n",
+    }
+    repo_files = []
+    for i in range(files):
+        extension = list(templates)[i % len(templates)]
+        name = f"module_{i}"
+        directory = os.path.join(base_dir, f"src/part{i % 20}")
+        os.makedirs(directory, exist_ok=True)
+        filename = "Makefile" if extension == "Makefile" else f"{name}{extension}"
+        text = synthetic_text(rng, rng.randint(words_per_file // 2, words_per_file * 3 // 2))
+        with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+            f.write(templates[extension].format(name=name, upper=name.upper(), text=text))
+        repo_files.append(os.path.relpath(os.path.join(directory, filename), base_dir))
+    doc_pages = [
+        (f"https://docs.example.org/page-{i}", synthetic_text(rng, rng.randint(300, 1500)))
+        for i in range(pages)
+    ]
+    return repo_files, doc_pages
+
+
+def synthetic_questions(count, seed=1):
+    rng = random.Random(seed)
+    return [f"how do I set {' '.join(rng.sample(CORPUS_WORDS, 4))} question {i}" for i in range(count)]
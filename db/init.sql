@@ -6,3 +6,135 @@ CREATE TABLE IF NOT EXISTS messages (
     text TEXT,
     media JSONB
 );
+
+-- Per-chat scrape watermarks: the newest and oldest message id stored so far.
+-- Scrapes fetch messages above newest_id, backfills continue below oldest_id.
+CREATE TABLE IF NOT EXISTS scrape_progress (
+    chat_id BIGINT PRIMARY KEY,
+    newest_id BIGINT NOT NULL,
+    oldest_id BIGINT NOT NULL,
+    backfill_complete BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Durable queue of scrape jobs, consumed by app/scrape_worker.py (the only
+-- process that talks to Telegram). At most one active job per chat and direction.
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    direction TEXT NOT NULL,
+    message_limit INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress JSONB NOT NULL DEFAULT '{}',
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    started_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS scrape_jobs_active ON scrape_jobs (chat_id, direction)
+    WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS scrape_jobs_queued ON scrape_jobs (run_after, id) WHERE status = 'queued';
+-- attempts counts every run of a job, failed_attempts only the runs that ended in
+-- an error; FloodWait pauses don't count towards SCRAPE_JOB_MAX_ATTEMPTS.
+ALTER TABLE scrape_jobs ADD COLUMN IF NOT EXISTS failed_attempts INTEGER NOT NULL DEFAULT 0;
+
+-- The TARGET_CHATS dialogs as last resolved by the scrape worker, served by /chats.
+CREATE TABLE IF NOT EXISTS telegram_chats (
+    chat_id BIGINT PRIMARY KEY,
+    name TEXT NOT NULL,
+    username TEXT,
+    type TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS messages_chat_id_date ON messages (chat_id, date);
+
+-- Per-chat aggregates kept up to date by statement-level triggers on messages,
+-- so stats endpoints never scan the messages table. Messages are only ever
+-- inserted or deleted, never updated.
+CREATE TABLE IF NOT EXISTS chat_stats (
+    chat_id BIGINT PRIMARY KEY,
+    message_count BIGINT NOT NULL DEFAULT 0,
+    earliest TIMESTAMP WITH TIME ZONE,
+    latest TIMESTAMP WITH TIME ZONE
+);
+
+CREATE OR REPLACE FUNCTION chat_stats_after_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO chat_stats AS s (chat_id, message_count, earliest, latest)
+    SELECT chat_id, COUNT(*), MIN(date), MAX(date) FROM inserted_messages GROUP BY chat_id
+    ON CONFLICT (chat_id) DO UPDATE SET
+        message_count = s.message_count + EXCLUDED.message_count,
+        earliest = LEAST(s.earliest, EXCLUDED.earliest),
+        latest = GREATEST(s.latest, EXCLUDED.latest);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION chat_stats_after_delete() RETURNS trigger AS $$
+BEGIN
+    -- The bounds of affected chats are re-read through messages_chat_id_date.
+    UPDATE chat_stats s SET
+        message_count = s.message_count - d.deleted,
+        earliest = (SELECT MIN(date) FROM messages m WHERE m.chat_id = s.chat_id),
+        latest = (SELECT MAX(date) FROM messages m WHERE m.chat_id = s.chat_id)
+    FROM (SELECT chat_id, COUNT(*) AS deleted FROM deleted_messages GROUP BY chat_id) d
+    WHERE s.chat_id = d.chat_id;
+    DELETE FROM chat_stats WHERE message_count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER messages_chat_stats_insert AFTER INSERT ON messages
+    REFERENCING NEW TABLE AS inserted_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION chat_stats_after_insert();
+CREATE OR REPLACE TRIGGER messages_chat_stats_delete AFTER DELETE ON messages
+    REFERENCING OLD TABLE AS deleted_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION chat_stats_after_delete();
+
+-- One-off seeding for messages stored before chat_stats existed.
+INSERT INTO chat_stats (chat_id, message_count, earliest, latest)
+SELECT chat_id, COUNT(*), MIN(date), MAX(date) FROM messages
+WHERE NOT EXISTS (SELECT 1 FROM chat_stats)
+GROUP BY chat_id;
+
+-- Full-text search over message text for /messages. The 'simple' configuration
+-- does no stemming or stop words, so it treats English, Russian and any other
+-- space-separated language alike; CJK ideographs and kana are split into
+-- one-character tokens first (those scripts don't separate words), and queries
+-- match them as phrases.
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('simple', regexp_replace(coalesce(text, ''),
+                                         '([぀-ヿ㐀-䶿一-鿿豈-﫿])', ' \1 ', 'g'))
+) STORED;
+CREATE INDEX IF NOT EXISTS messages_search_vector ON messages USING GIN (search_vector);
+-- Keyset pagination over all chats; per-chat pages use messages_chat_id_date.
+CREATE INDEX IF NOT EXISTS messages_date_id ON messages (date, id);
+
+-- Multi-turn chat sessions (/chat with an X-Session-Id header). Only the turns
+-- from history_start on are replayed into prompts; the context block is reused
+-- across turns while the questions stay on the topic of context_embedding.
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    turn_count INTEGER NOT NULL DEFAULT 0,
+    history_start INTEGER NOT NULL DEFAULT 0,
+    context TEXT,
+    context_query TEXT,
+    context_embedding REAL[],
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS chat_sessions_updated_at ON chat_sessions (updated_at);
+
+CREATE TABLE IF NOT EXISTS chat_turns (
+    session_id TEXT NOT NULL REFERENCES chat_sessions (id) ON DELETE CASCADE,
+    turn INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    standalone_query TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (session_id, turn)
+);
@@ -20,7 +20,7 @@ export async function sendMessage(chatId, text) {
 }
 
 export async function scrapeChat(chatId, limit = 100) {
-  // Add the limit as a query parameter to the URL
+  // Queues a scrape job; the scrape worker runs it in the background
   const res = await fetch(`${API_BASE}/chats/${chatId}/scrape?limit=${limit}`, {
     method: "POST",
   });
@@ -30,6 +30,26 @@ export async function scrapeChat(chatId, limit = 100) {
   return await res.json();
 }
 
+export async function fetchScrapeJob(jobId) {
+  const res = await fetch(`${API_BASE}/scrape-jobs/${jobId}`);
+  if (!res.ok) {
+    throw new Error(`Failed to fetch scrape job: ${res.status}`);
+  }
+  return await res.json();
+}
+
+// Polls a scrape job until it finishes, or until it is requeued to continue
+// later: waiting out a Telegram rate limit (progress.flood_wait_until is set)
+// or retrying after an error (error is set). Returns the job.
+export async function waitForScrapeJob(jobId, intervalMs = 2000) {
+  for (;;) {
+    const job = await fetchScrapeJob(jobId);
+    if (job.status === "done" || job.status === "failed") return job;
+    if (job.status === "queued" && (job.progress.flood_wait_until || job.error)) return job;
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+}
+
 export async function fetchSummary(chatId) {
   const res = await fetch(`${API_BASE}/chats/${chatId}/summary`);
   if (!res.ok) {
@@ -40,17 +60,23 @@ export async function fetchSummary(chatId) {
 
 // In src/api.js
 
+// The server keeps the conversation; follow-up questions send its id back.
+let chatSessionId = null;
+
 export async function streamChat(query, onChunk) { // REMOVED: chatId
   // The URL is now simpler
+  const headers = { "Content-Type": "application/json" };
+  if (chatSessionId) headers["X-Session-Id"] = chatSessionId;
   const res = await fetch(`${API_BASE}/chat`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers,
     body: JSON.stringify({ query }),
   });
 
   if (!res.ok) {
     throw new Error(`Chat API failed with status: ${res.status}`);
   }
+  chatSessionId = res.headers.get("X-Session-Id") || chatSessionId;
   
   const reader = res.body.getReader();
   const decoder = new TextDecoder();
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+# The app and ingest.py are imported from the repository root, as they are when run.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def run_with_database(monkeypatch):
+    """
+    Returns run(scenario), which awaits scenario() against a scratch schema
+    created from db/init.sql, with the app's modules pointed at it. Skips
+    when TEST_DATABASE_URL isn't set or reachable.
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import asyncpg
+    from databases import Database
+
+    import app.db
+
+    def run(scenario):
+        schema = f"test_{uuid.uuid4().hex[:12]}"
+
+        async def main():
+            try:
+                admin = await asyncpg.connect(TEST_DATABASE_URL)
+            except (OSError, asyncpg.PostgresError) as e:
+                pytest.skip(f"Postgres is not reachable: {e}")
+            try:
+                await admin.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+                with open(os.path.join(ROOT, "db", "init.sql"), encoding='utf-8') as f:
+                    await admin.execute(f.read())
+                database = Database(TEST_DATABASE_URL, server_settings={"search_path": schema})
+                # Modules that did `from app.db import database` hold their own reference.
+                original = app.db.database
+                for module in list(sys.modules.values()):
+                    if module and module.__name__.startswith("app.") \
+                            and getattr(module, "database", None) is original:
+                        monkeypatch.setattr(module, "database", database)
+                await database.connect()
+                try:
+                    await scenario()
+                finally:
+                    await database.disconnect()
+            finally:
+                await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+                await admin.close()
+
+        asyncio.run(main())
+
+    return run
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected, GenerationCoalescer, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  How do I flash   GK7205?? ") == "how do i flash gk7205"
+
+
+def test_requests_beyond_the_limit_queue_in_order():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=2)
+        first, second, third = admission.enqueue(), admission.enqueue(), admission.enqueue()
+        assert first.admitted and not second.admitted
+        assert (second.position, third.position) == (1, 2)
+        with pytest.raises(AdmissionRejected):
+            admission.enqueue()
+
+        first.release()
+        assert second.admitted
+        assert third.position == 1
+        second.release()
+        third.release()
+        assert admission.in_flight == 0 and admission.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiting_ticket_is_woken_when_admitted():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=1)
+        running, waiting = admission.enqueue(), admission.enqueue()
+        asyncio.get_running_loop().call_later(0.01, running.release)
+        await waiting.wait(timeout=1)
+        assert waiting.admitted
+
+    asyncio.run(scenario())
+
+
+def test_released_waiting_ticket_leaves_the_queue():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=2)
+        running, gave_up, waiting = admission.enqueue(), admission.enqueue(), admission.enqueue()
+        gave_up.release()
+        assert waiting.position == 1
+        running.release()
+        assert waiting.admitted and admission.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_coalesced_subscribers_share_one_generation():
+    async def scenario():
+        coalescer = GenerationCoalescer()
+        runs = []
+
+        async def produce(generation):
+            runs.append(1)
+            for token in ("a", "b", "c"):
+                generation.publish(token)
+                await asyncio.sleep(0)
+
+        generation = coalescer.start("q", produce)
+        assert coalescer.get("q") is generation
+
+        async def collect():
+            return "".join([chunk async for chunk in generation.stream()])
+
+        first, late = await asyncio.gather(collect(), collect())
+        await generation.task
+        assert first == late == "abc"
+        assert runs == [1]
+        assert coalescer.get("q") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.answer_cache import AnswerCache
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_exact_and_semantic_hits():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put("how do i flash", unit(1, 0, 0), "use the bootloader")
+    assert cache.get_exact("how do i flash") == "use the bootloader"
+    answer, similarity = cache.get_similar(unit(1, 0.1, 0))
+    assert answer == "use the bootloader" and similarity >= 0.9
+    answer, similarity = cache.get_similar(unit(0, 1, 0))
+    assert answer is None and similarity < 0.9
+
+
+def test_new_knowledge_base_version_drops_every_answer():
+    cache = AnswerCache()
+    cache.set_version("v1")
+    cache.put("q", unit(1, 0), "a")
+    cache.set_version("v1")
+    assert cache.get_exact("q") == "a"
+    cache.set_version("v2")
+    assert len(cache) == 0
+    assert cache.get_exact("q") is None
+    assert cache.get_similar(unit(1, 0)) == (None, 0.0)
+
+
+def test_expired_and_evicted_answers_are_gone(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.answer_cache.time.monotonic", lambda: now[0])
+    cache = AnswerCache(max_entries=2, ttl=60)
+    cache.put("a", unit(1, 0, 0), "A")
+    cache.put("b", unit(0, 1, 0), "B")
+    cache.get_exact("a")
+    cache.put("c", unit(0, 0, 1), "C")
+    assert cache.get_exact("b") is None  # least recently used
+    now[0] += 61
+    assert cache.get_exact("a") is None
+    assert len(cache) == 1
@@ -0,0 +1,15 @@
+import json
+
+from benchmarks import compare
+
+
+def test_compare_runs_without_a_commit(tmp_path, capsys):
+    paths = []
+    for name, commit, seconds in (("baseline", None, 1.0), ("current", "0123456789abcdef", 0.5)):
+        path = tmp_path / f"{name}.json"
+        path.write_text(json.dumps({"meta": {"commit": commit}, "warmup_seconds": seconds}))
+        paths.append(str(path))
+
+    compare.main(*paths)
+
+    assert "baseline ?  vs  current 01234567" in capsys.readouterr().out
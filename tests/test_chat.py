@@ -0,0 +1,181 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app.main as main
+from app.backends import Backend
+from app.vector_index import VectorSnapshotFile, export_snapshot
+from benchmarks.fakes import FakeOllama, InMemoryCollection, fake_embedding
+
+
+class FakeChromaClient:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def heartbeat(self):
+        return 1
+
+    def get_collection(self, name):
+        return self.collection
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """The API with fake Ollama and Chroma backends; the session store runs without a database."""
+    collection = InMemoryCollection()
+    collection.upsert(ids=["wifi", "boot"], documents=["Enable wifi with the wlan driver.",
+                                                       "The camera boots U-Boot and then majestic."])
+    ollama_client = FakeOllama(first_token_latency=0, token_interval=0, tokens=3)
+
+    async def connect_ollama():
+        return ollama_client
+
+    async def connect_chroma():
+        return main.ChromaConnection(FakeChromaClient(collection), collection)
+
+    async def healthy(client):
+        return None
+
+    monkeypatch.setattr(main, "ollama_backend", Backend("Ollama", connect_ollama, healthy))
+    monkeypatch.setattr(main, "chroma_backend", Backend("Chroma", connect_chroma, healthy))
+    monkeypatch.setattr(main, "embed_query", fake_embedding)
+    monkeypatch.setattr(main, "sessions", main.SessionStore())
+    monkeypatch.setattr(main, "answer_cache", main.AnswerCache(max_entries=16, ttl=60, similarity_threshold=0.99))
+    return ollama_client
+
+
+async def ask(client, query, session_id=None):
+    headers = {"X-Session-Id": session_id} if session_id else {}
+    response = await client.post("/chat", json={"query": query}, headers=headers)
+    return response
+
+
+async def wait_for_turns(session_id, count):
+    for _ in range(100):
+        session = main.sessions._cache.get(session_id)
+        if session is not None and session.turn_count >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"session {session_id} never reached {count} turns")
+
+
+def run(coroutine):
+    async def with_client():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await coroutine(client)
+    return asyncio.run(with_client())
+
+
+def test_standalone_question_later_in_a_session_uses_the_answer_cache(api):
+    async def scenario(client):
+        await ask(client, "How does the camera boot?")
+        first = await ask(client, "How do I enable wifi?")
+        session_id = first.headers["X-Session-Id"]
+        await wait_for_turns(session_id, 1)
+
+        await ask(client, "Where is the boot log?", session_id)
+        await wait_for_turns(session_id, 2)
+        second = await ask(client, "How does the camera boot?", session_id)
+        return second
+
+    response = run(scenario)
+    assert response.headers["X-Answer-Cache"] == "exact"
+
+
+def test_follow_ups_skip_the_answer_cache(api):
+    async def scenario(client):
+        first = await ask(client, "How do I enable wifi?")
+        session_id = first.headers["X-Session-Id"]
+        await wait_for_turns(session_id, 1)
+        await ask(client, "what about gk7205?")
+        return await ask(client, "what about gk7205?", session_id)
+
+    response = run(scenario)
+    assert response.headers["X-Answer-Cache"] == "miss"
+
+
+def test_concurrent_follow_ups_in_a_session_are_answered_separately(api, monkeypatch):
+    started = []
+    coalescer_start = main.coalescer.start
+
+    def start(key, generate):
+        started.append(key)
+        return coalescer_start(key, generate)
+
+    monkeypatch.setattr(main.coalescer, "start", start)
+
+    async def scenario(client):
+        first = await ask(client, "How do I enable wifi?")
+        session_id = first.headers["X-Session-Id"]
+        await wait_for_turns(session_id, 1)
+        await asyncio.gather(ask(client, "what about gk7205?", session_id),
+                             ask(client, "and ssc338q?", session_id))
+
+    run(scenario)
+    follow_up_keys = [key for key in started if key.startswith("session:")]
+    assert len(follow_up_keys) == 2
+    assert len(set(follow_up_keys)) == 2
+
+
+def test_shared_answers_are_generated_without_the_session_history(api, monkeypatch):
+    prompts = []
+    chat = api.chat
+
+    async def recording_chat(model, messages, **kwargs):
+        prompts.append(messages)
+        return await chat(model, messages, **kwargs)
+
+    monkeypatch.setattr(api, "chat", recording_chat)
+
+    async def scenario(client):
+        first = await ask(client, "How do I enable wifi?")
+        session_id = first.headers["X-Session-Id"]
+        await wait_for_turns(session_id, 1)
+        await ask(client, "How does the camera boot?", session_id)
+        await wait_for_turns(session_id, 2)
+        await ask(client, "what about gk7205?", session_id)
+
+    run(scenario)
+    standalone, follow_up = prompts[1], prompts[2]
+    assert [m["role"] for m in standalone] == ["system", "user"]
+    assert [m["role"] for m in follow_up] == ["system", "user", "assistant", "user", "assistant", "user"]
+
+
+def chroma_down(monkeypatch):
+    async def connect_chroma():
+        raise ConnectionError("chroma is down")
+
+    async def healthy(client):
+        return None
+
+    monkeypatch.setattr(main, "chroma_backend", Backend("Chroma", connect_chroma, healthy))
+
+
+def test_a_loaded_snapshot_answers_while_chroma_is_down(api, monkeypatch, tmp_path):
+    documents = {"wifi": "Enable wifi with the wlan driver.", "boot": "The camera boots U-Boot and then majestic."}
+    export_snapshot([(list(documents), [fake_embedding(text) for text in documents.values()],
+                      list(documents.values()), [{"source": "docs"}, {"source": "docs"}])], str(tmp_path))
+    monkeypatch.setattr(main, "vector_snapshot", VectorSnapshotFile(str(tmp_path)))
+    chroma_down(monkeypatch)
+    prompts = []
+    chat = api.chat
+
+    async def recording_chat(model, messages, **kwargs):
+        prompts.append(messages)
+        return await chat(model, messages, **kwargs)
+
+    monkeypatch.setattr(api, "chat", recording_chat)
+
+    response = run(lambda client: ask(client, "How do I enable wifi?"))
+    assert response.status_code == 200
+    assert "Enable wifi with the wlan driver." in prompts[0][0]["content"]
+
+
+def test_without_a_snapshot_chroma_is_required(api, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "vector_snapshot", VectorSnapshotFile(str(tmp_path)))
+    chroma_down(monkeypatch)
+
+    response = run(lambda client: ask(client, "How do I enable wifi?"))
+    assert response.status_code == 503
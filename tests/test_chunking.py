@@ -0,0 +1,81 @@
+from app.chunking import c_units, detect_language, make_units, markdown_units, python_units, split_document
+
+C_SOURCE = '''#include <stdio.h>
+#define MAX_FPS 30
+
+/* Brace in a comment: { */
+typedef struct {
+    int width;
+    int height;
+} resolution_t;
+
+static const char *name = "}";
+
+int sensor_init(int fps)
+{
+    if (fps > MAX_FPS) {
+        return -1;
+    }
+    return 0;
+}
+
+void sensor_exit(void);
+'''
+
+
+def test_c_units_follow_top_level_definitions():
+    units = c_units(C_SOURCE)
+    symbols = [unit.symbols for unit in units]
+    assert ["MAX_FPS"] in symbols
+    assert ["resolution_t"] in symbols
+    assert ["sensor_init"] in symbols
+    assert ["sensor_exit"] in symbols
+    function = next(unit for unit in units if unit.symbols == ["sensor_init"])
+    assert function.text.startswith("int sensor_init") and function.text.endswith("}")
+
+
+def test_python_units_are_functions_and_classes():
+    units = python_units("import os\n\nLIMIT = 3\n\n\n# Says hi.\ndef greet():\n    return 'hi'\n\n\n"
+                         "class Camera:\n    def start(self):\n        pass\n")
+    assert [unit.symbols for unit in units] == [["LIMIT"], ["greet"], ["Camera", "start"]]
+    assert units[1].text.startswith("# Says hi.")
+    assert python_units("def broken(:\n") is None
+
+
+def test_make_units_are_rules_and_variables():
+    units = make_units("CC ?= gcc\nCFLAGS += -O2\n\n# Builds the tool.\nall: tool\n\n"
+                       "tool: main.o\n\t$(CC) -o $@ $^\n\n.PHONY: all\n")
+    symbols = [unit.symbols for unit in units]
+    assert symbols[0] == ["CC", "CFLAGS"]
+    assert ["all"] in symbols
+    assert ["tool"] in symbols
+    tool = next(unit for unit in units if unit.symbols == ["tool"])
+    assert "\t$(CC) -o $@ $^" in tool.text
+
+
+def test_markdown_units_follow_headings_outside_code_blocks():
+    units = markdown_units("# Setup\nIntro.\n\n## Wifi\nLoad the driver.\n```sh\n# not a heading\n```\n\n"
+                           "# Usage\nRun it.\n")
+    assert [unit.section for unit in units] == ["Setup", "Setup > Wifi", "Usage"]
+    assert "# not a heading" in units[1].text
+
+
+def test_split_document_keeps_functions_whole_and_labels_chunks():
+    functions = "\n\n".join(f"int f{i}(void)\n{{\n" + "    x++;\n" * 20 + "}" for i in range(10))
+    texts, metadatas = split_document(functions, "src/main.c", chunk_size=500, chunk_overlap=50)
+    assert all(text.count("{") == text.count("}") for text in texts)
+    assert all(metadata["language"] == "c" and metadata["kind"] == "code" for metadata in metadatas)
+    assert sorted(name for m in metadatas for name in m["symbols"].split(",")) == sorted(f"f{i}" for i in range(10))
+
+    texts, metadatas = split_document("# Title\n" + "word " * 400, "README.md", chunk_size=500, chunk_overlap=50)
+    assert len(texts) > 1
+    assert all(text.startswith("# Title") for text in texts)
+    assert all(metadata == {"language": "markdown", "kind": "docs", "section": "Title"} for metadata in metadatas)
+
+
+def test_text_without_a_language_has_no_chunk_metadata():
+    assert detect_language("Makefile") == "make"
+    assert detect_language("notes.rst") is None
+    texts, metadatas = split_document("plain text " * 10, None, chunk_size=50, chunk_overlap=0)
+    assert len(texts) == len(metadatas) > 1
+    assert metadatas == [{} for _ in texts]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from app.context import estimate_tokens, pack_context
+
+
+def results(*chunks):
+    """Retrieval results from (id, text, metadata, score, embedding) tuples."""
+    return {field: [chunk[i] for chunk in chunks]
+            for i, field in enumerate(("ids", "documents", "metadatas", "scores", "embeddings"))}
+
+
+def test_near_duplicates_are_dropped():
+    context, report = pack_context(results(
+        ("a", "flash the firmware over tftp", {}, 1.0, [1.0, 0.0]),
+        ("b", "flash the firmware over tftp (vendored copy)", {}, 0.9, [1.0, 0.001]),
+        ("c", "enable wifi", {}, 0.5, [0.0, 1.0]),
+    ))
+    assert report["duplicates_dropped"] == 1
+    assert "vendored copy" not in context
+    assert "enable wifi" in context
+
+
+def test_neighbouring_chunks_are_merged_without_their_overlap():
+    source = {"source_key": "github:repo:README.md"}
+    context, report = pack_context(results(
+        ("second", "part two. part three", {**source, "chunk_index": 1}, 0.9, [0.0, 1.0]),
+        ("first", "part one. part two.", {**source, "chunk_index": 0}, 1.0, [1.0, 0.0]),
+    ))
+    assert report["chunks_merged"] == 1
+    assert context == "part one. part two. part three"
+
+
+def test_context_fits_the_token_budget():
+    chunks = [(str(i), f"chunk {i} " + "x" * 400, {}, 1.0 - i / 10, np.eye(5)[i]) for i in range(5)]
+    context, report = pack_context(results(*chunks), token_budget=250)
+    assert estimate_tokens(context) <= 250
+    assert report["chunks"] == 2
+    assert report["tokens_saved"] > 0
@@ -0,0 +1,56 @@
+import app.db as db
+
+
+def message(message_id, sender_id=7, text="hello"):
+    return {"id": message_id, "date": "2024-05-01T12:00:00+00:00", "text": text,
+            "sender_id": sender_id, "media": None}
+
+
+def test_save_messages_counts_inserted_duplicates_and_skipped(run_with_database):
+    async def scenario():
+        first = await db.save_messages([message(1), message(2), message(3)], chat_id=100, batch_size=2)
+        again = await db.save_messages([message(2), message(4), message(5, sender_id=None)], chat_id=100)
+        stored = await db.database.fetch_all("SELECT id, chat_id, text FROM messages ORDER BY id")
+
+        assert (first["inserted"], first["duplicates"], first["skipped"]) == (3, 0, 0)
+        assert (again["inserted"], again["duplicates"], again["skipped"]) == (1, 1, 1)
+        assert [(row["id"], row["chat_id"], row["text"]) for row in stored] == [
+            (1, 100, "hello"), (2, 100, "hello"), (3, 100, "hello"), (4, 100, "hello"),
+        ]
+
+    run_with_database(scenario)
+
+
+def test_save_messages_stores_media_as_json(run_with_database):
+    async def scenario():
+        photo = dict(message(1), media="MessageMediaPhoto()")
+        await db.save_messages([photo], chat_id=100)
+        row = await db.database.fetch_one("SELECT media FROM messages WHERE id = 1")
+        assert row["media"] == '"MessageMediaPhoto()"'
+
+    run_with_database(scenario)
+
+
+def test_watermarks_only_widen(run_with_database):
+    async def scenario():
+        assert await db.get_scrape_progress(100) is None
+        await db.save_message_batch([message(10), message(12)], chat_id=100)
+        await db.save_message_batch([message(11)], chat_id=100)
+        await db.save_message_batch([message(5)], chat_id=100)
+        progress = await db.get_scrape_progress(100)
+        assert (progress["newest_id"], progress["oldest_id"], progress["backfill_complete"]) == (12, 5, False)
+
+        await db.save_message_batch([], chat_id=100, backfill_complete=True)
+        assert (await db.get_scrape_progress(100))["backfill_complete"] is True
+
+    run_with_database(scenario)
+
+
+def test_watermarks_are_seeded_from_stored_messages(run_with_database):
+    async def scenario():
+        await db.save_messages([message(3), message(9)], chat_id=100)
+        progress = await db.get_scrape_progress(100)
+        assert (progress["newest_id"], progress["oldest_id"]) == (9, 3)
+        assert await db.get_scrape_progress(200) is None
+
+    run_with_database(scenario)
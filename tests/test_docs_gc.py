@@ -0,0 +1,84 @@
+import requests
+
+import ingest
+from app.crawler import PageCache, SiteCrawler
+
+SITE = "https://docs.example"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=""):
+        self.status_code = status_code
+        self.content = body.encode()
+        self.headers = {"Content-Type": "text/html"}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeSession:
+    """Serves pages from a dict of path -> HTML body, status code or exception."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, timeout=None, headers=None):
+        page = self.pages.get(url[len(SITE):], 404)
+        if isinstance(page, Exception):
+            raise page
+        if isinstance(page, int):
+            return FakeResponse(page)
+        return FakeResponse(200, page)
+
+
+def links(*paths):
+    return "".join(f'<a href="{SITE}{path}">{path}</a>' for path in paths)
+
+
+def crawl(tmp_path, pages, cached_links=None):
+    cache = PageCache(str(tmp_path / "page_cache.json"))
+    for path, paths in (cached_links or {}).items():
+        cache.entries[SITE + path] = {"links": [SITE + p for p in paths]}
+    crawler = SiteCrawler(max_workers=2, cache=cache)
+    crawler.session = FakeSession(pages)
+    list(crawler.crawl([SITE + "/"]))
+    return crawler
+
+
+def test_failed_pages_keep_their_chunks(tmp_path, monkeypatch):
+    # One failure in this five page site is 20%; real sites have far more pages.
+    monkeypatch.setattr(ingest, "CRAWL_GC_MAX_FAILURE_RATE", 0.5)
+    crawler = crawl(tmp_path, {
+        "/": links("/flaky", "/removed", "/kept"),
+        "/flaky": requests.Timeout("timed out"),
+        "/kept": "kept",
+        "/behind-flaky": "reached through the cached links of /flaky",
+    }, cached_links={"/flaky": ["/behind-flaky"]})
+
+    assert crawler.failed_urls == {SITE + "/flaky"}
+    assert crawler.gone_urls == {SITE + "/removed"}
+    assert SITE + "/behind-flaky" in crawler.crawled_urls
+
+    ledger_urls = [SITE + p for p in ("/", "/flaky", "/removed", "/kept", "/behind-flaky", "/unlinked")]
+    removed, skip_reason = ingest.removed_doc_urls(ledger_urls, crawler)
+    assert skip_reason is None
+    assert sorted(removed) == [SITE + "/removed", SITE + "/unlinked"]
+
+
+def test_outage_removes_nothing(tmp_path):
+    crawler = crawl(tmp_path, {"/": requests.ConnectionError("site down")})
+    removed, skip_reason = ingest.removed_doc_urls([SITE + "/", SITE + "/page"], crawler)
+    assert removed == []
+    assert skip_reason
+
+
+def test_many_failures_remove_nothing(tmp_path):
+    crawler = crawl(tmp_path, {
+        "/": links("/a", "/b"),
+        "/a": 503,
+        "/b": 502,
+    })
+    removed, skip_reason = ingest.removed_doc_urls([SITE + "/old"], crawler)
+    assert removed == []
+    assert "failed" in skip_reason
@@ -0,0 +1,19 @@
+import ingest
+from app.metrics import INGEST_BATCH_SECONDS, INGEST_STAGE_SECONDS
+
+
+def test_end_of_run_summary(tmp_path, monkeypatch, capsys):
+    INGEST_STAGE_SECONDS.observe(0.5, stage="split", source_type="file")
+    INGEST_BATCH_SECONDS.observe(1.5, stage="embed")
+    metrics_path = tmp_path / "ingest.prom"
+    monkeypatch.setattr(ingest, "INGEST_METRICS_PATH", str(metrics_path))
+
+    ingest.write_ingest_metrics({"chunks_added": 3}, 2.0)
+    ingest.print_stage_timings()
+
+    output = capsys.readouterr().out
+    assert "split (file)" in output
+    assert "embed (batches)" in output
+    metrics = metrics_path.read_text()
+    assert 'ingest_last_run{stat="chunks_added"} 3' in metrics
+    assert "ingest_batch_seconds_count" in metrics
@@ -0,0 +1,36 @@
+from app.lexical import LexicalIndex, tokenize
+
+DOCUMENTS = [
+    ("sensor", "#define CONFIG_SENSOR_IMX335 1\nint sensor_init(void);", {"source": "github", "kind": "code"}),
+    ("bitrate", "int getBitrate(struct venc *venc) { return venc->bitrate; }", {"source": "github", "kind": "code"}),
+    ("wifi", "To enable wifi, load the wlan driver and set the SSID.", {"source": "docs", "kind": "docs"}),
+]
+
+
+def test_identifiers_are_split_into_their_parts():
+    tokens = tokenize("CONFIG_SENSOR_IMX335 getBitrate")
+    assert {"config_sensor_imx335", "config", "sensor", "imx", "getbitrate", "get", "bitrate"} <= set(tokens)
+
+
+def test_search_ranks_exact_identifiers():
+    index = LexicalIndex.build(DOCUMENTS)
+    assert index.search("CONFIG_SENSOR_IMX335")[0][0] == "sensor"
+    assert index.search("bitrate")[0][0] == "bitrate"
+    assert index.search("nothing matches this") == []
+
+
+def test_saved_index_loads_with_the_same_results(tmp_path):
+    index = LexicalIndex.build(DOCUMENTS)
+    path = str(tmp_path / "lexical.npz")
+    index.save(path)
+    loaded = LexicalIndex.load(path)
+    assert len(loaded) == 3
+    assert loaded.search("wifi ssid") == index.search("wifi ssid")
+
+
+def test_search_within_a_filter(tmp_path):
+    index = LexicalIndex.build(DOCUMENTS + [("wifi_code", "int wifi_enable(void);", {"source": "github", "kind": "code"})])
+    assert [cid for cid, _ in index.search("wifi", where={"kind": "docs"})] == ["wifi"]
+    path = str(tmp_path / "lexical.npz")
+    index.save(path)
+    assert [cid for cid, _ in LexicalIndex.load(path).search("wifi", where={"kind": "code"})] == ["wifi_code"]
@@ -0,0 +1,111 @@
+from collections import Counter
+
+import pytest
+
+from app.pipeline import DeleteTask, IngestPipeline, SplitTask, TaskGroup
+
+
+class RecordingWriter:
+    """A VectorWriter stand-in that acknowledges every source on flush."""
+
+    def __init__(self):
+        self.sources = {}
+        self.removed = []
+        self.stats = Counter()
+        self._callbacks = []
+
+    def write_source(self, source_key, metadata, chunks, on_done=None, **kwargs):
+        self.sources[source_key] = list(chunks)
+        self._callbacks.append(on_done)
+
+    def remove_source(self, source_key=None, prefix=None, on_done=None):
+        self.removed.append(source_key or f"{prefix}*")
+        self._callbacks.append(on_done)
+
+    def flush(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for on_done in callbacks:
+            if on_done:
+                on_done(True)
+
+
+def test_task_group_completes_once_closed_and_drained():
+    results = []
+    group = TaskGroup(results.append)
+    first = group.track(SplitTask(source_key="a", metadata={}))
+    second = group.track(SplitTask(source_key="b", metadata={}))
+
+    first.on_done(True)
+    group.close()
+    assert results == []
+    second.on_done(False)
+    assert results == [False]
+
+
+def test_empty_task_group_completes_on_close():
+    results = []
+    TaskGroup(results.append).close()
+    assert results == [True]
+
+
+def test_run_splits_writes_and_deletes():
+    writer = RecordingWriter()
+    done = []
+
+    def source(pipeline):
+        pipeline.submit(SplitTask(source_key="docs:page", metadata={"source": "docs"},
+                                  text="first paragraph\n\nsecond paragraph", on_done=done.append))
+        pipeline.submit(DeleteTask(prefix="docs:old", on_done=done.append))
+
+    IngestPipeline(writer, split_workers=1, chunk_size=20, chunk_overlap=0).run([source], source_workers=1)
+
+    assert done == [True, True]
+    assert writer.sources == {"docs:page": ["first paragraph", "second paragraph"]}
+    assert writer.removed == ["docs:old*"]
+
+
+def test_an_unreadable_file_is_not_reported_as_written(tmp_path):
+    writer = RecordingWriter()
+    done = []
+
+    def source(pipeline):
+        pipeline.submit(SplitTask(source_key="missing", metadata={}, path=str(tmp_path / "missing.md"),
+                                  on_done=done.append))
+
+    stats = IngestPipeline(writer, split_workers=1).run([source], source_workers=1)
+
+    assert done == [False]
+    assert stats["split_errors"] == 1
+    assert writer.sources == {}
+
+
+class FailingWriter(RecordingWriter):
+    def flush(self):
+        raise ConnectionError("chroma is down")
+
+
+def test_a_failing_writer_stops_the_pipeline():
+    writer = FailingWriter()
+    done = []
+
+    def source(pipeline):
+        # More tasks than the queues hold: a dead writer thread would block the producer here.
+        for i in range(50):
+            pipeline.submit(SplitTask(source_key=f"docs:{i}", metadata={}, text=f"page {i}", on_done=done.append))
+
+    pipeline = IngestPipeline(writer, split_workers=1, queue_size=2, flush_interval=0.01)
+    with pytest.raises(RuntimeError, match="chroma is down"):
+        pipeline.run([source], source_workers=1)
+    assert done == []
+    assert pipeline.stats["write_errors"] == 1
+
+
+def test_a_failing_completion_callback_stops_the_pipeline():
+    def on_done(ok):
+        raise ValueError("cannot save state")
+
+    def source(pipeline):
+        pipeline.submit(SplitTask(source_key="docs:page", metadata={}, text="page", on_done=on_done))
+
+    with pytest.raises(RuntimeError, match="cannot save state"):
+        IngestPipeline(RecordingWriter(), split_workers=1).run([source], source_workers=1)
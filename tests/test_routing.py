@@ -0,0 +1,55 @@
+import pytest
+
+from app.retrieval import routed_search
+from app.routing import Route, find_symbol, route_query
+from benchmarks.fakes import InMemoryCollection
+
+
+@pytest.mark.parametrize("query, symbol", [
+    ("where is sensor_init defined?", "sensor_init"),
+    ("what does CONFIG_SENSOR do", "CONFIG_SENSOR"),
+    ("what calls main()?", "main"),
+    ("what does the macro `MAX` expand to", "MAX"),
+    ("function getFrameRate returns what", "getFrameRate"),
+])
+def test_symbol_lookups(query, symbol):
+    route = route_query(query)
+    assert route.name == "symbol"
+    assert route.symbol == symbol
+
+
+@pytest.mark.parametrize("query, route_name", [
+    ("what is the target of the build", "general"),
+    ("which method to flash the camera", "general"),
+    ("define to enable wifi", "general"),
+    ("is there a variable bitrate mode", "general"),
+    ("how do I flash the firmware", "howto"),
+])
+def test_plain_english_is_not_a_symbol(query, route_name):
+    assert find_symbol(query) is None
+    assert route_query(query).name == route_name
+
+
+def collection():
+    records = InMemoryCollection()
+    records.upsert(
+        ids=["code", "docs"],
+        documents=["int sensor_init(void) { return 0; }", "To enable wifi, load the wlan driver."],
+        metadatas=[{"source": "github", "kind": "code", "language": "c", "symbols": "sensor_init"},
+                   {"source": "docs", "kind": "docs"}],
+    )
+    return records
+
+
+def test_symbol_route_ranks_the_definition_first():
+    results = routed_search(collection(), None, "sensor_init", Route("symbol", where={"kind": "code"},
+                                                                     symbol="sensor_init"))
+    assert results["route"] == "symbol"
+    assert results["ids"][0] == "code"
+
+
+def test_symbol_route_without_a_definition_searches_everything():
+    route = Route("symbol", where={"kind": "code"}, symbol="wifi_enable")
+    results = routed_search(collection(), None, "enable wifi", route)
+    assert results["route"] == "general"
+    assert "docs" in results["ids"]
@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+
+import app.main as main
+import app.scrape_worker as scrape_worker
+from app.scrape_jobs import claim_job, enqueue_job, get_job
+
+
+def scrape_results(monkeypatch, *results):
+    """Makes scrape_chat return (or raise) each of results in turn."""
+    results = list(results)
+
+    async def scrape_chat(client, chat_id, direction, limit, on_progress):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return dict({"fetched": 0, "inserted": 0, "duplicates": 0, "skipped": 0, "newest_id": 10,
+                     "oldest_id": 1, "backfill_complete": False}, **result)
+
+    monkeypatch.setattr(scrape_worker, "scrape_chat", scrape_chat)
+
+
+async def run_next_job():
+    job = await claim_job()
+    await scrape_worker.run_job(None, job)
+    # Makes the requeued job runnable right away.
+    await scrape_worker.database.execute("UPDATE scrape_jobs SET run_after = now()")
+    return await get_job(job["id"])
+
+
+def test_flood_waits_do_not_use_up_attempts(monkeypatch, run_with_database):
+    monkeypatch.setattr(scrape_worker, "SCRAPE_JOB_MAX_ATTEMPTS", 2)
+    scrape_results(monkeypatch, {"retry_after": 60}, {"retry_after": 60}, {"retry_after": 60},
+                   ConnectionError("telegram is down"), {"retry_after": None})
+
+    async def scenario():
+        job, _ = await enqueue_job(100, "newer")
+        for _ in range(3):
+            job = await run_next_job()
+            assert (job["status"], job["failed_attempts"], job["error"]) == ("queued", 0, None)
+            assert job["progress"]["flood_wait_until"]
+
+        job = await run_next_job()
+        assert (job["status"], job["failed_attempts"], job["error"]) == ("queued", 1, "telegram is down")
+        job = await run_next_job()
+        assert (job["status"], job["attempts"], job["failed_attempts"]) == ("done", 5, 1)
+
+    run_with_database(scenario)
+
+
+def test_a_job_fails_after_its_error_attempts(monkeypatch, run_with_database):
+    monkeypatch.setattr(scrape_worker, "SCRAPE_JOB_MAX_ATTEMPTS", 2)
+    scrape_results(monkeypatch, ConnectionError("first"), {"retry_after": 60}, ConnectionError("second"))
+
+    async def scenario():
+        await enqueue_job(100, "older")
+        statuses = [(job["status"], job["failed_attempts"]) for job in [await run_next_job() for _ in range(3)]]
+        assert statuses == [("queued", 1), ("queued", 1), ("failed", 2)]
+
+    run_with_database(scenario)
+
+
+def test_an_unknown_direction_is_rejected():
+    async def post():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/chats/100/scrape", params={"direction": "sideways"})
+
+    response = asyncio.run(post())
+    assert response.status_code == 400
+    assert "direction" in response.json()["detail"]
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import app.scraper as scraper
+from app.scraper import NEWER, OLDER, scrape_chat
+
+
+class FakeClient:
+    """Serves a chat's history through the iter_messages arguments scrape_chat uses."""
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.calls = []
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, reverse=False):
+        self.calls.append({"min_id": min_id, "max_id": max_id, "reverse": reverse})
+        ids = [i for i in self.ids if i > min_id and (not max_id or i < max_id)]
+        for message_id in (ids if reverse else ids[::-1])[:limit]:
+            yield SimpleNamespace(id=message_id, date=datetime(2024, 5, 1, tzinfo=timezone.utc),
+                                  message=f"message {message_id}", sender_id=7, media=None)
+
+
+class FakeStore:
+    """The watermark and save functions of app.db, kept in memory."""
+
+    def __init__(self):
+        self.saved = []
+        self.progress = None
+
+    async def get_scrape_progress(self, chat_id):
+        return dict(self.progress) if self.progress else None
+
+    async def save_message_batch(self, messages, chat_id, backfill_complete=False):
+        self.saved.extend(message["id"] for message in messages)
+        ids = [message["id"] for message in messages]
+        if ids:
+            progress = self.progress or {"newest_id": max(ids), "oldest_id": min(ids), "backfill_complete": False}
+            progress["newest_id"] = max(progress["newest_id"], *ids)
+            progress["oldest_id"] = min(progress["oldest_id"], *ids)
+            self.progress = progress
+        if backfill_complete and self.progress:
+            self.progress["backfill_complete"] = True
+        return {"inserted": len(messages), "duplicates": 0, "skipped": 0}
+
+
+def scrape(monkeypatch, client, store, **kwargs):
+    async def resolve_channel(client, chat):
+        return chat
+
+    monkeypatch.setattr(scraper, "resolve_channel", resolve_channel)
+    monkeypatch.setattr(scraper, "get_scrape_progress", store.get_scrape_progress)
+    monkeypatch.setattr(scraper, "save_message_batch", store.save_message_batch)
+    return asyncio.run(scrape_chat(client, 100, batch_size=2, **kwargs))
+
+
+def test_first_scrape_starts_from_the_newest_message(monkeypatch):
+    store = FakeStore()
+    stats = scrape(monkeypatch, FakeClient(range(1, 11)), store, direction=NEWER, limit=4)
+
+    assert store.saved == [10, 9, 8, 7]
+    assert (stats["newest_id"], stats["oldest_id"], stats["backfill_complete"]) == (10, 7, False)
+
+
+def test_newer_fetches_only_above_the_watermark(monkeypatch):
+    store = FakeStore()
+    store.progress = {"newest_id": 10, "oldest_id": 7, "backfill_complete": False}
+    client = FakeClient(range(1, 14))
+    stats = scrape(monkeypatch, client, store, direction=NEWER)
+
+    assert store.saved == [11, 12, 13]
+    assert client.calls == [{"min_id": 10, "max_id": 0, "reverse": True}]
+    assert stats["inserted"] == 3
+
+
+def test_older_backfills_until_the_history_runs_out(monkeypatch):
+    store = FakeStore()
+    store.progress = {"newest_id": 10, "oldest_id": 7, "backfill_complete": False}
+    stats = scrape(monkeypatch, FakeClient(range(1, 11)), store, direction=OLDER)
+
+    assert store.saved == [6, 5, 4, 3, 2, 1]
+    assert stats["backfill_complete"] is True
+    assert scrape(monkeypatch, FakeClient(range(1, 11)), store, direction=OLDER)["fetched"] == 0
@@ -0,0 +1,43 @@
+import pytest
+
+from app.sessions import ChatSession, Turn, is_follow_up, standalone_query
+
+
+@pytest.mark.parametrize("query", [
+    "what about gk7205?",
+    "And on hi3516ev300?",
+    "Does it support h265?",
+    "how do I configure it?",
+    "how do I flash this?",
+    "is that the same for majestic?",
+    "why?",
+])
+def test_follow_ups(query):
+    assert is_follow_up(query)
+
+
+@pytest.mark.parametrize("query", [
+    "What is majestic?",
+    "How does this camera boot?",
+    "Is there a wifi driver for ssc338q?",
+    "Is it possible to flash firmware over uart?",
+    "Why does majestic crash on boot?",
+    "how to build firmware",
+    "wifi",
+])
+def test_standalone_questions(query):
+    assert not is_follow_up(query)
+
+
+def test_follow_ups_keep_the_topic():
+    session = ChatSession(id="0" * 32)
+    assert standalone_query("what about gk7205?", session) == "what about gk7205?"
+
+    topic = "how do I enable wifi"
+    session.turns.append(Turn(topic, topic, "..."))
+    first = standalone_query("what about gk7205?", session)
+    assert first == "how do I enable wifi what about gk7205?"
+
+    session.turns.append(Turn("what about gk7205?", first, "..."))
+    assert standalone_query("and ssc338q?", session) == "how do I enable wifi and ssc338q?"
+    assert standalone_query("What is majestic?", session) == "What is majestic?"
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.telegram_source import conversation_windows
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def row(chat_id, message_id, minutes, text="hi"):
+    return {"chat_id": chat_id, "id": message_id, "sender_id": 7, "date": START + timedelta(minutes=minutes),
+            "text": text, "chat_name": "firmware"}
+
+
+def windows(rows, watermarks=None, **kwargs):
+    async def rows_iter():
+        for r in rows:
+            yield r
+
+    async def collect():
+        return [(w, last) async for w, last in conversation_windows(rows_iter(), watermarks or {}, **kwargs)]
+
+    return asyncio.run(collect())
+
+
+def test_pauses_and_chats_split_windows():
+    result = windows([row(1, 1, 0), row(1, 2, 5), row(1, 3, 60), row(2, 4, 61)])
+
+    assert [[m["id"] for m in w.messages] for w, _ in result] == [[1, 2], [3], [4]]
+    assert [last for _, last in result] == [False, True, True]
+    assert [w.source_key for w, _ in result] == ["telegram:1:1", "telegram:1:3", "telegram:2:4"]
+    assert result[0][0].metadata["message_count"] == 2
+
+
+def test_long_windows_are_split_by_size():
+    result = windows([row(1, i, i, text="x" * 50) for i in range(1, 5)], max_chars=150)
+    assert [len(w.messages) for w, _ in result] == [2, 2]
+
+
+def test_windows_do_not_span_the_ingested_range():
+    # Messages 2..3 were ingested already; a backfilled 1 and a new 4 stay apart.
+    watermarks = {"1": {"low": [(START + timedelta(minutes=2)).isoformat(), 2],
+                        "high": [(START + timedelta(minutes=3)).isoformat(), 3]}}
+    result = windows([row(1, 1, 1), row(1, 4, 4)], watermarks)
+    assert [[m["id"] for m in w.messages] for w, _ in result] == [[1], [4]]
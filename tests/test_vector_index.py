@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from app.vector_index import VectorSnapshot, VectorSnapshotFile, export_snapshot
+
+
+def random_page(rows=200, dimension=32, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(rows, dimension)).astype(np.float32)
+    ids = [f"c{i}" for i in range(rows)]
+    documents = [f"document {i}" for i in range(rows)]
+    metadatas = [{"source": "docs" if i % 2 else "github", "n": i} for i in range(rows)]
+    return ids, embeddings, documents, metadatas
+
+
+def exact_ranking(embeddings, query, k):
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return list(np.argsort(-(unit @ query))[:k])
+
+
+def test_int8_ranking_matches_float32(tmp_path):
+    page = random_page()
+    path, rows = export_snapshot([page], str(tmp_path), version="v1", dtype="int8")
+    snapshot = VectorSnapshot(path)
+    assert rows == len(snapshot) == 200
+    assert snapshot.version == "v1"
+
+    query = page[1][7] / np.linalg.norm(page[1][7])
+    top = snapshot.search(query, k=10)
+    assert top[0][0] == 7
+    assert abs(top[0][1] - 1.0) < 0.02
+    # Quantization may swap near-ties, but the top results are the same chunks.
+    assert len({row for row, _ in top} & set(exact_ranking(page[1], query, 10))) >= 8
+
+
+def test_records_and_embeddings_round_trip(tmp_path):
+    ids, embeddings, documents, metadatas = random_page(rows=5)
+    path, _ = export_snapshot([(ids[:3], embeddings[:3], documents[:3], metadatas[:3]),
+                               (ids[3:], embeddings[3:], documents[3:], metadatas[3:])],
+                              str(tmp_path), dtype="float16")
+    snapshot = VectorSnapshot(path)
+    row = snapshot.row_of("c4")
+    assert row == 4
+    assert snapshot.record(row) == {"document": "document 4", "metadata": metadatas[4]}
+    expected = embeddings[4] / np.linalg.norm(embeddings[4])
+    assert np.allclose(snapshot.embedding(row), expected, atol=1e-2)
+
+
+def test_new_snapshots_are_picked_up_and_old_ones_pruned(tmp_path):
+    base_dir = str(tmp_path)
+    snapshots = VectorSnapshotFile(base_dir, check_interval=0)
+    assert snapshots.get() is None
+
+    export_snapshot([random_page(rows=3)], base_dir, version="v1")
+    assert snapshots.get().version == "v1"
+    for version in ("v2", "v3"):
+        export_snapshot([random_page(rows=4)], base_dir, version=version)
+    assert snapshots.get().version == "v3"
+    assert len([name for name in os.listdir(base_dir) if name.startswith("snapshot-")]) == 2
+
+
+def test_search_within_a_filter(tmp_path):
+    page = random_page()
+    path, _ = export_snapshot([page], str(tmp_path))
+    snapshot = VectorSnapshot(path)
+    query = page[1][8] / np.linalg.norm(page[1][8])
+    top = snapshot.search(query, k=10, where={"source": "docs"})
+    assert len(top) == 10
+    assert all(row % 2 for row, _ in top)
+    assert top[0][0] != 8  # row 8 is a github chunk
+    assert snapshot.search(query, k=5, where={"source": "telegram"}) == []
@@ -0,0 +1,163 @@
+import pytest
+
+from app.vector_writer import ChunkLedger, VectorWriter, chunk_id
+
+
+class RecordingCollection:
+    """A Chroma collection stand-in that keeps the records and logs every write."""
+
+    def __init__(self):
+        self.records = {}
+        self.calls = []
+        self.fail = False
+
+    def _log(self, operation, ids):
+        if self.fail:
+            raise ConnectionError("chroma is down")
+        self.calls.append((operation, list(ids)))
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        self._log("upsert", ids)
+        for cid, document, metadata in zip(ids, documents, metadatas):
+            self.records[cid] = {"document": document, "metadata": metadata}
+
+    def update(self, ids, metadatas):
+        self._log("update", ids)
+        for cid, metadata in zip(ids, metadatas):
+            self.records[cid]["metadata"] = metadata
+
+    def delete(self, ids):
+        self._log("delete", ids)
+        for cid in ids:
+            self.records.pop(cid, None)
+
+    def get(self, include=None, limit=None, offset=0, ids=None):
+        selected = list(self.records)[offset:offset + limit if limit is not None else None]
+        return {"ids": selected}
+
+
+@pytest.fixture
+def collection():
+    return RecordingCollection()
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return ChunkLedger(str(tmp_path / "chunks.db"))
+
+
+def writer_for(collection, ledger):
+    return VectorWriter(collection, ledger, batch_size=1000, backoff_seconds=0, max_retries=0)
+
+
+def test_identical_chunks_are_stored_once(collection, ledger):
+    writer = writer_for(collection, ledger)
+    done = []
+    writer.write_source("github:a:LICENSE", {"source": "github"}, ["MIT license", "a only"], on_done=done.append)
+    writer.write_source("github:b:LICENSE", {"source": "github"}, ["MIT license"], on_done=done.append)
+    writer.flush()
+
+    assert done == [True, True]
+    assert collection.calls == [("upsert", [chunk_id("MIT license"), chunk_id("a only")])]
+    assert writer.stats["chunks_added"] == 2
+    assert writer.stats["chunks_deduplicated"] == 1
+    metadata = collection.records[chunk_id("MIT license")]["metadata"]
+    assert metadata["location_count"] == 2
+    assert metadata["locations"] == "github:a:LICENSE\ngithub:b:LICENSE"
+
+
+def test_a_chunk_is_deleted_with_its_last_location(collection, ledger):
+    writer = writer_for(collection, ledger)
+    writer.write_source("github:a:LICENSE", {}, ["MIT license"])
+    writer.write_source("github:b:LICENSE", {}, ["MIT license"])
+    writer.flush()
+
+    writer.remove_source(source_key="github:a:LICENSE")
+    writer.flush()
+    assert collection.calls[-1] == ("update", [chunk_id("MIT license")])
+    assert collection.records[chunk_id("MIT license")]["metadata"]["location_count"] == 1
+
+    writer.write_source("github:b:LICENSE", {}, ["Apache license"])
+    writer.flush()
+    assert chunk_id("MIT license") not in collection.records
+    assert writer.stats["chunks_deleted"] == 1
+
+
+def test_a_failed_batch_leaves_no_trace_in_the_ledger(collection, ledger):
+    writer = writer_for(collection, ledger)
+    collection.fail = True
+    done = []
+    writer.write_source("docs:page", {}, ["some text"], on_done=done.append)
+    writer.flush()
+
+    assert done == [False]
+    assert ledger.chunk_ids("docs:page") == []
+    assert not ledger.is_stored(chunk_id("some text"))
+
+    collection.fail = False
+    writer.write_source("docs:page", {}, ["some text"], on_done=done.append)
+    writer.flush()
+    assert done == [False, True]
+    assert chunk_id("some text") in collection.records
+
+
+def test_chunks_know_their_source_and_position(collection, ledger):
+    writer = writer_for(collection, ledger)
+    writer.write_source("github:a:main.c", {"source": "github"}, ["first", "second"])
+    writer.flush()
+    metadata = collection.records[chunk_id("second")]["metadata"]
+    assert metadata["source_key"] == "github:a:main.c"
+    assert metadata["chunk_index"] == 1
+
+
+def test_garbage_collection_deletes_vectors_the_ledger_does_not_know(collection, ledger):
+    writer = writer_for(collection, ledger)
+    writer.write_source("github:a:main.c", {}, ["kept"])
+    writer.flush()
+    collection.records["github_a_main.c_0"] = {"document": "old id scheme", "metadata": {}}
+    collection.records[chunk_id("interrupted run")] = {"document": "interrupted run", "metadata": {}}
+
+    report = writer.collect_garbage(page_size=2)
+    assert report == {"vectors_scanned": 3, "orphans_deleted": 2, "missing_from_collection": 0}
+    assert list(collection.records) == [chunk_id("kept")]
+
+
+def test_chunk_metadata_adds_to_the_source_metadata(collection, ledger):
+    writer = writer_for(collection, ledger)
+    writer.write_source("github:a:main.c", {"source": "github"}, ["int main(void);"],
+                        chunk_metadatas=[{"language": "c", "symbols": "main"}])
+    writer.flush()
+    metadata = collection.records[chunk_id("int main(void);")]["metadata"]
+    assert metadata["source"] == "github"
+    assert metadata["symbols"] == "main"
+    assert metadata["language"] == "c"
+
+
+def test_rewriting_an_unchanged_source_writes_nothing(collection, ledger):
+    writer = writer_for(collection, ledger)
+    window = ("telegram:1:10", {"source": "telegram", "message_count": 2}, ["[12:00] user 7: hi"])
+    writer.write_source(*window)
+    writer.flush()
+    calls, stats = list(collection.calls), dict(writer.stats)
+
+    done = []
+    writer.write_source(*window, on_done=done.append)
+    writer.flush()
+
+    assert done == [True]
+    assert collection.calls == calls
+    assert writer.stats["sources_unchanged"] == 1
+    for key in ("chunks_added", "chunks_deleted", "chunks_relabelled", "batches_written"):
+        assert writer.stats[key] == stats[key]
+
+
+def test_new_source_metadata_relabels_its_chunks(collection, ledger):
+    writer = writer_for(collection, ledger)
+    writer.write_source("telegram:1:10", {"message_count": 1}, ["hi"])
+    writer.flush()
+    writer.write_source("telegram:1:10", {"message_count": 2}, ["hi"])
+    writer.flush()
+
+    assert collection.calls[-1] == ("update", [chunk_id("hi")])
+    assert writer.stats["chunks_relabelled"] == 1
+    assert collection.records[chunk_id("hi")]["metadata"]["message_count"] == 2